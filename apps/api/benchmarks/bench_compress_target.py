@@ -0,0 +1,106 @@
+"""
+Target-size compression benchmark: how close the predicted size comes to
+the achieved one, and what it costs next to searching for a CRF with full
+encodes.
+
+For every fixture and target (a share of the source size) it times
+compress_to_target with 'vbr' and '2pass', and a bisection over integer
+CRFs that re-encodes the whole file until the largest output under the
+target is found, which is what a client without target support has to do.
+
+    cd apps/api && python -m benchmarks.bench_compress_target --ratios 0.15 0.35
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.fixtures import DEFAULT_DIR, fixture, working_copy
+from benchmarks.report import emit
+
+FIXTURES = ("video_480p_10s.mp4", "video_720p_30s.mp4")
+
+
+def crf_search(service, path: str, target_bytes: int, low: int = 18, high: int = 51) -> dict:
+    """Bisect integer CRFs with full encodes; returns the best fit and the number of encodes"""
+    best, encodes = None, 0
+    while low <= high:
+        crf = (low + high) // 2
+        size = os.path.getsize(service.compress_video(path, crf)["path"])
+        encodes += 1
+        if size <= target_bytes:
+            best = {"crf": crf, "size_bytes": size}
+            high = crf - 1
+        else:
+            low = crf + 1
+    return {"encodes": encodes, **(best or {"crf": None, "size_bytes": None})}
+
+
+def run_target(service, uploads: str, fixtures_dir: str, name: str, ratio: float, methods: list) -> list:
+    target_bytes = int(os.path.getsize(fixture(name, fixtures_dir)) * ratio)
+    results = []
+    for method in methods:
+        path = working_copy(name, uploads, fixtures_dir)
+        start = time.perf_counter()
+        if method == "crf_search":
+            outcome = crf_search(service, path, target_bytes)
+            size = outcome["size_bytes"]
+            entry = {"crf": outcome["crf"], "encodes": outcome["encodes"]}
+        else:
+            outcome = service.compress_to_target(path, target_bytes=target_bytes, method=method, allow_downscale=True)
+            size = outcome["size_bytes"]
+            entry = {
+                "crf": outcome["crf"],
+                "predicted_bytes": outcome["predicted_bytes"],
+                "prediction_error_percent": outcome["prediction_error_percent"],
+                "resolution": f"{outcome['width']}x{outcome['height']}",
+                "attempts": outcome["attempts"],
+            }
+        elapsed = time.perf_counter() - start
+        os.remove(path)
+        results.append({
+            "fixture": name,
+            "ratio": ratio,
+            "method": method,
+            "target_bytes": target_bytes,
+            "size_bytes": size,
+            "target_met": size is not None and size <= target_bytes,
+            "fill_percent": round(size / target_bytes * 100, 1) if size else None,
+            "elapsed_s": round(elapsed, 3),
+            **entry,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", nargs="+", default=list(FIXTURES))
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.15, 0.35],
+                        help="targets as a share of each fixture's size")
+    parser.add_argument("--methods", nargs="+", choices=("vbr", "2pass", "crf_search"),
+                        default=["vbr", "2pass", "crf_search"])
+    parser.add_argument("--fixtures-dir", default=DEFAULT_DIR)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    for name in args.fixtures:
+        fixture(name, args.fixtures_dir)
+
+    storage = tempfile.mkdtemp(prefix="bench-compress-")
+    try:
+        from services.media_service import MediaService
+        service = MediaService(storage_path=storage)
+        uploads = os.path.join(storage, "uploads")
+        results = []
+        for name in args.fixtures:
+            for ratio in args.ratios:
+                results.extend(run_target(service, uploads, args.fixtures_dir, name, ratio, args.methods))
+    finally:
+        shutil.rmtree(storage, ignore_errors=True)
+
+    emit("compress_target", results, args.output, ratios=args.ratios)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Diff benchmark: difflib.HtmlDiff (the old /text/diff) vs the patience engine.
+
+Inputs are synthetic source-like files with a given share of lines edited,
+inserted or deleted. Every run happens in a fresh process with a time limit,
+because HtmlDiff can take minutes on large, heavily edited inputs.
+
+    cd apps/api && python -m benchmarks.bench_diff --lines 10000 50000 100000 --change 0.01 0.2 0.9
+"""
+import argparse
+import difflib
+import json
+import multiprocessing
+import random
+import time
+
+from services.diff_service import diff_service
+
+
+def make_texts(lines: int, change: float, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["value", "count", "index", "result", "items", "config", "self", "return", "for", "if"]
+    old = [
+        f"{'    ' * rng.randint(0, 3)}{rng.choice(words)} = {rng.choice(words)}({rng.randint(0, 999)})"
+        for _ in range(lines)
+    ]
+    new = []
+    for line in old:
+        roll = rng.random()
+        if roll < change / 3:
+            continue
+        if roll < 2 * change / 3:
+            new.append(line.replace("=", "+=", 1))
+        else:
+            new.append(line)
+        if rng.random() < change / 3:
+            new.append(f"    {rng.choice(words)}.{rng.choice(words)}()")
+    return "\n".join(old), "\n".join(new)
+
+
+def _htmldiff(text1: str, text2: str):
+    return difflib.HtmlDiff().make_file(text1.splitlines(), text2.splitlines())
+
+
+VARIANTS = {
+    "difflib_htmldiff": _htmldiff,
+    "patience_html": lambda a, b: diff_service.diff(a, b, "html")["data"],
+    "patience_unified": lambda a, b: diff_service.diff(a, b, "unified")["data"],
+    "patience_json": lambda a, b: json.dumps(diff_service.diff(a, b, "json")["data"]),
+}
+
+
+def _child(variant: str, lines: int, change: float, queue):
+    text1, text2 = make_texts(lines, change)
+    start = time.perf_counter()
+    output = VARIANTS[variant](text1, text2)
+    queue.put((time.perf_counter() - start, len(output)))
+
+
+def run_variant(variant: str, lines: int, change: float, timeout: float) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(variant, lines, change, queue))
+    proc.start()
+    proc.join(timeout)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+        return {"variant": variant, "lines": lines, "change": change, "seconds": None, "timed_out": True}
+    elapsed, output_size = queue.get()
+    return {
+        "variant": variant,
+        "lines": lines,
+        "change": change,
+        "seconds": round(elapsed, 3),
+        "output_kb": round(output_size / 1024, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--change", type=float, nargs="+", default=[0.01, 0.2, 0.9])
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per run")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    args = parser.parse_args(argv)
+
+    results = []
+    for lines in args.lines:
+        for change in args.change:
+            for variant in args.variants:
+                results.append(run_variant(variant, lines, change, args.timeout))
+
+    print(json.dumps({"benchmark": "diff", "timeout_s": args.timeout, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
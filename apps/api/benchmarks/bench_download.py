@@ -0,0 +1,111 @@
+"""
+Download benchmark: HLS fragment fetching, sequential vs concurrent.
+
+Serves a generated fMP4 HLS stream from a local HTTP server that adds a
+fixed latency to every request, standing in for a remote CDN, and downloads
+it through YouTubeService with different concurrent_fragment_downloads.
+
+    cd apps/api && python -m benchmarks.bench_download --segments 40 --latency 0.1
+"""
+import argparse
+import functools
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from core.config import settings
+from services.youtube_service import YouTubeService
+
+
+def make_hls(out_dir: str, segments: int, segment_seconds: float):
+    # fMP4 segments; the encoder is forced to cut a keyframe at every boundary
+    duration = segments * segment_seconds
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+        "-c:a", "aac", "-shortest",
+        "-f", "hls", "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4", "-hls_segment_filename", os.path.join(out_dir, "seg%03d.m4s"),
+        os.path.join(out_dir, "stream.m3u8"),
+    ], check=True)
+
+
+class SlowHandler(SimpleHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory: str, latency: float):
+    handler = type("Handler", (SlowHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_variant(url: str, fragments: int, out_dir: str, repeat: int) -> dict:
+    settings.YTDLP_CONCURRENT_FRAGMENTS = fragments
+    service = YouTubeService(
+        download_path=os.path.join(out_dir, "downloads"),
+        work_path=os.path.join(out_dir, "work"),
+    )
+    timings = []
+    for _ in range(repeat):
+        # Bypass the metadata cache so every run does the same work
+        service.forget_info(url)
+        start = time.perf_counter()
+        result = service.download_video(url, "mp4", "best")
+        timings.append(time.perf_counter() - start)
+        os.remove(result["path"])
+    return {
+        "concurrent_fragments": fragments,
+        "median_s": round(statistics.median(timings), 4),
+        "min_s": round(min(timings), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=40)
+    parser.add_argument("--segment-seconds", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds added to every HTTP request")
+    parser.add_argument("--fragments", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        media_dir = os.path.join(tmp, "media")
+        os.makedirs(media_dir)
+        make_hls(media_dir, args.segments, args.segment_seconds)
+        server = serve(media_dir, args.latency)
+        url = f"http://127.0.0.1:{server.server_address[1]}/stream.m3u8"
+        try:
+            results = [run_variant(url, fragments, tmp, args.repeat) for fragments in args.fragments]
+        finally:
+            server.shutdown()
+
+    baseline = results[0]
+    for result in results[1:]:
+        result["speedup"] = round(baseline["median_s"] / result["median_s"], 2)
+
+    print(json.dumps({
+        "benchmark": "download",
+        "source": {"type": "hls-fmp4", "segments": args.segments, "latency_s": args.latency},
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
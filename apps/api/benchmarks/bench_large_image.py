@@ -0,0 +1,219 @@
+"""
+Large-image benchmark and peak-RSS regression check: the Pillow path vs
+the streamed (libvips) path of ImageService.process_image, per operation,
+image size and input format.
+
+Each run is a fresh spawned process, so its peaks are its own. The
+'pillow' engine runs with an unlimited memory budget and the 'vips' engine
+with --budget-mb, which sends every input that Pillow can't shrink on load
+under the budget to the streamed path. Besides peak RSS, private memory
+(RssAnon) is sampled on Linux: rotations read a disc-backed decode through
+mmap, whose pages count towards RSS but are page cache the kernel can
+reclaim, not memory a worker can run out of.
+
+With --check the run fails (exit status 1) when a budgeted run peaks above
+--max-mb of private memory, or when that peak grows by more than
+--max-growth from the smallest to the largest size it was streamed at:
+streamed memory must not follow the image's area.
+
+Test images are generated with libvips when it is installed (a strip at a
+time), otherwise with Pillow.
+
+    cd apps/api && python -m benchmarks.bench_large_image --megapixels 25 100 --check
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.report import emit
+
+FORMATS = {"jpeg": ".jpg", "png": ".png", "tiff": ".tif"}
+
+# name -> (operations for a width x height input, output format or None to keep the input's)
+CASES = {
+    "resize_quarter": (lambda w, h: [{"op": "resize", "width": w // 4, "height": h // 4}], None),
+    "thumbnail_512": (lambda w, h: [{"op": "thumbnail", "width": 512, "height": 512}], None),
+    "rotate_90": (lambda w, h: [{"op": "rotate", "degrees": 90}], None),
+    "grayscale": (lambda w, h: [{"op": "grayscale"}], None),
+    "convert_jpeg": (lambda w, h: [{"op": "convert"}], "JPEG"),
+}
+
+UNLIMITED_MB = 1024 * 1024
+
+
+def make_image(path: str, megapixels: float):
+    """Gradient plus noise, 3:2, so encoders can't cheat on flat areas"""
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    try:
+        import pyvips
+    except ImportError:
+        pyvips = None
+
+    if pyvips is not None:
+        gradient = (pyvips.Image.xyz(width, height)[0] * (255 / width)).cast("uchar")
+        noise = pyvips.Image.gaussnoise(width, height, sigma=40, mean=128).cast("uchar")
+        image = gradient.bandjoin([noise, gradient.flip("horizontal")]).copy(interpretation="srgb")
+        options = {".jpg": {"Q": 90}, ".png": {"compression": 1}, ".tif": {}}[os.path.splitext(path)[1]]
+        image.write_to_file(path, **options)
+    else:
+        from PIL import Image
+        Image.MAX_IMAGE_PIXELS = None
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 40)
+        image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+        image.save(path, quality=90, compress_level=1)
+    return width, height
+
+
+def _anon_mb():
+    """Private resident memory of this process (Linux), or None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class _AnonPeak(threading.Thread):
+    """Samples RssAnon until stopped; there is no kernel high-water mark for it"""
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _anon_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, _anon_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def _child(engine: str, budget_mb: int, path: str, storage: str, case: str, queue):
+    # Settings are read on import, so the environment has to be in place first
+    os.environ["IMAGE_MEMORY_BUDGET_MB"] = str(UNLIMITED_MB if engine == "pillow" else budget_mb)
+    os.environ["STORAGE_PATH"] = storage
+    from PIL import Image
+    from services.image_service import ImageService
+
+    with Image.open(path) as img:
+        width, height = img.size
+    build, target_format = CASES[case]
+    params = {"format": target_format} if target_format else {}
+    sampler = _AnonPeak() if _anon_mb() is not None else None
+    if sampler:
+        sampler.start()
+    try:
+        start = time.perf_counter()
+        result = ImageService(storage_path=storage).process_image(path, "pipeline", params, build(width, height))
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        queue.put({"error": str(e)[-500:]})
+        return
+    finally:
+        anon_mb = sampler.stop() if sampler else None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    queue.put({"elapsed": elapsed, "peak_rss_mb": peak_mb, "peak_anon_mb": anon_mb, "engine_used": result["engine"]})
+    os.remove(result["path"])
+
+
+def run(engine: str, budget_mb: int, path: str, storage: str, case: str) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(engine, budget_mb, path, storage, case, queue))
+    proc.start()
+    proc.join()
+    if queue.empty():
+        # Killed, most likely by the OOM killer
+        return {"error": f"process exited with code {proc.exitcode}"}
+    outcome = queue.get()
+    if "error" in outcome:
+        return outcome
+    anon_mb = outcome["peak_anon_mb"]
+    return {
+        "elapsed_s": round(outcome["elapsed"], 3),
+        "peak_rss_mb": round(outcome["peak_rss_mb"], 1),
+        "peak_anon_mb": round(anon_mb, 1) if anon_mb is not None else None,
+        "engine_used": outcome["engine_used"],
+    }
+
+
+def check(results: list, max_mb: float, max_growth: float) -> list:
+    """Regressions among the budgeted runs; private memory where it was sampled, else peak RSS"""
+    failures = []
+    budgeted = [result for result in results if result["engine"] == "vips"]
+    series = {}
+    for result in budgeted:
+        label = f"{result['case']} {result['format']} {result['megapixels']:g} MP"
+        if "error" in result:
+            failures.append(f"{label}: {result['error']}")
+            continue
+        peak = result["peak_anon_mb"] or result["peak_rss_mb"]
+        if peak > max_mb:
+            failures.append(f"{label}: peak {peak} MB is over {max_mb} MB ({result['engine_used']})")
+        # Runs Pillow could shrink on load under the budget grow with the image up to the budget
+        if result["engine_used"] == "vips":
+            series.setdefault((result["case"], result["format"]), []).append((result["megapixels"], peak))
+
+    for (case, fmt), runs in series.items():
+        runs.sort()
+        (smallest, first), (largest, last) = runs[0], runs[-1]
+        if largest > smallest and last / first - 1 > max_growth:
+            failures.append(f"{case} {fmt}: peak grew {last / first - 1:.0%} from {smallest:g} MP to {largest:g} MP")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[25, 100])
+    parser.add_argument("--formats", nargs="+", choices=sorted(FORMATS), default=["jpeg", "png", "tiff"])
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--engines", nargs="+", choices=("pillow", "vips"), default=["pillow", "vips"])
+    parser.add_argument("--budget-mb", type=int, default=16, help="memory budget of the vips engine's runs")
+    parser.add_argument("--check", action="store_true", help="fail on peak-memory regressions of the budgeted runs")
+    parser.add_argument("--max-mb", type=float, default=200)
+    parser.add_argument("--max-growth", type=float, default=0.5)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="bench-large-image-")
+    results = []
+    try:
+        for megapixels in args.megapixels:
+            for fmt in args.formats:
+                path = os.path.join(work, f"input_{megapixels:g}mp{FORMATS[fmt]}")
+                make_image(path, megapixels)
+                for case in args.cases:
+                    for engine in args.engines:
+                        outcome = run(engine, args.budget_mb, path, work, case)
+                        results.append({
+                            "case": case, "format": fmt, "megapixels": megapixels, "engine": engine, **outcome
+                        })
+                os.remove(path)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    failures = check(results, args.max_mb, args.max_growth) if args.check else []
+    emit("large_image", results, args.output, budget_mb=args.budget_mb, failures=failures)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+End-to-end load test: concurrent clients drive the FastAPI app in-process
+while an in-process Celery worker runs the tasks, and every job is timed
+from submission until /tasks/{id} reports it finished.
+
+The broker and result backend are Celery's in-memory transports, so no
+broker needs to run. The app's own caches, upload index and admission
+bookkeeping still talk to Redis at --redis-url. Admission control reads
+queue depth from the broker's Redis lists, which the in-memory broker
+doesn't have, so it is switched off for the run.
+
+Uploads and texts get random trailing bytes so every job misses the result
+cache; --cache sends identical inputs to measure cache hits instead.
+
+    cd apps/api && python -m benchmarks.bench_load --scenario image_resize --clients 8 --jobs 200 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.fixtures import DEFAULT_DIR, fixture
+from benchmarks.report import emit, percentiles
+
+API = "/api/v1"
+DONE_STATES = {"SUCCESS", "FAILURE", "REVOKED"}
+
+
+def _salt(rng: random.Random, cache: bool) -> bytes:
+    return b"" if cache else rng.randbytes(16).hex().encode()
+
+
+async def image_resize(client, rng, fixtures, cache):
+    # JPEG decoders stop at the end-of-image marker, so trailing bytes are harmless
+    data = fixtures["image_2mp.jpg"] + _salt(rng, cache)
+    return await client.post(f"{API}/visual/process", files={"file": ("image.jpg", data, "image/jpeg")},
+                             data={"action": "resize", "params": '{"width": 800, "height": 450}'})
+
+
+async def media_convert(client, rng, fixtures, cache):
+    # WAV readers stop at the end of the data chunk
+    data = fixtures["audio_30s.wav"] + _salt(rng, cache)
+    return await client.post(f"{API}/media/convert", files={"file": ("audio.wav", data, "audio/wav")},
+                             data={"target_format": "mp3"})
+
+
+async def json_format(client, rng, fixtures, cache):
+    records = [{"id": index, "name": f"item {index}", "tags": ["a", "b"], "score": index / 7} for index in range(500)]
+    records.append({"salt": _salt(rng, cache).decode()})
+    return await client.post(f"{API}/text/json/format", json={"data": json.dumps(records), "sort_keys": True})
+
+
+async def text_diff(client, rng, fixtures, cache):
+    lines = [f"line {index}: the quick brown fox" for index in range(2000)]
+    changed = [line + " jumps" if index % 37 == 0 else line for index, line in enumerate(lines)]
+    salt = _salt(rng, cache).decode()
+    return await client.post(f"{API}/text/diff", json={
+        "text1": "\n".join(lines), "text2": "\n".join(changed) + salt, "format": "unified",
+    })
+
+
+async def markdown_pdf(client, rng, fixtures, cache):
+    sections = "\n\n".join(f"## Section {index}\n\nSome *text* with `code`.\n\n- one\n- two" for index in range(20))
+    source = f"# Report {_salt(rng, cache).decode()}\n\n{sections}"
+    return await client.post(f"{API}/text/markdown", json={"data": source, "target": "pdf"})
+
+
+SCENARIOS = {
+    "image_resize": image_resize,
+    "media_convert": media_convert,
+    "json_format": json_format,
+    "text_diff": text_diff,
+    "markdown_pdf": markdown_pdf,
+}
+
+
+async def _job(client, scenario, rng, fixtures, cache, poll_interval, timeout) -> dict:
+    start = time.perf_counter()
+    response = await SCENARIOS[scenario](client, rng, fixtures, cache)
+    submitted = time.perf_counter() - start
+    if response.status_code != 200:
+        return {"ok": False, "submit": submitted, "error": f"HTTP {response.status_code}"}
+    body = response.json()
+    task_id = body.get("task_id")
+    if not task_id:
+        # Answered inline
+        return {"ok": True, "submit": submitted, "latency": submitted}
+
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        status = (await client.get(f"{API}/tasks/{task_id}")).json()
+        if status["status"] in DONE_STATES:
+            ok = status["status"] == "SUCCESS"
+            return {"ok": ok, "submit": submitted, "latency": time.perf_counter() - start,
+                    "cached": body.get("cache") == "hit", "error": None if ok else status["error"]}
+        await asyncio.sleep(poll_interval)
+    return {"ok": False, "submit": submitted, "error": "timed out"}
+
+
+async def run_scenario(app, scenario: str, clients: int, jobs: int, fixtures: dict, args) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    outcomes = []
+    remaining = iter(range(jobs))
+
+    async def client_loop(client):
+        # Closed loop: each client starts its next job when the last one finishes
+        for _ in remaining:
+            outcomes.append(await _job(client, scenario, rng, fixtures, args.cache, args.poll_interval, args.timeout))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    completed = [outcome for outcome in outcomes if outcome["ok"]]
+    errors = {}
+    for outcome in outcomes:
+        if not outcome["ok"]:
+            errors[outcome["error"][:200]] = errors.get(outcome["error"][:200], 0) + 1
+    return {
+        "scenario": scenario,
+        "clients": clients,
+        "jobs": jobs,
+        "completed": len(completed),
+        "failed": len(outcomes) - len(completed),
+        "cache_hits": sum(outcome.get("cached", False) for outcome in completed),
+        "elapsed_s": round(elapsed, 3),
+        "jobs_per_s": round(len(completed) / elapsed, 2) if elapsed else None,
+        "latency_s": percentiles([outcome["latency"] for outcome in completed]),
+        "submit_s": percentiles([outcome["submit"] for outcome in outcomes]),
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable); all by default")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--jobs", type=int, default=50, help="jobs per scenario")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1, help="worker threads")
+    parser.add_argument("--cache", action="store_true", help="send identical inputs so the result cache answers")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379/1"))
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures-dir", default=DEFAULT_DIR)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    fixtures = {}
+    for name in ("image_2mp.jpg", "audio_30s.wav"):
+        with open(fixture(name, args.fixtures_dir), "rb") as f:
+            fixtures[name] = f.read()
+
+    # Settings are read at import time, so the environment goes first
+    storage = tempfile.mkdtemp(prefix="bench-load-")
+    os.environ.update({
+        "CELERY_BROKER_URL": "memory://",
+        "CELERY_RESULT_BACKEND": "cache+memory://",
+        "REDIS_URL": args.redis_url,
+        "STORAGE_PATH": storage,
+    })
+    from celery.contrib.testing.worker import start_worker
+    from core.queues import QUEUES, admission
+    from main import app
+    from worker import celery_app
+
+    admission.check = lambda *args, **kwargs: None
+
+    scenarios = args.scenario or list(SCENARIOS)
+    with start_worker(celery_app, pool="threads", concurrency=args.concurrency, perform_ping_check=False,
+                      queues=list(QUEUES), shutdown_timeout=args.timeout):
+        results = [asyncio.run(run_scenario(app, scenario, args.clients, args.jobs, fixtures, args))
+                   for scenario in scenarios]
+
+    emit("load", results, args.output, worker={"pool": "threads", "concurrency": args.concurrency},
+         cache=args.cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Resize/thumbnail benchmark: full decode + LANCZOS vs shrink-on-load.
+
+Each variant runs in a fresh process so peak RSS is measured in isolation.
+
+    cd apps/api && python -m benchmarks.bench_resize --megapixels 40 --width 800
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from services.image_service import ImageService
+
+
+def make_jpeg(path: str, megapixels: float):
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    # Gradient plus noise so the encoder can't cheat on flat areas
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(path, quality=90)
+    return width, height
+
+
+def _full_decode(path: str, out_dir: str, width: int, height: int):
+    """The pre-shrink-on-load resize path"""
+    with Image.open(path) as img:
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+        img.save(os.path.join(out_dir, "full.jpeg"), format="JPEG", quality=85)
+
+
+def _service(action: str):
+    def run(path: str, out_dir: str, width: int, height: int):
+        service = ImageService(storage_path=out_dir)
+        service.process_image(path, action, {"width": width, "height": height, "format": "JPEG"})
+    return run
+
+
+VARIANTS = {
+    "full_decode_resize": _full_decode,
+    "shrink_on_load_resize": _service("resize"),
+    "shrink_on_load_thumbnail": _service("thumbnail"),
+}
+
+
+def _child(variant: str, path: str, out_dir: str, width: int, height: int, queue):
+    start = time.perf_counter()
+    VARIANTS[variant](path, out_dir, width, height)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    queue.put((elapsed, peak_mb))
+
+
+def run_variant(variant: str, path: str, out_dir: str, width: int, height: int, repeat: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    timings, peaks = [], []
+    for _ in range(repeat):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_child, args=(variant, path, out_dir, width, height, queue))
+        proc.start()
+        elapsed, peak_mb = queue.get()
+        proc.join()
+        timings.append(elapsed)
+        peaks.append(peak_mb)
+    return {
+        "variant": variant,
+        "median_s": round(statistics.median(timings), 4),
+        "min_s": round(min(timings), 4),
+        "peak_rss_mb": round(max(peaks), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=40)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.jpeg")
+        # Generate in a child: ru_maxrss survives fork+exec, so a bloated
+        # parent would inflate every variant's peak RSS
+        ctx = multiprocessing.get_context("spawn")
+        proc = ctx.Process(target=make_jpeg, args=(source, args.megapixels))
+        proc.start()
+        proc.join()
+        with Image.open(source) as img:
+            src_width, src_height = img.size
+        height = round(args.width * src_height / src_width)
+
+        results = [run_variant(variant, source, tmp, args.width, height, args.repeat) for variant in VARIANTS]
+
+    baseline = results[0]
+    for result in results[1:]:
+        result["speedup"] = round(baseline["median_s"] / result["median_s"], 2)
+        result["rss_saved_mb"] = round(baseline["peak_rss_mb"] - result["peak_rss_mb"], 1)
+
+    print(json.dumps({
+        "benchmark": "resize",
+        "source": {"width": src_width, "height": src_height, "format": "JPEG"},
+        "target": {"width": args.width, "height": height},
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
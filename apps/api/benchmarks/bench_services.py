@@ -0,0 +1,136 @@
+"""
+Micro-benchmarks of the MediaService and ImageService methods on the
+synthetic fixtures from benchmarks.fixtures.
+
+Every case runs in its own spawned process: the first call warms imports
+and caches and is not timed, then --repeat calls are. A case that crashes
+its process (a broken ffmpeg build, a missing binary) is reported as an
+error instead of ending the run.
+
+    cd apps/api && python -m benchmarks.bench_services --repeat 5 --only image --output services.json
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.fixtures import DEFAULT_DIR, fixture, working_copy
+from benchmarks.report import emit, summarize
+
+
+def _media():
+    from services.media_service import MediaService
+    return MediaService(storage_path=os.environ["STORAGE_PATH"])
+
+
+def _image():
+    from services.image_service import ImageService
+    return ImageService(storage_path=os.environ["STORAGE_PATH"])
+
+
+def _fresh(name: str):
+    """A private copy of a fixture for a single run; returns its path"""
+    return working_copy(name, os.path.join(os.environ["STORAGE_PATH"], "uploads"), os.environ["FIXTURES_DIR"])
+
+
+# name -> (group, fixture, call(service, path))
+CASES = {
+    "media.probe": ("media", "video_720p_30s.mp4", lambda s, p: s.probe(p)),
+    "media.keyframes": ("media", "video_720p_30s.mp4", lambda s, p: s.keyframes(p)),
+    "media.convert_mp3": ("media", "video_480p_10s.mp4", lambda s, p: s.convert_file(p, "mp3")),
+    "media.convert_remux_mkv": ("media", "video_720p_30s.mp4", lambda s, p: s.convert_file(p, "mkv")),
+    "media.convert_audio_opus": ("media", "audio_30s.wav", lambda s, p: s.convert_file(p, "opus")),
+    "media.compress_video": ("media", "video_720p_10s.mkv", lambda s, p: s.compress_video(p, crf=28)),
+    "media.compress_video_parallel": ("media", "video_720p_30s.mp4", lambda s, p: s.compress_video_parallel(p, crf=28)),
+    "media.compress_to_target": ("media", "video_720p_10s.mkv",
+                                 lambda s, p: s.compress_to_target(p, target_bytes=1024 * 1024)),
+    "media.cut_video": ("media", "video_720p_30s.mp4", lambda s, p: s.cut_video(p, "00:00:05", "00:00:20")),
+    "media.smart_cut": ("media", "video_720p_30s.mp4", lambda s, p: s.smart_cut(p, [(3.2, 11.7), (17.5, 24.1)])),
+    "media.create_gif": ("media", "video_480p_10s.mp4", lambda s, p: s.create_gif(p, fps=10, width=320, duration=4)),
+    "image.resize_12mp": ("image", "image_12mp.jpg",
+                          lambda s, p: s.process_image(p, "resize", {"width": 1280, "height": 960})),
+    "image.thumbnail_12mp": ("image", "image_12mp.jpg",
+                             lambda s, p: s.process_image(p, "thumbnail", {"width": 256, "height": 256})),
+    "image.rotate_2mp": ("image", "image_2mp.jpg", lambda s, p: s.process_image(p, "rotate", {"degrees": 90})),
+    "image.grayscale_2mp": ("image", "image_2mp.jpg", lambda s, p: s.process_image(p, "grayscale")),
+    "image.convert_png_to_webp": ("image", "image_2mp.png",
+                                  lambda s, p: s.process_image(p, "convert", {"format": "WEBP"})),
+    "image.pipeline_12mp": ("image", "image_12mp.jpg", lambda s, p: s.process_image(p, "pipeline", {}, [
+        {"op": "resize", "width": 2000, "height": 1500}, {"op": "rotate", "degrees": 90}, {"op": "grayscale"},
+    ])),
+    "image.batch_16x2mp": ("image", None, lambda s, p: s.process_batch(
+        [{"path": _fresh("image_2mp.jpg"), "filename": f"{index}.jpg"} for index in range(16)],
+        "thumbnail", {"width": 512, "height": 512}, make_zip=True,
+    )),
+    "image.extract_text": ("image", "ocr_page.png", lambda s, p: s.extract_text(p)),
+}
+
+
+def _child(case: str, repeat: int, queue):
+    group, name, call = CASES[case]
+    service = _media() if group == "media" else _image()
+    timings = []
+    try:
+        for run in range(repeat + 1):
+            path = _fresh(name) if name else None
+            start = time.perf_counter()
+            call(service, path)
+            if run:
+                timings.append(time.perf_counter() - start)
+        queue.put({"timings": timings})
+    except Exception as e:
+        # ffmpeg puts its banner first and the actual error last
+        queue.put({"error": str(e)[-500:]})
+
+
+def run_case(case: str, repeat: int) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(case, repeat, queue))
+    proc.start()
+    proc.join()
+    if queue.empty():
+        return {"case": case, "error": f"process exited with code {proc.exitcode}"}
+    outcome = queue.get()
+    if "error" in outcome:
+        return {"case": case, "error": outcome["error"]}
+    return {"case": case, **summarize(outcome["timings"])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", action="append", default=[],
+                        help="run cases whose name starts with this prefix (repeatable)")
+    parser.add_argument("--fixtures-dir", default=DEFAULT_DIR)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if not args.only or any(case.startswith(prefix) for prefix in args.only)]
+    # Build fixtures up front so generating them isn't timed
+    for case in cases:
+        if CASES[case][1]:
+            fixture(CASES[case][1], args.fixtures_dir)
+    fixture("image_2mp.jpg", args.fixtures_dir)
+
+    storage = tempfile.mkdtemp(prefix="bench-services-")
+    # Inherited by the spawned children before they import the services
+    os.environ["STORAGE_PATH"] = storage
+    os.environ["FIXTURES_DIR"] = args.fixtures_dir
+    try:
+        results = []
+        for case in cases:
+            results.append(run_case(case, args.repeat))
+            # Keep disk use flat across cases
+            for sub in ("uploads", "downloads", "work"):
+                shutil.rmtree(os.path.join(storage, sub), ignore_errors=True)
+    finally:
+        shutil.rmtree(storage, ignore_errors=True)
+
+    emit("services", results, args.output, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
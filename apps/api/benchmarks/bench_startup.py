@@ -0,0 +1,85 @@
+"""
+API startup budget: import time and peak RSS of `import main` in a fresh
+interpreter, and a check that none of the worker-only backends got loaded.
+
+Exits non-zero when a budget is exceeded or a heavy module is imported, so
+it can gate CI. Each run is a new process; the median is compared.
+
+    cd apps/api && python -m benchmarks.bench_startup --max-seconds 1.2 --max-rss-mb 90
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.report import emit
+
+# Modules the API process must never import: they belong to the workers
+FORBIDDEN = (
+    "worker", "yt_dlp", "xhtml2pdf", "reportlab", "rembg", "onnxruntime",
+    "pytesseract", "tesserocr", "pypdfium2", "services.youtube_service", "boto3", "pyvips",
+    "PIL", "ffmpeg", "services.image_service", "services.media_service", "services.background_service",
+    "services.large_image_service", "services.ocr_service",
+)
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "seconds": elapsed,
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    "rss_mb": peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024,
+    "loaded": [name for name in %r if name in sys.modules],
+    "modules": len(sys.modules),
+}))
+""" % (FORBIDDEN,)
+
+
+def measure() -> dict:
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": api_dir}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=api_dir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=1.2)
+    parser.add_argument("--max-rss-mb", type=float, default=90)
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    runs = [measure() for _ in range(args.repeat)]
+    seconds = statistics.median(run["seconds"] for run in runs)
+    rss_mb = statistics.median(run["rss_mb"] for run in runs)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+
+    violations = []
+    if seconds > args.max_seconds:
+        violations.append(f"import took {seconds:.3f}s, budget {args.max_seconds}s")
+    if rss_mb > args.max_rss_mb:
+        violations.append(f"peak RSS {rss_mb:.1f} MB, budget {args.max_rss_mb} MB")
+    if loaded:
+        violations.append(f"worker-only modules imported: {', '.join(loaded)}")
+
+    emit("startup", [{
+        "median_s": round(seconds, 4),
+        "min_s": round(min(run["seconds"] for run in runs), 4),
+        "peak_rss_mb": round(rss_mb, 1),
+        "modules": runs[-1]["modules"],
+        "forbidden_loaded": loaded,
+    }], args.output, budget={"max_seconds": args.max_seconds, "max_rss_mb": args.max_rss_mb},
+         violations=violations)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Object storage benchmark: the round trip a job's files make through the
+storage backend, for the local backend and for S3.
+
+For every size it times a streamed upload (what the API does with a request
+body), a multipart put of a finished file (what a worker does with an
+output), a cold fetch into the worker's read-through cache, a warm fetch,
+a ranged read, and presigning. Without --endpoint the S3 runs go to an
+in-process moto server (pip install "moto[server]"), which stands in for
+MinIO: it checks the protocol, not the network.
+
+    cd apps/api && python -m benchmarks.bench_storage --sizes 1 16 64
+    python -m benchmarks.bench_storage --backends s3 --endpoint http://localhost:9000 \\
+        --access-key minioadmin --secret-key minioadmin
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from benchmarks.report import emit, summarize
+from core.config import settings
+from core.objects import ObjectStore, S3Backend
+
+CHUNK = 1024 * 1024
+
+
+def _timed(call) -> float:
+    started = time.perf_counter()
+    call()
+    return time.perf_counter() - started
+
+
+def _start_moto():
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+
+def _store(backend: str, root: str) -> ObjectStore:
+    store = ObjectStore(backend=backend, root=root, cache_path=os.path.join(root, "cache"))
+    if backend == "s3":
+        # Built here rather than from import-time defaults, after main() points settings at the endpoint
+        store.backend = S3Backend(
+            bucket=settings.S3_BUCKET, endpoint_url=settings.S3_ENDPOINT_URL, public_endpoint_url=""
+        )
+        client = store.backend.client
+        if settings.S3_BUCKET not in [bucket["Name"] for bucket in client.list_buckets().get("Buckets", [])]:
+            client.create_bucket(Bucket=settings.S3_BUCKET)
+    return store
+
+
+def run_size(store: ObjectStore, root: str, size_mb: int, repeat: int) -> list:
+    payload = os.urandom(CHUNK)
+    timings = {name: [] for name in ("stream_upload", "put", "fetch_cold", "fetch_warm", "range_1mb", "presign")}
+    for _ in range(repeat):
+        key = f"uploads/bench-{uuid.uuid4().hex}.bin"
+
+        def stream_upload():
+            out = store.writer(key)
+            for _ in range(size_mb):
+                out.write(payload)
+            out.close()
+        timings["stream_upload"].append(_timed(stream_upload))
+
+        local = os.path.join(root, "downloads", f"bench-{uuid.uuid4().hex}.bin")
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with open(local, "wb") as f:
+            for _ in range(size_mb):
+                f.write(payload)
+        output_key = store.key_for(local)
+        timings["put"].append(_timed(lambda: store.put(local, output_key)))
+
+        timings["fetch_cold"].append(_timed(lambda: store.fetch(key)))
+        timings["fetch_warm"].append(_timed(lambda: store.fetch(key)))
+        middle = size_mb * CHUNK // 2
+        timings["range_1mb"].append(_timed(lambda: b"".join(store.stream(key, middle, middle + CHUNK - 1))))
+        timings["presign"].append(_timed(lambda: store.url(output_key, "out.bin")))
+
+        store.delete(key)
+        store.delete(output_key)
+
+    results = []
+    for operation, samples in timings.items():
+        summary = summarize(samples)
+        if operation in ("stream_upload", "put", "fetch_cold") and summary["mean_s"]:
+            summary["mb_per_sec"] = round(size_mb / summary["mean_s"], 1)
+        results.append({"backend": store.backend.name, "size_mb": size_mb, "operation": operation, **summary})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=("local", "s3"), default=["local", "s3"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 64], help="object sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--endpoint", help="S3 endpoint; default: an in-process moto server")
+    parser.add_argument("--bucket", default=settings.S3_BUCKET)
+    parser.add_argument("--access-key", default=settings.S3_ACCESS_KEY_ID or "bench")
+    parser.add_argument("--secret-key", default=settings.S3_SECRET_ACCESS_KEY or "bench")
+    parser.add_argument("--part-size-mb", type=int, default=settings.S3_PART_SIZE_MB)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    server = None
+    if "s3" in args.backends:
+        endpoint = args.endpoint
+        if endpoint is None:
+            server, endpoint = _start_moto()
+        settings.S3_ENDPOINT_URL = endpoint
+        settings.S3_BUCKET = args.bucket
+        settings.S3_ACCESS_KEY_ID = args.access_key
+        settings.S3_SECRET_ACCESS_KEY = args.secret_key
+        settings.S3_REGION = settings.S3_REGION or "us-east-1"
+        settings.S3_PART_SIZE_MB = args.part_size_mb
+
+    results = []
+    try:
+        for backend in args.backends:
+            root = tempfile.mkdtemp(prefix=f"bench-storage-{backend}-")
+            try:
+                store = _store(backend, root)
+                for size_mb in args.sizes:
+                    results.extend(run_size(store, root, size_mb, args.repeat))
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+    finally:
+        if server is not None:
+            server.stop()
+
+    emit("storage", results, args.output, endpoint=settings.S3_ENDPOINT_URL if "s3" in args.backends else None)
+
+
+if __name__ == "__main__":
+    main()
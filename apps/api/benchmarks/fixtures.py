@@ -0,0 +1,123 @@
+"""
+Deterministic benchmark inputs, generated locally and cached on disk.
+
+Video and audio come from ffmpeg's lavfi test sources and images from
+Pillow's fractal and gradient generators, so every machine builds the same
+content without downloading anything. Files are created on first use.
+
+    cd apps/api && python -m benchmarks.fixtures --dir /tmp/swissknife-fixtures
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "swissknife-fixtures")
+
+# name -> (kind, spec)
+FIXTURES = {
+    "video_480p_10s.mp4": ("video", {"size": "854x480", "duration": 10}),
+    "video_720p_30s.mp4": ("video", {"size": "1280x720", "duration": 30}),
+    "video_720p_10s.mkv": ("video", {"size": "1280x720", "duration": 10}),
+    "audio_30s.wav": ("audio", {"duration": 30}),
+    "image_0.3mp.jpg": ("image", {"size": (640, 480)}),
+    "image_2mp.jpg": ("image", {"size": (1920, 1080)}),
+    "image_12mp.jpg": ("image", {"size": (4000, 3000)}),
+    "image_2mp.png": ("image", {"size": (1920, 1080)}),
+    "ocr_page.png": ("ocr", {"size": (1700, 2200), "lines": 40}),
+}
+
+OCR_TEXT = (
+    "The quick brown fox jumps over the lazy dog. Pack my box with five dozen liquor jugs. "
+    "Sphinx of black quartz, judge my vow. How vexingly quick daft zebras jump."
+)
+
+
+def _video(path: str, size: str, duration: float):
+    # -bitexact and a single encoder thread keep the bytes identical across runs
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-g", "60", "-pix_fmt", "yuv420p", "-threads", "1",
+        "-c:a", "aac", "-b:a", "128k", "-shortest",
+        "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        path,
+    ], check=True)
+
+
+def _audio(path: str, duration: float):
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-fflags", "+bitexact", path,
+    ], check=True)
+
+
+def _image(path: str, size: tuple):
+    # Mandelbrot plus gradients: detailed, non-repeating and the same everywhere
+    fractal = Image.effect_mandelbrot(size, (-2.2, -1.2, 1.0, 1.2), 120)
+    horizontal = Image.linear_gradient("L").resize(size)
+    vertical = horizontal.transpose(Image.Transpose.ROTATE_90).resize(size)
+    image = Image.merge("RGB", (fractal, horizontal, vertical))
+    image.save(path, quality=90) if path.endswith(".jpg") else image.save(path)
+
+
+def _ocr(path: str, size: tuple, lines: int):
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=28)
+    words = OCR_TEXT.split()
+    for line in range(lines):
+        # Rotate through the pangrams so every line differs
+        start = (line * 7) % len(words)
+        text = " ".join((words[start:] + words[:start])[:10])
+        draw.text((100, 100 + line * 48), text, fill=0, font=font)
+    image.save(path)
+
+
+def fixture(name: str, directory: str = DEFAULT_DIR) -> str:
+    """Path of a fixture, generating it first if needed"""
+    kind, spec = FIXTURES[name]
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    # Write under a temp name so an interrupted run never leaves a truncated fixture
+    partial = os.path.join(directory, f".partial-{name}")
+    if kind == "video":
+        _video(partial, **spec)
+    elif kind == "audio":
+        _audio(partial, **spec)
+    elif kind == "image":
+        _image(partial, **spec)
+    else:
+        _ocr(partial, **spec)
+    os.replace(partial, path)
+    return path
+
+
+def working_copy(name: str, directory: str, fixtures_dir: str = DEFAULT_DIR) -> str:
+    """A fresh copy of a fixture, for code that deletes or modifies its input"""
+    source = fixture(name, fixtures_dir)
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=os.path.splitext(name)[1])
+    with os.fdopen(fd, "wb") as out, open(source, "rb") as src:
+        while chunk := src.read(1024 * 1024):
+            out.write(chunk)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    args = parser.parse_args(argv)
+    for name in FIXTURES:
+        path = fixture(name, args.dir)
+        print(f"{os.path.getsize(path):>12}  {path}")
+
+
+if __name__ == "__main__":
+    main()
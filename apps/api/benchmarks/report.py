@@ -0,0 +1,59 @@
+"""Shared helpers for benchmark output: latency percentiles and the JSON envelope."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+def percentiles(samples: list, points=(50, 95, 99)) -> dict:
+    """Nearest-rank percentiles of samples, in the samples' unit"""
+    if not samples:
+        return {f"p{point}": None for point in points}
+    ordered = sorted(samples)
+    return {
+        f"p{point}": round(ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))], 4)
+        for point in points
+    }
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "runs": len(samples),
+        "min_s": round(min(samples), 4) if samples else None,
+        "mean_s": round(sum(samples) / len(samples), 4) if samples else None,
+        **{f"{key}_s": value for key, value in percentiles(samples).items()},
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """Where the numbers came from, so runs from different commits can be compared"""
+    return {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def emit(benchmark: str, results: list, output: str = None, **extra):
+    """Print the report as JSON, and also write it to output if given"""
+    report = {"benchmark": benchmark, "environment": environment(), **extra, "results": results}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    return report
@@ -0,0 +1,215 @@
+import hashlib
+import json
+import time
+import uuid
+from typing import Optional
+
+import redis
+from celery import states
+
+from core.config import settings
+from core.metrics import metrics
+from core.objects import object_store
+from core.storage import storage_manager
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's content, read in fixed-size chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_params(params: Optional[dict]) -> str:
+    return json.dumps(params or {}, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of finished task results.
+
+    Entries live in Redis under ``cache:entry:<key>`` with a sliding TTL, and a
+    sorted set of last-access times drives LRU eviction. Evicting an entry also
+    deletes the output object it points to (``cache:paths`` maps entry -> key).
+    """
+
+    def __init__(
+        self,
+        url: str = settings.REDIS_URL,
+        max_entries: int = settings.RESULT_CACHE_MAX_ENTRIES,
+        ttl: int = settings.RESULT_CACHE_TTL,
+        inflight_ttl: int = settings.RESULT_CACHE_INFLIGHT_TTL,
+    ):
+        self.url = url
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self._client = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def make_key(self, task_name: str, digest: str, params: Optional[dict] = None) -> str:
+        raw = f"{task_name}:{digest}:{normalize_params(params)}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        data = self.client.get(f"cache:entry:{key}")
+        if data is None:
+            self.client.hincrby("cache:stats", "misses", 1)
+            metrics.cache_lookup("result", False)
+            return None
+
+        result = json.loads(data)
+        output = result.get("key")
+        if output and not object_store.exists(output):
+            # Output was removed behind our back, the entry is useless
+            self._drop(key)
+            self.client.hincrby("cache:stats", "misses", 1)
+            metrics.cache_lookup("result", False)
+            return None
+
+        pipe = self.client.pipeline()
+        pipe.expire(f"cache:entry:{key}", self.ttl)
+        pipe.zadd("cache:lru", {key: time.time()})
+        pipe.hincrby("cache:stats", "hits", 1)
+        pipe.execute()
+        metrics.cache_lookup("result", True)
+        return result
+
+    def set(self, key: str, result: dict):
+        pipe = self.client.pipeline()
+        pipe.set(f"cache:entry:{key}", json.dumps(result), ex=self.ttl)
+        pipe.zadd("cache:lru", {key: time.time()})
+        if result.get("key"):
+            pipe.hset("cache:paths", key, result["key"])
+        pipe.execute()
+        self._evict()
+
+    def _evict(self):
+        stale = self.client.zrangebyscore("cache:lru", 0, time.time() - self.ttl)
+        overflow = self.client.zcard("cache:lru") - len(stale) - self.max_entries
+        if overflow > 0:
+            stale += self.client.zrange("cache:lru", len(stale), len(stale) + overflow - 1)
+        for key in stale:
+            self._drop(key)
+            self.client.hincrby("cache:stats", "evictions", 1)
+
+    def _drop(self, key: str):
+        output = self.client.hget("cache:paths", key)
+        if output:
+            object_store.delete(output)
+
+        pipe = self.client.pipeline()
+        pipe.delete(f"cache:entry:{key}")
+        pipe.zrem("cache:lru", key)
+        pipe.hdel("cache:paths", key)
+        pipe.execute()
+
+    def claim(self, key: str, task_id: str) -> Optional[str]:
+        """
+        Register task_id as the producer of key.
+        Returns the id of the task already producing it, or None if the claim succeeded.
+        """
+        for _ in range(3):
+            if self.client.set(f"cache:inflight:{key}", task_id, nx=True, ex=self.inflight_ttl):
+                return None
+            running = self.client.get(f"cache:inflight:{key}")
+            if running:
+                return running
+        return None
+
+    def release(self, key: str):
+        self.client.delete(f"cache:inflight:{key}")
+
+    def stats(self) -> dict:
+        counters = self.client.hgetall("cache:stats")
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "entries": self.client.zcard("cache:lru"),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "evictions": int(counters.get("evictions", 0)),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache()
+
+
+class ProbeCache:
+    """ffprobe output keyed by the input's content hash, so re-uploads skip the probe"""
+
+    def __init__(self, url: str = settings.REDIS_URL, ttl: int = settings.PROBE_CACHE_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._client = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def get(self, digest: str) -> Optional[dict]:
+        data = self.client.get(f"probe:{digest}")
+        return json.loads(data) if data is not None else None
+
+    def set(self, digest: str, info: dict):
+        self.client.set(f"probe:{digest}", json.dumps(info), ex=self.ttl)
+
+
+probe_cache = ProbeCache()
+
+
+def submit_cached(
+    celery_app, task_name: str, input_key: str, args: list,
+    params: dict = None, digest: str = None, kwargs: dict = None
+):
+    """
+    Queue task_name unless an identical job was already done or is running.
+
+    Returns (task_id, cache_state) where cache_state is "hit", "attached" or "miss".
+    A hit is written straight to the result backend so clients poll it like any task.
+    Pass digest when the content hash is already known to skip re-reading the object.
+    kwargs are passed to the task alongside cache_key.
+    """
+    key = result_cache.make_key(task_name, digest or file_digest(object_store.fetch(input_key)), params)
+    task_id, cache_state = submit_deduplicated(celery_app, task_name, key, args, kwargs)
+    if cache_state != "miss":
+        object_store.delete(input_key)
+    return task_id, cache_state
+
+
+def submit_deduplicated(celery_app, task_name: str, key: str, args: list, kwargs: dict = None):
+    """
+    submit_cached for jobs identified by key rather than an uploaded file,
+    e.g. a URL: a finished result is reused and a running one is joined.
+    """
+    cached = result_cache.get(key)
+    if cached is not None:
+        # Keep the shared output around for this job's download too
+        if cached.get("key"):
+            storage_manager.touch(cached["key"])
+        task_id = str(uuid.uuid4())
+        celery_app.backend.store_result(task_id, {**cached, "cached": True}, states.SUCCESS)
+        return task_id, "hit"
+
+    task_id = str(uuid.uuid4())
+    running = result_cache.claim(key, task_id)
+    if running:
+        return running, "attached"
+
+    celery_app.send_task(task_name, args=args, kwargs={**(kwargs or {}), "cache_key": key}, task_id=task_id)
+    return task_id, "miss"
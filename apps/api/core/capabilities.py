@@ -0,0 +1,121 @@
+import importlib
+import importlib.util
+import json
+import shutil
+import subprocess
+import sys
+import time
+from functools import lru_cache
+
+import redis
+
+from core.config import settings
+
+# Optional backends: the Python modules and executables each one needs.
+# Availability is checked without importing anything, so the API can report
+# on backends it never loads.
+BACKENDS = {
+    "rembg": {"modules": ("rembg", "onnxruntime")},
+    "tesserocr": {"modules": ("tesserocr",)},
+    "pytesseract": {"modules": ("pytesseract",), "binaries": ("tesseract",)},
+    "pypdfium2": {"modules": ("pypdfium2",)},
+    "xhtml2pdf": {"modules": ("xhtml2pdf",)},
+    "yt_dlp": {"modules": ("yt_dlp",)},
+    "orjson": {"modules": ("orjson",)},
+    "boto3": {"modules": ("boto3",)},
+    "pyvips": {"modules": ("pyvips",)},
+    "ffmpeg": {"binaries": ("ffmpeg", "ffprobe")},
+}
+
+# User-facing features and the backends that provide them (any one is enough)
+FEATURES = {
+    "media": ("ffmpeg",),
+    "download": ("yt_dlp",),
+    "remove_bg": ("rembg",),
+    "ocr": ("tesserocr", "pytesseract"),
+    "ocr_pdf": ("pypdfium2",),
+    "markdown_pdf": ("xhtml2pdf",),
+    "fast_json": ("orjson",),
+    "s3_storage": ("boto3",),
+    "large_images": ("pyvips",),
+}
+
+
+@lru_cache(maxsize=None)
+def backend_available(name: str) -> bool:
+    backend = BACKENDS[name]
+    return (
+        all(importlib.util.find_spec(module) is not None for module in backend.get("modules", ()))
+        and all(shutil.which(binary) is not None for binary in backend.get("binaries", ()))
+    )
+
+
+@lru_cache(maxsize=None)
+def ocr_languages() -> frozenset:
+    """Tesseract languages installed here; empty when that can't be told (no tesseract binary)"""
+    if shutil.which("tesseract") is None:
+        return frozenset()
+    try:
+        completed = subprocess.run(["tesseract", "--list-langs"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return frozenset()
+    # 'List of available languages in "..." (N):' then one language per line;
+    # older releases print it on stderr
+    lines = (completed.stdout or completed.stderr).splitlines()
+    return frozenset(line.strip() for line in lines[1:] if line.strip())
+
+
+def require(module: str, feature: str):
+    """Import an optional backend module on first use, failing like the services always have"""
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise Exception(f"{feature} is not available. Please install '{module.partition('.')[0]}'.")
+
+
+def report() -> dict:
+    """Backends installed in this process's environment, whether they are loaded yet, and the features they enable"""
+    backends = {
+        name: {
+            "available": backend_available(name),
+            "loaded": any(module in sys.modules for module in backend.get("modules", ())),
+        }
+        for name, backend in BACKENDS.items()
+    }
+    features = {
+        feature: any(backends[name]["available"] for name in providers)
+        for feature, providers in FEATURES.items()
+    }
+    return {"features": features, "backends": backends}
+
+
+class CapabilityRegistry:
+    """
+    What each worker can do. Workers publish their report at startup into
+    the ``capabilities:workers`` hash, so the API can answer for them
+    without importing any of their backends itself.
+    """
+
+    def __init__(self, url: str = settings.REDIS_URL):
+        self.url = url
+        self._client = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def publish(self, hostname: str, queues: list):
+        self.client.hset("capabilities:workers", hostname, json.dumps({
+            **report(), "queues": sorted(queues), "reported_at": time.time(),
+        }))
+
+    def withdraw(self, hostname: str):
+        self.client.hdel("capabilities:workers", hostname)
+
+    def workers(self) -> dict:
+        return {hostname: json.loads(data) for hostname, data in self.client.hgetall("capabilities:workers").items()}
+
+
+capability_registry = CapabilityRegistry()
@@ -10,6 +10,168 @@ class Settings(BaseSettings):
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/0"
     STORAGE_PATH: str = "./storage"
 
+    # Uploads
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    MAX_MEDIA_UPLOAD_MB: int = 4096
+    MAX_IMAGE_UPLOAD_MB: int = 100
+    UPLOAD_SESSION_TTL: int = 24 * 60 * 60
+
+    # Minimum seconds between task progress writes to the result backend
+    PROGRESS_MIN_INTERVAL: float = 1.0
+
+    # Task status: ids per bulk/stream request, stream lifetime and keep-alive
+    TASK_STATUS_MAX_IDS: int = 1000
+    TASK_STREAM_TIMEOUT: float = 60 * 60
+    TASK_STREAM_HEARTBEAT: float = 15.0
+
+    # Storage lifecycle: output/upload/work-dir TTLs, disk quota and sweep period
+    STORAGE_OUTPUT_TTL: int = 6 * 60 * 60
+    STORAGE_UPLOAD_TTL: int = 24 * 60 * 60
+    STORAGE_WORK_TTL: int = 6 * 60 * 60
+    STORAGE_MIN_AGE: int = 5 * 60
+    STORAGE_QUOTA_MB: int = 20 * 1024
+    STORAGE_QUOTA_LOW_WATERMARK: float = 0.9
+    STORAGE_SWEEP_INTERVAL: float = 5 * 60
+
+    # Object storage: 'local' (STORAGE_PATH on a volume shared by API and workers)
+    # or 's3' (any S3-compatible store; STORAGE_PATH is then node-local scratch).
+    # Workers keep fetched objects in OBJECT_CACHE_PATH (default STORAGE_PATH/cache)
+    STORAGE_BACKEND: str = "local"
+    OBJECT_CACHE_PATH: str = ""
+    OBJECT_CACHE_MB: int = 10 * 1024
+    S3_BUCKET: str = "swissknife"
+    S3_PREFIX: str = ""
+    S3_ENDPOINT_URL: str = ""
+    S3_PUBLIC_ENDPOINT_URL: str = ""
+    S3_REGION: str = ""
+    S3_ACCESS_KEY_ID: str = ""
+    S3_SECRET_ACCESS_KEY: str = ""
+    S3_ADDRESSING_STYLE: str = "path"
+    S3_PART_SIZE_MB: int = 8
+    S3_MAX_CONCURRENCY: int = 4
+    S3_PRESIGN_TTL: int = 60 * 60
+
+    # Downloads: redirect to a presigned URL when the backend has them, or hand
+    # file serving to a front proxy ('X-Accel-Redirect' for nginx, 'X-Sendfile'
+    # for Apache/lighttpd) instead of streaming through the app
+    DOWNLOAD_REDIRECT: bool = True
+    DOWNLOAD_OFFLOAD_HEADER: str = ""
+    DOWNLOAD_OFFLOAD_PREFIX: str = "/protected-downloads"
+
+    # ffprobe metadata cached per input content hash
+    PROBE_CACHE_TTL: int = 7 * 24 * 60 * 60
+
+    # Queues: one per workload class. QUEUE_CONCURRENCY mirrors each queue's worker
+    # concurrency (for wait estimates); TASK_CORE_BUDGET 0 = CPUs / concurrency
+    CELERY_DEFAULT_QUEUE: str = "io"
+    WORKER_PREFETCH_MULTIPLIER: int = 1
+    TASK_CORE_BUDGET: int = 0
+    QUEUE_CONCURRENCY: dict = {"io": 8, "cpu-video": 2, "cpu-image": 2, "ocr": 2, "ml": 1}
+    QUEUE_MAX_DEPTH: dict = {"io": 200, "cpu-video": 40, "cpu-image": 200, "ocr": 100, "ml": 50}
+    QUEUE_MAX_WAIT: float = 10 * 60
+    QUEUE_RETRY_AFTER: int = 30
+
+    # yt-dlp: metadata cache lifetime (media URLs expire) and parallel DASH/HLS fragments
+    YTDLP_INFO_TTL: int = 30 * 60
+    YTDLP_CONCURRENT_FRAGMENTS: int = 4
+
+    # Segment-parallel video encoding: 'local', 'distributed' (Celery subtasks) or 'off'.
+    # PARALLEL_ENCODE_WORKERS 0 = the task's cores locally, the cpu-video concurrency when distributed
+    PARALLEL_ENCODE_MODE: str = "local"
+    PARALLEL_ENCODE_MIN_DURATION: float = 120.0
+    PARALLEL_ENCODE_MIN_SEGMENT: float = 10.0
+    PARALLEL_ENCODE_SEGMENTS_PER_WORKER: int = 2
+    PARALLEL_ENCODE_WORKERS: int = 0
+
+    # Target-size compression: sample clips and their length for the CRF -> bitrate
+    # curve, CRFs each sample is encoded at, usable CRF range, audio bitrate range,
+    # VBV peak allowance over the target rate, share of the budget held back for
+    # rate-control error, smallest height downscaling may reach
+    COMPRESS_SAMPLES: int = 4
+    COMPRESS_SAMPLE_SECONDS: float = 3.0
+    COMPRESS_SAMPLE_CRFS: list = [20, 26, 32]
+    COMPRESS_MIN_CRF: int = 18
+    COMPRESS_MAX_CRF: int = 36
+    COMPRESS_AUDIO_KBPS: int = 128
+    COMPRESS_MIN_AUDIO_KBPS: int = 32
+    COMPRESS_MAXRATE_FACTOR: float = 1.0
+    COMPRESS_HEADROOM: float = 0.03
+    COMPRESS_MIN_HEIGHT: int = 240
+
+    # GIF engine: probe clip length, probe encodes per size target, ladder floor
+    GIF_PROBE_SECONDS: float = 3.0
+    GIF_MAX_PROBES: int = 3
+    GIF_MIN_WIDTH: int = 120
+    GIF_MIN_FPS: int = 5
+
+    # Images: integer pre-reduction before LANCZOS resampling (None disables it)
+    IMAGE_REDUCING_GAP: float = 3.0
+
+    # Large images: pixel limit per input and the memory one image may take to
+    # process. Inputs that would go over the budget in Pillow are streamed through
+    # libvips (pyvips) in strips instead, or refused when that isn't possible
+    IMAGE_MAX_MEGAPIXELS: int = 1000
+    IMAGE_MEMORY_BUDGET_MB: int = 512
+
+    # Background removal: sessions kept per worker process, threads per session (0 = auto)
+    REMBG_MODEL: str = "u2net"
+    REMBG_SESSIONS: int = 1
+    REMBG_THREADS: int = 0
+    REMBG_PRELOAD: bool = True
+
+    # OCR: parallel tiles/resident Tesseract instances per language (0 = one per CPU)
+    OCR_WORKERS: int = 0
+    OCR_TARGET_DPI: int = 300
+    OCR_TILE_HEIGHT: int = 2000
+    OCR_MAX_SKEW: float = 5.0
+
+    # Batch image processing (0 = one thread per CPU)
+    BATCH_POOL_SIZE: int = 0
+    BATCH_CHUNK_SIZE: int = 8
+
+    # JSON tools: parser backend ('auto' = orjson when installed, 'orjson', 'stdlib'),
+    # largest body /json/format parses whole, stream nesting and token limits,
+    # widest indent either endpoint accepts
+    JSON_BACKEND: str = "auto"
+    JSON_MAX_INLINE_MB: int = 10
+    JSON_MAX_DEPTH: int = 512
+    JSON_MAX_TOKEN_SIZE: int = 16 * 1024 * 1024
+    JSON_MAX_INDENT: int = 8
+
+    # Diff: default context lines, input cap, line count and changed-line bytes
+    # above which the diff runs on a worker, Myers edit budget per region, longest
+    # line given a word diff and the word edits a line pair may need to get one
+    DIFF_CONTEXT: int = 3
+    DIFF_MAX_INPUT_MB: int = 20
+    DIFF_SYNC_MAX_LINES: int = 20000
+    DIFF_SYNC_MAX_CHANGED_KB: int = 256
+    DIFF_MAX_EDIT_COST: int = 2000
+    DIFF_WORD_MAX_LINE: int = 2000
+    DIFF_WORD_MAX_EDIT_COST: int = 64
+
+    # Markdown: extensions of the per-worker pipeline, PDF warm-up on worker start,
+    # source size cap and documents per batch
+    MARKDOWN_EXTENSIONS: list = ["extra", "sane_lists"]
+    MARKDOWN_PRELOAD: bool = True
+    MARKDOWN_MAX_MB: int = 5
+    MARKDOWN_BATCH_MAX: int = 100
+
+    # Metrics: recording on/off and how often each process adds its buffer onto Redis
+    METRICS_ENABLED: bool = True
+    METRICS_FLUSH_INTERVAL: float = 5.0
+
+    # Sampling profiler: task names to profile ('*' = all), sample period, run time
+    # below which a profile is discarded, and how many profiles to keep on disk
+    PROFILE_TASKS: list = []
+    PROFILE_INTERVAL: float = 0.01
+    PROFILE_MIN_SECONDS: float = 5.0
+    PROFILE_KEEP: int = 50
+
+    # Result cache
+    RESULT_CACHE_MAX_ENTRIES: int = 500
+    RESULT_CACHE_TTL: int = 24 * 60 * 60
+    RESULT_CACHE_INFLIGHT_TTL: int = 60 * 60
+
     class Config:
         case_sensitive = True
         env_file = ".env"
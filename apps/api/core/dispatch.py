@@ -0,0 +1,32 @@
+import time
+
+from celery import Celery
+from celery.signals import before_task_publish
+
+from core.config import settings
+from core.queues import route_task
+
+# The Celery app without any tasks: enough to send tasks by name and read
+# their results, which is all the API does. worker.py registers the tasks on
+# this same app, so both sides share one configuration, but importing this
+# module never loads a service or its backends.
+celery_app = Celery(
+    "worker",
+    broker=settings.CELERY_BROKER_URL,
+    backend=settings.CELERY_RESULT_BACKEND
+)
+
+celery_app.conf.update(
+    task_serializer="json",
+    accept_content=["json"],
+    result_serializer="json",
+    timezone="UTC",
+    enable_utc=True,
+    task_routes=(route_task,),
+    task_default_queue=settings.CELERY_DEFAULT_QUEUE,
+)
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    # Read back by the worker to measure time spent in the queue
+    headers["enqueued_at"] = time.time()
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import redis
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from core.cache import file_digest
+from core.config import settings
+from core.objects import object_store
+
+UPLOAD_LIMITS = {
+    "media": settings.MAX_MEDIA_UPLOAD_MB * 1024 * 1024,
+    "image": settings.MAX_IMAGE_UPLOAD_MB * 1024 * 1024,
+}
+
+# Path prefixes whose multipart bodies are checked against a limit before parsing
+ROUTE_KINDS = {
+    f"{settings.API_V1_STR}/media": "media",
+    f"{settings.API_V1_STR}/visual": "image",
+}
+
+
+@dataclass
+class IngestedFile:
+    key: str
+    filename: str
+    size: int
+    digest: str
+
+
+def upload_dir() -> str:
+    """Local staging area for resumable uploads, whatever the storage backend"""
+    path = f"{settings.STORAGE_PATH}/uploads"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def upload_key(filename: Optional[str]) -> str:
+    return f"uploads/{uuid.uuid4()}{os.path.splitext(filename or '')[1]}"
+
+
+def upload_limit(kind: str) -> int:
+    if kind not in UPLOAD_LIMITS:
+        raise HTTPException(status_code=400, detail=f"Unknown upload kind: {kind}")
+    return UPLOAD_LIMITS[kind]
+
+
+def _too_large(kind: str) -> HTTPException:
+    limit_mb = UPLOAD_LIMITS[kind] // (1024 * 1024)
+    return HTTPException(status_code=413, detail=f"File exceeds the {limit_mb} MB limit for {kind} uploads")
+
+
+async def save_upload(file: UploadFile, kind: str) -> IngestedFile:
+    """
+    Stream an upload into the object store in fixed-size chunks (a multipart
+    upload on S3, so nothing is staged on the API's disk).
+    The content hash is computed on the fly and the size limit is enforced per chunk.
+    """
+    limit = upload_limit(kind)
+    if file.size is not None and file.size > limit:
+        raise _too_large(kind)
+
+    key = upload_key(file.filename)
+    digest = hashlib.sha256()
+    size = 0
+
+    out = await run_in_threadpool(object_store.writer, key)
+    try:
+        while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                raise _too_large(kind)
+            digest.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+        await run_in_threadpool(out.close)
+    except BaseException:
+        await run_in_threadpool(out.abort)
+        raise
+
+    return IngestedFile(key=key, filename=file.filename, size=size, digest=digest.hexdigest())
+
+
+def store_text(text: str, suffix: str = ".txt") -> str:
+    """Save a text body as an upload object; returns its key"""
+    key = f"uploads/{uuid.uuid4()}{suffix}"
+    out = object_store.writer(key)
+    try:
+        out.write(text.encode("utf-8"))
+        out.close()
+    except BaseException:
+        out.abort()
+        raise
+    return key
+
+
+class UploadLimitMiddleware:
+    """Reject oversized uploads from their Content-Length before the body is read."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            kind = next((k for prefix, k in ROUTE_KINDS.items() if scope["path"].startswith(prefix)), None)
+            length = dict(scope["headers"]).get(b"content-length")
+            if kind and length and length.isdigit() and int(length) > UPLOAD_LIMITS[kind]:
+                body = json.dumps({"detail": _too_large(kind).detail}).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class ResumableUploads:
+    """
+    Offset-addressed chunk uploads (tus-style).
+
+    Each session preallocates a .part file that chunks are written into at
+    their offset, so chunks may arrive out of order or in parallel and a
+    dropped connection only loses the bytes that weren't written yet.
+    Received byte ranges are tracked in Redis so every API process sees them.
+    """
+
+    def __init__(self, url: str = settings.REDIS_URL, ttl: int = settings.UPLOAD_SESSION_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._client = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def _part_path(self, upload_id: str) -> str:
+        return f"{upload_dir()}/{upload_id}.part"
+
+    def create(self, filename: str, size: int, kind: str) -> str:
+        if size < 0:
+            raise HTTPException(status_code=400, detail="size must not be negative")
+        if size > upload_limit(kind):
+            raise _too_large(kind)
+
+        upload_id = str(uuid.uuid4())
+        with open(self._part_path(upload_id), "wb") as f:
+            f.truncate(size)
+
+        pipe = self.client.pipeline()
+        pipe.hset(f"upload:{upload_id}", mapping={
+            "filename": filename,
+            "size": size,
+            "kind": kind,
+            "created": time.time(),
+        })
+        pipe.expire(f"upload:{upload_id}", self.ttl)
+        pipe.execute()
+        return upload_id
+
+    def get(self, upload_id: str) -> dict:
+        meta = self.client.hgetall(f"upload:{upload_id}")
+        if not meta or not os.path.exists(self._part_path(upload_id)):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        meta["size"] = int(meta["size"])
+        meta["ranges"] = self.ranges(upload_id)
+        meta["offset"] = self.offset(meta["ranges"])
+        meta["received"] = sum(end - start for start, end in meta["ranges"])
+        return meta
+
+    def ranges(self, upload_id: str) -> List[Tuple[int, int]]:
+        members = self.client.smembers(f"upload:{upload_id}:ranges")
+        return _merge([tuple(int(n) for n in m.split("-")) for m in members])
+
+    @staticmethod
+    def offset(ranges: List[Tuple[int, int]]) -> int:
+        """Length of the contiguous prefix received so far"""
+        return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+    async def write_chunk(self, upload_id: str, offset: int, request: Request) -> dict:
+        meta = self.get(upload_id)
+        if offset < 0 or offset > meta["size"]:
+            raise HTTPException(status_code=409, detail="Upload-Offset is out of range")
+
+        fd = os.open(self._part_path(upload_id), os.O_WRONLY)
+        position = offset
+        try:
+            async for chunk in request.stream():
+                if position + len(chunk) > meta["size"]:
+                    raise HTTPException(status_code=413, detail="Chunk exceeds the declared upload size")
+                await run_in_threadpool(os.pwrite, fd, chunk, position)
+                position += len(chunk)
+        finally:
+            os.close(fd)
+            # Record whatever made it to disk, even if the client went away mid-chunk
+            if position > offset:
+                pipe = self.client.pipeline()
+                pipe.sadd(f"upload:{upload_id}:ranges", f"{offset}-{position}")
+                pipe.expire(f"upload:{upload_id}:ranges", self.ttl)
+                pipe.expire(f"upload:{upload_id}", self.ttl)
+                pipe.execute()
+
+        return self.get(upload_id)
+
+    async def finalize(self, upload_id: str, kind: str) -> IngestedFile:
+        """Hand a complete upload over to the object store; kind is the one the task needs"""
+        meta = self.get(upload_id)
+        # The session's size was checked against its own kind's limit
+        if meta["kind"] != kind:
+            raise HTTPException(status_code=400, detail=f"Upload was created as '{meta['kind']}', this task needs '{kind}'")
+        if meta["received"] < meta["size"] or meta["offset"] != meta["size"]:
+            raise HTTPException(status_code=409, detail="Upload is incomplete")
+
+        part_path = self._part_path(upload_id)
+        digest = await run_in_threadpool(file_digest, part_path)
+        file_ext = os.path.splitext(meta["filename"])[1]
+        # A rename on the local backend, a multipart upload on S3
+        key = await run_in_threadpool(object_store.put, part_path, f"uploads/{upload_id}{file_ext}")
+        self.client.delete(f"upload:{upload_id}", f"upload:{upload_id}:ranges")
+
+        return IngestedFile(key=key, filename=meta["filename"], size=meta["size"], digest=digest)
+
+    def abort(self, upload_id: str):
+        part_path = self._part_path(upload_id)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        self.client.delete(f"upload:{upload_id}", f"upload:{upload_id}:ranges")
+
+
+resumable_uploads = ResumableUploads()
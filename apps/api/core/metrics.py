@@ -0,0 +1,249 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import redis
+
+from core.config import settings
+
+# Histogram bucket upper bounds, in seconds: sub-millisecond API calls up to half-hour encodes
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# name -> (type, help)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "API request latency by router, route and status class"),
+    "http_request_bytes_total": ("counter", "Request body bytes received by the API"),
+    "http_response_bytes_total": ("counter", "Response body bytes sent by the API"),
+    "task_queue_wait_seconds": ("histogram", "Time from a task being published to a worker starting it"),
+    "task_run_seconds": ("histogram", "Task run time by final state"),
+    "task_phase_seconds": ("histogram", "Time spent in each phase of a task (decode, process, encode, ...)"),
+    "task_input_bytes_total": ("counter", "Bytes of input files handed to tasks"),
+    "task_output_bytes_total": ("counter", "Bytes of output files written by tasks"),
+    "ffmpeg_runs_total": ("counter", "ffmpeg processes run"),
+    "ffmpeg_wall_seconds_total": ("counter", "Wall-clock seconds spent in ffmpeg processes"),
+    "ffmpeg_cpu_seconds_total": ("counter", "CPU seconds (user + system) used by ffmpeg processes"),
+    "cache_lookups_total": ("counter", "Cache lookups by cache and result (hit or miss)"),
+}
+
+_SEPARATOR = "\t"
+
+# Task whose work is being measured; pools running part of a task should
+# submit through contextvars.copy_context().run to keep the attribution
+_current_task = contextvars.ContextVar("metrics_task", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    """
+    Prometheus-style counters and histograms shared by the API and workers.
+
+    The API and every worker process record into an in-process buffer that
+    is added onto Redis hashes (``metrics:<name>``) at most every
+    METRICS_FLUSH_INTERVAL seconds, so instrumenting a hot path costs a dict
+    update rather than a round-trip. Workers also flush after every task.
+    render() turns the hashes into the text exposition format, so one
+    /metrics scrape covers the whole deployment.
+
+    Metrics never fail the work they measure: Redis errors drop the batch.
+    """
+
+    def __init__(
+        self,
+        url: str = settings.REDIS_URL,
+        enabled: bool = settings.METRICS_ENABLED,
+        flush_interval: float = settings.METRICS_FLUSH_INTERVAL,
+    ):
+        self.url = url
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self._client = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def _add(self, name: str, field: str, value: float):
+        key = (name, field)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + value
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if self.enabled:
+            self._add(name, _labels(labels), value)
+
+    def observe(self, name: str, value: float, **labels):
+        """Record one histogram sample; buckets are stored non-cumulative and summed on render"""
+        if not self.enabled:
+            return
+        field = _labels(labels)
+        index = bisect.bisect_left(BUCKETS, value)
+        bucket = _number(BUCKETS[index]) if index < len(BUCKETS) else "+Inf"
+        with self._lock:
+            pending = self._pending
+            for part, amount in ((bucket, 1), ("sum", value), ("count", 1)):
+                key = (name, f"{field}{_SEPARATOR}{part}")
+                pending[key] = pending.get(key, 0) + amount
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for (name, field), value in pending.items():
+                pipe.hincrbyfloat(f"metrics:{name}", field, value)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    # Task context: phases and ffmpeg runs are attributed to the task being run
+
+    def set_task(self, task_name: Optional[str]):
+        _current_task.set(task_name)
+
+    @property
+    def current_task(self) -> Optional[str]:
+        return _current_task.get()
+
+    @contextmanager
+    def phase(self, phase: str):
+        """Time a block as one phase of the current task; a no-op outside tasks"""
+        task = self.current_task
+        if task is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("task_phase_seconds", time.perf_counter() - started, task=task, phase=phase)
+
+    def ffmpeg(self, wall: float, cpu: float):
+        task = self.current_task or "none"
+        self.inc("ffmpeg_runs_total", task=task)
+        self.inc("ffmpeg_wall_seconds_total", wall, task=task)
+        self.inc("ffmpeg_cpu_seconds_total", cpu, task=task)
+
+    def cache_lookup(self, cache: str, hit: bool):
+        self.inc("cache_lookups_total", cache=cache, result="hit" if hit else "miss")
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        self.flush()
+        pipe = self.client.pipeline(transaction=False)
+        for name in METRICS:
+            pipe.hgetall(f"metrics:{name}")
+        lines = []
+        for (name, (kind, help_text)), values in zip(METRICS.items(), pipe.execute()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                lines.extend(_render_histogram(name, values))
+            else:
+                for field, value in sorted(values.items()):
+                    lines.append(f"{name}{{{field}}} {_number(float(value))}" if field else f"{name} {_number(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name: str, values: dict) -> list:
+    series = {}
+    for field, value in values.items():
+        labels, _, part = field.rpartition(_SEPARATOR)
+        series.setdefault(labels, {})[part] = float(value)
+
+    lines = []
+    for labels, parts in sorted(series.items()):
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0
+        for bound in BUCKETS:
+            cumulative += parts.get(_number(bound), 0)
+            lines.append(f'{name}_bucket{{{prefix}le="{_number(bound)}"}} {_number(cumulative)}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {_number(parts.get("count", 0))}')
+        lines.append(f"{name}_sum{{{labels}}} {_number(parts.get('sum', 0))}")
+        lines.append(f"{name}_count{{{labels}}} {_number(parts.get('count', 0))}")
+    return lines
+
+
+def _route_labels(scope) -> dict:
+    """Router module and path template of the matched route, so ids don't explode the label set"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return {"router": "unmatched", "route": "unmatched"}
+    names = {str(value): f"{{{name}}}" for name, value in (scope.get("path_params") or {}).items()}
+    route = "/".join(names.get(segment, segment) for segment in scope["path"].split("/"))
+    return {"router": endpoint.__module__.rpartition(".")[2], "route": route}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request and counting body bytes,
+    labelled with the router and the route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        received = sent = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal sent, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            labels = _route_labels(scope)
+            metrics.observe(
+                "http_request_duration_seconds", time.perf_counter() - started,
+                method=scope["method"], status=f"{status // 100}xx", **labels
+            )
+            metrics.inc("http_request_bytes_total", received, **labels)
+            metrics.inc("http_response_bytes_total", sent, **labels)
+
+
+metrics = Metrics()
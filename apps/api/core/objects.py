@@ -0,0 +1,464 @@
+import os
+import shutil
+import time
+import uuid
+from stat import S_ISREG
+from typing import Iterator, Optional
+from urllib.parse import quote
+
+from core.capabilities import require
+from core.config import settings
+
+CHUNK_SIZE = 1024 * 1024
+
+# S3 error codes for a missing object (HEAD answers with a bare 404)
+MISSING_CODES = ("404", "NoSuchKey", "NotFound")
+
+
+def _local_path(root: str, key: str) -> str:
+    path = os.path.normpath(os.path.join(root, key))
+    if key.startswith("/") or not path.startswith(os.path.normpath(root) + os.sep):
+        raise ValueError(f"Invalid object key: {key}")
+    return path
+
+
+def _error_code(error) -> Optional[str]:
+    return (getattr(error, "response", None) or {}).get("Error", {}).get("Code")
+
+
+def _read_range(path: str, start: int, end: Optional[int]) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class LocalBackend:
+    """Objects are files under STORAGE_PATH, keyed by their relative path"""
+
+    name = "local"
+
+    def __init__(self, root: str = settings.STORAGE_PATH):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return _local_path(self.root, key)
+
+    def writer(self, key: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _LocalWriter(path)
+
+    def put(self, path: str, key: str):
+        target = self.path(key)
+        if os.path.abspath(path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+
+    def get(self, key: str, path: str):
+        shutil.copyfile(self.path(key), path)
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        return _read_range(self.path(key), start, end)
+
+    def stat(self, key: str) -> Optional[dict]:
+        try:
+            stat = os.stat(self.path(key))
+        except OSError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}"}
+
+    def delete(self, key: str) -> int:
+        path = self.path(key)
+        try:
+            if os.path.isdir(path):
+                size = sum(
+                    os.path.getsize(os.path.join(dirpath, filename))
+                    for dirpath, _, filenames in os.walk(path) for filename in filenames
+                )
+                shutil.rmtree(path, ignore_errors=True)
+                return size
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def scan(self, prefix: str) -> Iterator[dict]:
+        """Top-level entries of a prefix; work dirs come back as a single entry"""
+        directory = os.path.join(self.root, prefix)
+        if not os.path.isdir(directory):
+            return
+        for entry in os.scandir(directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            yield {
+                "key": f"{prefix}/{entry.name}",
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "is_file": entry.is_file(),
+            }
+
+    def url(self, key: str, filename: str) -> Optional[str]:
+        # Served by the API's /download route
+        return None
+
+
+class _LocalWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class S3Backend:
+    """
+    Objects in an S3-compatible bucket (AWS, MinIO, Ceph, R2, ...).
+
+    Files go up as multipart uploads and come down as parallel ranged GETs,
+    both in S3_PART_SIZE_MB parts. Downloads are handed to clients as
+    presigned URLs so the bytes never pass through the API.
+    """
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str = settings.S3_BUCKET,
+        endpoint_url: str = settings.S3_ENDPOINT_URL,
+        public_endpoint_url: str = settings.S3_PUBLIC_ENDPOINT_URL,
+        prefix: str = settings.S3_PREFIX,
+    ):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or None
+        self.public_endpoint_url = public_endpoint_url or self.endpoint_url
+        self.prefix = prefix.strip("/")
+        self.part_size = max(5, settings.S3_PART_SIZE_MB) * 1024 * 1024
+        self._client = None
+        self._public_client = None
+        self._transfer_config = None
+
+    def _make_client(self, endpoint_url: Optional[str]):
+        boto3 = require("boto3", "S3 object storage")
+        botocore_config = require("botocore.config", "S3 object storage")
+        return boto3.session.Session().client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=settings.S3_REGION or None,
+            aws_access_key_id=settings.S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY or None,
+            config=botocore_config.Config(
+                signature_version="s3v4",
+                s3={"addressing_style": settings.S3_ADDRESSING_STYLE},
+                max_pool_connections=max(10, settings.S3_MAX_CONCURRENCY * 2),
+            ),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._make_client(self.endpoint_url)
+        return self._client
+
+    @property
+    def public_client(self):
+        """Signs URLs for the host clients reach, which may differ from the one workers use"""
+        if self.public_endpoint_url == self.endpoint_url:
+            return self.client
+        if self._public_client is None:
+            self._public_client = self._make_client(self.public_endpoint_url)
+        return self._public_client
+
+    @property
+    def transfer_config(self):
+        if self._transfer_config is None:
+            transfer = require("boto3.s3.transfer", "S3 object storage")
+            self._transfer_config = transfer.TransferConfig(
+                multipart_threshold=self.part_size,
+                multipart_chunksize=self.part_size,
+                max_concurrency=settings.S3_MAX_CONCURRENCY,
+            )
+        return self._transfer_config
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def writer(self, key: str):
+        return _MultipartWriter(self, self._key(key))
+
+    def put(self, path: str, key: str):
+        self.client.upload_file(path, self.bucket, self._key(key), Config=self.transfer_config)
+        os.remove(path)
+
+    def get(self, key: str, path: str):
+        self.client.download_file(self.bucket, self._key(key), path, Config=self.transfer_config)
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        extra = {"Range": f"bytes={start}-{'' if end is None else end}"} if start or end is not None else {}
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key), **extra)["Body"]
+        try:
+            yield from body.iter_chunks(CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def stat(self, key: str) -> Optional[dict]:
+        exceptions = require("botocore.exceptions", "S3 object storage")
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except exceptions.ClientError as e:
+            if _error_code(e) in MISSING_CODES:
+                return None
+            raise
+        return {
+            "size": head["ContentLength"],
+            "mtime": head["LastModified"].timestamp(),
+            "etag": head["ETag"].strip('"'),
+        }
+
+    def delete(self, key: str) -> int:
+        stat = self.stat(key)
+        if stat is None:
+            return 0
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return stat["size"]
+
+    def scan(self, prefix: str) -> Iterator[dict]:
+        strip = len(self._key(""))
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(f"{prefix}/")):
+            for item in page.get("Contents", []):
+                yield {
+                    "key": item["Key"][strip:],
+                    "size": item["Size"],
+                    "mtime": item["LastModified"].timestamp(),
+                    "is_file": True,
+                }
+
+    def url(self, key: str, filename: str) -> Optional[str]:
+        return self.public_client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._key(key),
+                "ResponseContentDisposition": f"attachment; filename*=utf-8''{quote(filename)}",
+            },
+            ExpiresIn=settings.S3_PRESIGN_TTL,
+        )
+
+
+class _MultipartWriter:
+    """
+    Streams bytes into an object: parts are sent as soon as S3_PART_SIZE_MB
+    has been buffered, so an upload never has to land on local disk first.
+    Objects smaller than one part are sent with a single PUT.
+    """
+
+    def __init__(self, backend: S3Backend, key: str):
+        self.backend = backend
+        self.key = key
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, data: bytes):
+        self._buffer += data
+        while len(self._buffer) >= self.backend.part_size:
+            self._send(bytes(self._buffer[:self.backend.part_size]))
+            del self._buffer[:self.backend.part_size]
+
+    def _send(self, body: bytes):
+        client = self.backend.client
+        if self._upload_id is None:
+            self._upload_id = client.create_multipart_upload(Bucket=self.backend.bucket, Key=self.key)["UploadId"]
+        number = len(self._parts) + 1
+        response = client.upload_part(
+            Bucket=self.backend.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=body
+        )
+        self._parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    def close(self):
+        client = self.backend.client
+        if self._upload_id is None:
+            client.put_object(Bucket=self.backend.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        if self._buffer:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        client.complete_multipart_upload(
+            Bucket=self.backend.bucket, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def abort(self):
+        self._buffer.clear()
+        if self._upload_id is not None:
+            self.backend.client.abort_multipart_upload(
+                Bucket=self.backend.bucket, Key=self.key, UploadId=self._upload_id
+            )
+
+
+BACKENDS = {"local": LocalBackend, "s3": S3Backend}
+
+
+class ObjectStore:
+    """
+    Where uploads and outputs live, addressed by key ("uploads/<id>.mp4",
+    "downloads/<name>"). Tasks take and return keys, never absolute paths, so
+    the API and workers can run on different hosts.
+
+    With the local backend a key is simply a path under STORAGE_PATH, so
+    fetch() costs nothing and a shared volume behaves exactly as before.
+    With S3, fetch() is a read-through cache: the object is downloaded once
+    into OBJECT_CACHE_PATH on the worker, where ffmpeg and Pillow can seek in
+    it, and the least recently used copies are dropped past OBJECT_CACHE_MB.
+    """
+
+    def __init__(
+        self,
+        backend: str = settings.STORAGE_BACKEND,
+        root: str = settings.STORAGE_PATH,
+        cache_path: str = settings.OBJECT_CACHE_PATH,
+        cache_bytes: int = settings.OBJECT_CACHE_MB * 1024 * 1024,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown storage backend: {backend}")
+        self.root = root
+        self.backend = LocalBackend(root) if backend == "local" else BACKENDS[backend]()
+        self.cache_path = cache_path or os.path.join(root, "cache")
+        self.cache_bytes = cache_bytes
+
+    @property
+    def local(self) -> bool:
+        return self.backend.name == "local"
+
+    def key_for(self, path: str) -> str:
+        """Key of a file written under STORAGE_PATH (or fetched into the cache)"""
+        path = os.path.abspath(path)
+        cache = os.path.abspath(self.cache_path)
+        base = cache if path.startswith(cache + os.sep) else os.path.abspath(self.root)
+        return os.path.relpath(path, base)
+
+    def _cache_file(self, key: str) -> str:
+        return _local_path(self.cache_path, key)
+
+    def writer(self, key: str):
+        """File-like object with write/close/abort that streams into a new object"""
+        return self.backend.writer(key)
+
+    def put(self, path: str, key: Optional[str] = None) -> str:
+        """Make a local file the object at key (default: its path under STORAGE_PATH); the file is consumed"""
+        key = key or self.key_for(path)
+        self.backend.put(path, key)
+        return key
+
+    def fetch(self, key: str) -> str:
+        """Local path of an object, downloading it into the read-through cache if needed"""
+        if self.local:
+            path = self.backend.path(key)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Object not found: {key}")
+            return path
+
+        path = self._cache_file(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            self.backend.get(key, partial)
+            os.replace(partial, path)
+        except Exception as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            if _error_code(e) in MISSING_CODES:
+                raise FileNotFoundError(f"Object not found: {key}")
+            raise
+        self.trim_cache()
+        return path
+
+    def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        return self.backend.stream(key, start, end)
+
+    def stat(self, key: str) -> Optional[dict]:
+        return self.backend.stat(key)
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def size(self, key: str) -> int:
+        """Object size, read from a local copy when there is one"""
+        local = self.backend.path(key) if self.local else self._cache_file(key)
+        if os.path.isfile(local):
+            return os.path.getsize(local)
+        stat = self.stat(key)
+        return stat["size"] if stat else 0
+
+    def delete(self, key: str) -> int:
+        """Remove an object and any cached copy; returns the bytes freed"""
+        if not self.local:
+            try:
+                os.remove(self._cache_file(key))
+            except OSError:
+                pass
+        return self.backend.delete(key)
+
+    def scan(self, prefix: str) -> Iterator[dict]:
+        return self.backend.scan(prefix)
+
+    def url(self, key: str, filename: str) -> Optional[str]:
+        """Direct download URL, or None when the API has to serve the object itself"""
+        return self.backend.url(key, filename)
+
+    def trim_cache(self):
+        """
+        Drop the least recently fetched cache files past OBJECT_CACHE_MB.
+        Files fetched within STORAGE_MIN_AGE are kept: a running job may
+        still be about to open them.
+        """
+        entries, total = [], 0
+        for dirpath, _, filenames in os.walk(self.cache_path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        if total <= self.cache_bytes:
+            return
+
+        cutoff = time.time() - settings.STORAGE_MIN_AGE
+        for mtime, size, path in sorted(entries):
+            if total <= self.cache_bytes or mtime > cutoff:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+object_store = ObjectStore()
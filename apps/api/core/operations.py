@@ -0,0 +1,82 @@
+# Task options the API validates requests against and the services run;
+# kept free of the worker backends so the routers can import them cheaply
+
+import math
+
+IMAGE_OPERATIONS = {"resize", "thumbnail", "rotate", "grayscale", "remove_bg", "convert"}
+
+# Numeric fields of the operations that take them; sizes are whole pixels
+OPERATION_FIELDS = {
+    "resize": {"width": int, "height": int},
+    "thumbnail": {"width": int, "height": int},
+    "rotate": {"degrees": float},
+}
+
+GIF_FORMATS = {"gif", "webp", "mp4"}
+GIF_DITHERS = {"none", "bayer", "heckbert", "floyd_steinberg", "sierra2", "sierra2_4a"}
+
+# Target-size compression: one CRF encode capped by the VBV, or two-pass ABR
+COMPRESS_METHODS = {"vbr", "2pass"}
+
+def fuse_operations(operations: list) -> list:
+    """
+    Collapse an operation list into the minimal plan:
+    consecutive resizes become one resize to the final size, consecutive
+    right-angle rotations become one rotation by the summed angle, repeated
+    grayscale steps collapse and "convert" steps are dropped (their format is
+    the output format, see output_format).
+    Other rotations expand the canvas each time, so they are kept as they are.
+    """
+    plan = []
+    for operation in operations:
+        op = operation.get("op")
+        if op not in IMAGE_OPERATIONS:
+            raise ValueError(f"Unknown image operation: {op}")
+        _check_fields(operation)
+        if op == "convert":
+            if not isinstance(operation.get("format", ""), str):
+                raise ValueError("convert format must be a string")
+            continue
+
+        previous = plan[-1] if plan else None
+        if previous and previous["op"] == op == "resize":
+            plan[-1] = {**previous, **operation}
+        elif previous and previous["op"] == op == "rotate" and _right_angle(previous) and _right_angle(operation):
+            degrees = (previous.get("degrees", 90) + operation.get("degrees", 90)) % 360
+            plan[-1] = {"op": "rotate", "degrees": degrees}
+        elif previous and previous["op"] == op == "thumbnail":
+            plan[-1] = {
+                "op": "thumbnail",
+                "width": min(previous.get("width", 2 ** 31), operation.get("width", 2 ** 31)),
+                "height": min(previous.get("height", 2 ** 31), operation.get("height", 2 ** 31)),
+            }
+        elif previous and previous["op"] == op == "grayscale":
+            continue
+        else:
+            plan.append(dict(operation))
+
+    return [operation for operation in plan if not (operation["op"] == "rotate" and operation.get("degrees", 90) % 360 == 0)]
+
+def _check_fields(operation: dict):
+    op = operation["op"]
+    for field, kind in OPERATION_FIELDS.get(op, {}).items():
+        if field not in operation:
+            continue
+        value = operation[field]
+        if kind is int:
+            if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+                raise ValueError(f"{op} {field} must be a positive integer")
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{op} {field} must be a number")
+
+def _right_angle(operation: dict) -> bool:
+    return operation.get("degrees", 90) % 90 == 0
+
+def output_format(operations: list, params: dict, default: str) -> str:
+    """The output format: the last pipeline "convert" step's, else params', else default"""
+    requested = next(
+        (operation["format"] for operation in reversed(operations) if operation.get("op") == "convert" and operation.get("format")),
+        None,
+    )
+    target_format = (requested or params.get("format") or default).upper()
+    return "JPEG" if target_format == "JPG" else target_format
@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from core.config import settings
+
+
+def profile_dir() -> str:
+    path = f"{settings.STORAGE_PATH}/profiles"
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def should_profile(task_name: str) -> bool:
+    return "*" in settings.PROFILE_TASKS or task_name in settings.PROFILE_TASKS
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack every interval from a side thread and
+    counts identical stacks, giving the "folded" format that flamegraph.pl,
+    speedscope and inferno read directly (one "a;b;c count" line per stack).
+
+    Nothing is installed into the profiled thread, so the job runs at full
+    speed apart from the GIL the sampler briefly takes. Time spent inside
+    C code (Pillow, ffmpeg waits) shows up on the Python frame that called it.
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = settings.PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> float:
+        """Stop sampling; returns the profiled wall time"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        return time.monotonic() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def save(self, name: str, directory: Optional[str] = None, keep: int = settings.PROFILE_KEEP) -> str:
+        """Write the folded stacks to <directory>/<name>.folded and prune the oldest profiles past keep"""
+        directory = directory or profile_dir()
+        path = os.path.join(directory, f"{name}.folded")
+        with open(path, "w") as f:
+            f.write(self.folded())
+
+        profiles = sorted(
+            (entry for entry in os.scandir(directory) if entry.name.endswith(".folded")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in profiles[:max(0, len(profiles) - keep)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        return path
@@ -0,0 +1,48 @@
+import os
+import time
+import threading
+from typing import Optional
+
+from core.config import settings
+
+
+class ProgressReporter:
+    """
+    Rate-limited progress writer for a Celery task.
+
+    Tools report progress many times a second; each update_state is a write
+    to the result backend, so updates closer than min_interval apart are
+    dropped. Call it with a progress dict; force=True always writes.
+    """
+
+    def __init__(self, task, step: str, min_interval: float = settings.PROGRESS_MIN_INTERVAL):
+        self.task = task
+        self.step = step
+        self.min_interval = min_interval
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, progress: dict, force: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last < self.min_interval:
+                return
+            self._last = now
+        self.task.update_state(state='PROCESSING', meta={'step': self.step, 'progress': progress})
+
+
+def throughput(elapsed: float, size_bytes: Optional[int] = None, frames: Optional[int] = None) -> dict:
+    """Final per-task rates for a result: MB/s of input and frames/s of output"""
+    elapsed = max(elapsed, 1e-6)
+    stats = {"elapsed_seconds": round(elapsed, 3)}
+    if size_bytes is not None:
+        stats["size_mb"] = round(size_bytes / (1024 * 1024), 3)
+        stats["mb_per_sec"] = round(size_bytes / (1024 * 1024) / elapsed, 3)
+    if frames:
+        stats["frames"] = frames
+        stats["frames_per_sec"] = round(frames / elapsed, 2)
+    return stats
+
+
+def file_size(path: str) -> Optional[int]:
+    return os.path.getsize(path) if os.path.exists(path) else None
@@ -0,0 +1,153 @@
+import math
+import os
+from typing import Optional
+
+import redis
+from fastapi import HTTPException
+
+from core.config import settings
+
+# Workload class of every task. Each class has its own queue so short I/O
+# jobs never wait behind long encodes, and each queue's workers get their own
+# concurrency and prefetch (see docker-compose.yml).
+TASK_QUEUES = {
+    "download_youtube": "io",
+    "concat_segments": "io",
+    "sweep_storage": "io",
+    "convert_media": "cpu-video",
+    "compress_media": "cpu-video",
+    "encode_segment": "cpu-video",
+    "cut_media": "cpu-video",
+    "create_gif": "cpu-video",
+    "process_image": "cpu-image",
+    "process_image_batch": "cpu-image",
+    "ocr_image": "ocr",
+    # Short pure-Python text jobs share the image workers
+    "diff_text": "cpu-image",
+    "render_markdown": "cpu-image",
+    "render_markdown_batch": "cpu-image",
+}
+QUEUES = ("io", "cpu-video", "cpu-image", "ocr", "ml")
+
+# Where the action/operations sit in the args of image tasks
+IMAGE_TASK_ARGS = {"process_image": (1, 3), "process_image_batch": (1, 4)}
+
+
+def queue_for(task_name: str, args=None) -> str:
+    """Queue a task goes to; image jobs that run a model go to 'ml'"""
+    if task_name in IMAGE_TASK_ARGS and args:
+        action_index, operations_index = IMAGE_TASK_ARGS[task_name]
+        action = args[action_index] if len(args) > action_index else None
+        operations = args[operations_index] if len(args) > operations_index else None
+        steps = [action] + [operation.get("op") for operation in operations or [] if isinstance(operation, dict)]
+        if "remove_bg" in steps:
+            return "ml"
+    return TASK_QUEUES.get(task_name, settings.CELERY_DEFAULT_QUEUE)
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Celery task_routes hook, also applied to send_task"""
+    return {"queue": queue_for(name, args)}
+
+
+def core_budget() -> int:
+    """
+    Cores a single task may use: TASK_CORE_BUDGET if set, otherwise the
+    machine's CPUs split across the worker's concurrency (see apply_core_budget).
+    Passed to ffmpeg's -threads and used to size the OCR, rembg and batch pools.
+    """
+    return settings.TASK_CORE_BUDGET or os.cpu_count() or 1
+
+
+def apply_core_budget(concurrency: int):
+    """
+    Fix the per-task budget in the worker's parent process, before the pool
+    forks, so every child inherits it.
+    """
+    if not settings.TASK_CORE_BUDGET:
+        settings.TASK_CORE_BUDGET = max(1, (os.cpu_count() or 1) // max(1, concurrency))
+
+
+class AdmissionControl:
+    """
+    Backpressure for the API: refuse new work with 429 when a queue is too
+    deep or its estimated wait too long, instead of accepting jobs that would
+    sit for minutes.
+
+    Queue depth is read straight from the Redis broker lists. The estimated
+    wait is depth * average runtime / queue concurrency, where the average is
+    an EWMA that workers keep per queue in ``queue:runtime``.
+    """
+
+    def __init__(self, broker_url: str = settings.CELERY_BROKER_URL, url: str = settings.REDIS_URL):
+        self.broker_url = broker_url
+        self.url = url
+        self._broker = None
+        self._client = None
+
+    @property
+    def broker(self) -> redis.Redis:
+        if self._broker is None:
+            self._broker = redis.Redis.from_url(self.broker_url)
+        return self._broker
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def depth(self, queue: str) -> int:
+        # kombu keeps priority levels in sibling lists named queue\x06\x16<n>
+        pipe = self.broker.pipeline()
+        pipe.llen(queue)
+        for priority in (3, 6, 9):
+            pipe.llen(f"{queue}\x06\x16{priority}")
+        return sum(pipe.execute())
+
+    def record_runtime(self, queue: str, seconds: float, alpha: float = 0.2):
+        current = self.client.hget("queue:runtime", queue)
+        average = seconds if current is None else alpha * seconds + (1 - alpha) * float(current)
+        self.client.hset("queue:runtime", queue, average)
+
+    def estimate(self, queue: str) -> dict:
+        depth = self.depth(queue)
+        runtime = self.client.hget("queue:runtime", queue)
+        concurrency = max(1, settings.QUEUE_CONCURRENCY.get(queue, 1))
+        wait = depth * float(runtime) / concurrency if runtime is not None else None
+        return {"queue": queue, "depth": depth, "avg_runtime": runtime and float(runtime), "estimated_wait": wait}
+
+    def check(self, task_name: str, args=None):
+        """Raise 429 with Retry-After if task_name's queue is saturated"""
+        queue = queue_for(task_name, args)
+        try:
+            state = self.estimate(queue)
+        except redis.RedisError:
+            # Can't see the queue; let the broker decide
+            return
+
+        max_depth = settings.QUEUE_MAX_DEPTH.get(queue)
+        over_depth = max_depth is not None and state["depth"] >= max_depth
+        over_wait = state["estimated_wait"] is not None and state["estimated_wait"] > settings.QUEUE_MAX_WAIT
+        if not (over_depth or over_wait):
+            return
+
+        retry_after = self._retry_after(queue, state, max_depth)
+        raise HTTPException(
+            status_code=429,
+            detail=f"The {queue} queue is busy ({state['depth']} waiting). Try again later.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def _retry_after(self, queue: str, state: dict, max_depth: Optional[int]) -> int:
+        if state["avg_runtime"] is None:
+            return settings.QUEUE_RETRY_AFTER
+        concurrency = max(1, settings.QUEUE_CONCURRENCY.get(queue, 1))
+        # Time until enough jobs drain to get back under both limits
+        excess = state["depth"] - (max_depth - 1 if max_depth else state["depth"])
+        allowed = settings.QUEUE_MAX_WAIT * concurrency / state["avg_runtime"]
+        excess = max(excess, state["depth"] - allowed, 1)
+        return max(1, min(math.ceil(excess * state["avg_runtime"] / concurrency), 10 * 60))
+
+
+admission = AdmissionControl()
@@ -0,0 +1,47 @@
+import importlib
+import threading
+
+# Capability -> (module, singleton). Services are imported on first use, so a
+# worker process only loads the libraries its own queue's tasks touch: the io
+# workers never import Pillow or onnxruntime, the image workers never yt-dlp.
+SERVICES = {
+    "download": ("services.youtube_service", "youtube_service"),
+    "media": ("services.media_service", "media_service"),
+    "image": ("services.image_service", "image_service"),
+    "background": ("services.background_service", "background_service"),
+    "diff": ("services.diff_service", "diff_service"),
+    "markdown": ("services.markdown_service", "markdown_service"),
+}
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def load(capability: str):
+    """The service singleton for capability, importing its module the first time"""
+    service = _loaded.get(capability)
+    if service is None:
+        with _lock:
+            service = _loaded.get(capability)
+            if service is None:
+                module, name = SERVICES[capability]
+                service = _loaded[capability] = getattr(importlib.import_module(module), name)
+    return service
+
+
+def loaded() -> list:
+    return sorted(_loaded)
+
+
+class LazyService:
+    """Stands in for a service singleton until an attribute is first used"""
+
+    def __init__(self, capability: str):
+        self._capability = capability
+
+    def __getattr__(self, name):
+        return getattr(load(self._capability), name)
+
+    def __repr__(self):
+        state = "loaded" if self._capability in _loaded else "not loaded"
+        return f"<LazyService {self._capability} ({state})>"
@@ -0,0 +1,194 @@
+import os
+import time
+from typing import Optional
+
+import redis
+
+from core.config import settings
+from core.objects import ObjectStore, object_store
+
+# Top-level directories under STORAGE_PATH that the sweeper manages
+AREAS = ("uploads", "downloads", "work")
+
+
+class StorageManager:
+    """
+    Lifecycle of stored objects, on whichever backend object_store uses.
+
+    Outputs are registered with an expiry when their task finishes and their
+    last access is bumped on every download. A periodic sweep deletes expired
+    outputs, stale uploads and work dirs left by crashed jobs, then evicts the
+    least recently used outputs until the quota is met.
+
+    Metadata lives in Redis: hash ``storage:expires`` (key -> expiry) and
+    sorted set ``storage:access`` (key -> last access), keyed by object key,
+    which for the local backend is the path relative to STORAGE_PATH.
+    """
+
+    def __init__(
+        self,
+        store: ObjectStore = object_store,
+        url: str = settings.REDIS_URL,
+        quota_bytes: int = settings.STORAGE_QUOTA_MB * 1024 * 1024,
+    ):
+        self.store = store
+        self.url = url
+        self.quota_bytes = quota_bytes
+        self._client = None
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def key(self, area: str, filename: str) -> Optional[str]:
+        """Object key of a file in an area, or None for names that escape it"""
+        if filename != os.path.basename(filename) or filename in ("", ".", ".."):
+            return None
+        return f"{area}/{filename}"
+
+    def register(self, name: str, ttl: int = settings.STORAGE_OUTPUT_TTL):
+        """Record a new artifact; it may be deleted ttl seconds after its last access"""
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.hset("storage:expires", name, now + ttl)
+        pipe.zadd("storage:access", {name: now})
+        pipe.execute()
+
+    def touch(self, name: str):
+        """Mark an artifact as just used, pushing back its expiry and LRU position"""
+        now = time.time()
+        expires = self.client.hget("storage:expires", name)
+        pipe = self.client.pipeline()
+        pipe.zadd("storage:access", {name: now})
+        if expires is not None:
+            pipe.hset("storage:expires", name, max(float(expires), now + settings.STORAGE_OUTPUT_TTL))
+        pipe.execute()
+
+    def _forget(self, names: list):
+        if not names:
+            return
+        pipe = self.client.pipeline()
+        pipe.hdel("storage:expires", *names)
+        pipe.zrem("storage:access", *names)
+        pipe.execute()
+
+    def sweep(self) -> dict:
+        """
+        One GC pass: expire, then enforce the quota. Files younger than
+        STORAGE_MIN_AGE are never touched so in-flight jobs keep their inputs.
+        """
+        now = time.time()
+        expires = {name: float(value) for name, value in self.client.hgetall("storage:expires").items()}
+        access = dict(self.client.zrange("storage:access", 0, -1, withscores=True))
+        untracked_ttl = {
+            "uploads": settings.STORAGE_UPLOAD_TTL,
+            "downloads": settings.STORAGE_OUTPUT_TTL,
+            "work": settings.STORAGE_WORK_TTL,
+        }
+
+        entries, removed, seen, freed, stored = [], [], set(), 0, 0
+        for area in AREAS:
+            for entry in self.store.scan(area):
+                name, mtime = entry["key"], entry["mtime"]
+                seen.add(name)
+                stored += entry["size"] if entry["is_file"] else 0
+                if now - mtime < settings.STORAGE_MIN_AGE:
+                    continue
+                last_used = max(access.get(name, 0), mtime)
+                expiry = expires.get(name, last_used + untracked_ttl[area])
+                if expiry <= now:
+                    freed += self.store.delete(name)
+                    removed.append(name)
+                elif area == "downloads" and entry["is_file"]:
+                    entries.append((last_used, name))
+
+        # The local backend counts everything on the volume, caches and profiles included
+        usage = _tree_size(self.store.root) if self.store.local else stored - freed
+        evicted = []
+        if usage > self.quota_bytes:
+            # Evict least recently used outputs down to the low watermark
+            target = self.quota_bytes * settings.STORAGE_QUOTA_LOW_WATERMARK
+            for _, name in sorted(entries):
+                if usage <= target:
+                    break
+                size = self.store.delete(name)
+                usage -= size
+                freed += size
+                evicted.append(name)
+
+        # Metadata for objects that are gone, however they went
+        stale = [name for name in set(expires) | set(access) if name not in seen]
+        self._forget(list(set(removed + evicted + stale)))
+
+        return {
+            "expired": len(removed),
+            "evicted": len(evicted),
+            "freed_bytes": freed,
+            "usage_bytes": usage,
+            "quota_bytes": self.quota_bytes,
+        }
+
+    def usage(self) -> dict:
+        if self.store.local:
+            usage = _tree_size(self.store.root)
+        else:
+            usage = sum(entry["size"] for area in AREAS for entry in self.store.scan(area))
+        return {
+            "backend": self.store.backend.name,
+            "usage_bytes": usage,
+            "quota_bytes": self.quota_bytes,
+            "tracked": self.client.zcard("storage:access"),
+        }
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _artifacts(result) -> list:
+    if not isinstance(result, dict):
+        return []
+    items = [result]
+    # Batch tasks list their per-item files under "items"
+    for key in ("outputs", "results", "items"):
+        items.extend(item for item in result.get(key) or [] if isinstance(item, dict))
+    return items
+
+
+def artifact_paths(result) -> list:
+    """Local output files referenced by a task result"""
+    return list(dict.fromkeys(item["path"] for item in _artifacts(result) if item.get("path")))
+
+
+def artifact_keys(result) -> list:
+    """Object keys of the outputs referenced by a task result"""
+    return list(dict.fromkeys(item["key"] for item in _artifacts(result) if item.get("key")))
+
+
+def publish_outputs(result):
+    """
+    Store every output a service wrote under STORAGE_PATH as an object and
+    record its key on the result, next to the (worker-local) path.
+    """
+    published = {}
+    for item in _artifacts(result):
+        path = item.get("path")
+        # Items with a key were published by the service, e.g. to cache them
+        if not path or item.get("key"):
+            continue
+        if path not in published:
+            published[path] = object_store.put(path) if os.path.isfile(path) else object_store.key_for(path)
+        item["key"] = published[path]
+    return result
+
+
+storage_manager = StorageManager()
@@ -0,0 +1,102 @@
+import time
+from typing import Optional
+
+import redis.asyncio as aioredis
+from celery import states
+
+from core.config import settings
+
+
+def status_payload(task_id: str, status: str, info) -> dict:
+    """The /tasks response shape for a task's state and meta"""
+    result = None
+    error = None
+    step = None
+    progress = None
+
+    if status == states.SUCCESS:
+        result = info
+    elif status == states.FAILURE:
+        error = str(info)
+    elif isinstance(info, dict):
+        # Custom states like 'PROCESSING' carry step/progress metadata
+        step = info.get("step")
+        progress = info.get("progress")
+        result = info.get("result")
+        error = info.get("error")
+
+    return {
+        "task_id": task_id,
+        "status": status,
+        "result": result,
+        "error": error,
+        "step": step,
+        "progress": progress
+    }
+
+
+def _decode(backend, task_id: str, raw) -> dict:
+    if raw is None:
+        return status_payload(task_id, states.PENDING, None)
+    meta = backend.decode_result(raw)
+    return status_payload(task_id, meta["status"], meta.get("result"))
+
+
+def bulk_status(backend, task_ids: list) -> list:
+    """States of many tasks in one MGET round-trip to the result backend"""
+    if not task_ids:
+        return []
+    raws = backend.client.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    return [_decode(backend, task_id, raw) for task_id, raw in zip(task_ids, raws)]
+
+
+async def watch(
+    backend,
+    task_ids: list,
+    timeout: float = settings.TASK_STREAM_TIMEOUT,
+    heartbeat: float = settings.TASK_STREAM_HEARTBEAT,
+):
+    """
+    Yield status payloads for task_ids as their states change, until all are
+    ready or timeout passes. Yields None every heartbeat seconds of silence.
+
+    The Redis result backend publishes every state write on the task's meta
+    key, so subscribing to those channels sees each transition without polling.
+    """
+    channels = {backend.get_key_for_task(task_id).decode(): task_id for task_id in task_ids}
+    pending = set(task_ids)
+    client = aioredis.from_url(settings.CELERY_RESULT_BACKEND)
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(*channels)
+
+        # Subscribe first, then read current state, so nothing falls in between
+        raws = await client.mget(list(channels))
+        for task_id, raw in zip(task_ids, raws):
+            payload = _decode(backend, task_id, raw)
+            yield payload
+            if payload["status"] in states.READY_STATES:
+                pending.discard(task_id)
+
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+            if message is None:
+                yield None
+                continue
+            task_id = channels.get(message["channel"].decode())
+            if task_id not in pending:
+                continue
+            payload = _decode(backend, task_id, message["data"])
+            yield payload
+            if payload["status"] in states.READY_STATES:
+                pending.discard(task_id)
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def parse_task_ids(value: Optional[str]) -> list:
+    """Comma-separated ids, deduplicated in order"""
+    return list(dict.fromkeys(part.strip() for part in (value or "").split(",") if part.strip()))
@@ -1,7 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from core.config import settings
-from routers import general, visual, media, text
+from core.ingest import UploadLimitMiddleware
+from core.metrics import MetricsMiddleware
+from routers import general, visual, media, text, uploads
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -15,13 +17,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Upload-Offset", "Upload-Length", "Location"],
 )
+app.add_middleware(UploadLimitMiddleware)
+# Outermost, so the timing covers the other middleware too
+app.add_middleware(MetricsMiddleware)
 
 # Include Routers
 app.include_router(general.router, prefix=settings.API_V1_STR, tags=["general"])
 app.include_router(media.router, prefix=f"{settings.API_V1_STR}/media", tags=["media"])
 app.include_router(visual.router, prefix=f"{settings.API_V1_STR}/visual", tags=["visual"])
 app.include_router(text.router, prefix=f"{settings.API_V1_STR}/text", tags=["text"])
+app.include_router(uploads.router, prefix=f"{settings.API_V1_STR}/uploads", tags=["uploads"])
 
 @app.get("/")
 def root():
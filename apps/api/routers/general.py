@@ -1,12 +1,34 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from typing import List
 from celery.result import AsyncResult
 from core.config import settings
-from worker import celery_app
+from core.dispatch import celery_app
+from core.capabilities import capability_registry, report
+from core.cache import result_cache
+from core.metrics import metrics
+from core.objects import object_store
+from core.storage import storage_manager
+from core.queues import admission, QUEUES
+from core.task_status import status_payload, bulk_status, watch, parse_task_ids
+from urllib.parse import quote
+import json
+import mimetypes
 import os
+import redis
 
 router = APIRouter()
 
+class TaskStatusRequest(BaseModel):
+    task_ids: List[str]
+
+def _check_task_ids(task_ids: list):
+    if not task_ids:
+        raise HTTPException(status_code=400, detail="No task ids given")
+    if len(task_ids) > settings.TASK_STATUS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.TASK_STATUS_MAX_IDS} task ids per request")
+
 @router.get("/health")
 def health_check():
     return {
@@ -21,51 +43,161 @@ def ping_celery():
     task = celery_app.send_task("test_task", args=["hello world"])
     return {"task_id": task.id, "status": "submitted"}
 
+@router.post("/tasks/status")
+def get_tasks_status(request: TaskStatusRequest):
+    """
+    States of many tasks in one call, fetched with a single pipelined read.
+    """
+    task_ids = list(dict.fromkeys(request.task_ids))
+    _check_task_ids(task_ids)
+    return {"tasks": bulk_status(celery_app.backend, task_ids)}
+
+@router.get("/tasks/events")
+async def stream_tasks_status(ids: str):
+    """
+    Server-sent events for comma-separated task ids: one 'status' event per
+    state change, ending when every task has finished.
+    """
+    task_ids = parse_task_ids(ids)
+    _check_task_ids(task_ids)
+
+    async def events():
+        async for payload in watch(celery_app.backend, task_ids):
+            if payload is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(payload, default=str)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+@router.websocket("/tasks/ws")
+async def tasks_websocket(websocket: WebSocket):
+    """
+    Send {"task_ids": [...]} once; status payloads are pushed as they change
+    and the socket is closed when every task has finished.
+    """
+    await websocket.accept()
+    try:
+        message = await websocket.receive_json()
+        task_ids = list(dict.fromkeys(message.get("task_ids") or []))
+        if not task_ids or len(task_ids) > settings.TASK_STATUS_MAX_IDS:
+            await websocket.close(code=1008, reason="Invalid task_ids")
+            return
+        async for payload in watch(celery_app.backend, task_ids):
+            if payload is not None:
+                await websocket.send_text(json.dumps(payload, default=str))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @router.get("/tasks/{task_id}")
 def get_task_status(task_id: str):
     task_result = AsyncResult(task_id, app=celery_app)
-    
     # Use .info instead of .result to avoid exception deserialization issues
-    info = task_result.info
-    result = None
-    error = None
-    step = None
-
-    if task_result.status == "SUCCESS":
-        result = info
-    elif task_result.status == "FAILURE":
-        error = str(info)
-    elif isinstance(info, dict):
-        # This handles custom states like 'PROCESSING' with metadata
-        step = info.get("step")
-        result = info.get("result")
-        if not error:
-            error = info.get("error")
+    return status_payload(task_id, task_result.status, task_result.info)
 
-    return {
-        "task_id": task_id,
-        "status": task_result.status,
-        "result": result,
-        "error": error,
-        "step": step
-    }
+@router.get("/cache/stats")
+def cache_stats():
+    return result_cache.stats()
+
+@router.get("/queues/stats")
+def queue_stats():
+    return {"queues": [admission.estimate(queue) for queue in QUEUES]}
 
-def remove_file(path: str):
-    """Background task to remove file after download"""
+@router.get("/storage/stats")
+def storage_stats():
+    return storage_manager.usage()
+
+@router.get("/capabilities")
+def capabilities():
+    """Optional backends and the features they enable, as reported by each worker and seen by the API"""
     try:
-        if os.path.exists(path):
-            os.remove(path)
-            # Also try to remove the source upload if it exists
-            # This is a bit tricky as we don't always have the input path here
-    except Exception:
-        pass
+        workers = capability_registry.workers()
+    except redis.RedisError:
+        workers = None
+    return {"api": report(), "workers": workers}
+
+@router.get("/metrics")
+def metrics_endpoint():
+    """API and worker metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _byte_range(range_header: str, size: int):
+    """(start, end) of a single 'bytes=' range, or None when it can't be served as one"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            length = int(end)
+            return (max(0, size - length), size - 1) if length else None
+        start, end = int(start), int(end) if end else size - 1
+    except ValueError:
+        return None
+    return (start, min(end, size - 1)) if start <= end and start < size else None
 
-@router.get("/download/{filename}")
-def download_file(filename: str, background_tasks: BackgroundTasks):
-    file_path = os.path.join(f"{settings.STORAGE_PATH}/downloads", filename)
-    if not os.path.exists(file_path):
+@router.api_route("/download/{filename}", methods=["GET", "HEAD"])
+def download_file(filename: str, request: Request):
+    """
+    Serve an output. Files stay until the storage sweeper expires or evicts
+    them, so downloads can be retried, resumed and split into Range requests.
+    Objects on S3 are answered with a redirect to a presigned URL.
+    """
+    key = storage_manager.key("downloads", filename)
+    stat = object_store.stat(key) if key else None
+    if stat is None:
         raise HTTPException(status_code=404, detail="File not found")
-    
-    background_tasks.add_task(remove_file, file_path)
-    return FileResponse(file_path, filename=filename)
 
+    etag = f'"{stat["etag"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    storage_manager.touch(key)
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    if not object_store.local:
+        url = object_store.url(key, filename) if settings.DOWNLOAD_REDIRECT else None
+        if url:
+            headers["Cache-Control"] = "no-store"
+            return RedirectResponse(url, status_code=307, headers=headers)
+
+        # Proxy the object, one range at most
+        headers.update({"Accept-Ranges": "bytes", "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"})
+        byte_range = _byte_range(request.headers.get("range", ""), stat["size"])
+        start, end = byte_range or (0, stat["size"] - 1)
+        headers["Content-Length"] = str(end - start + 1)
+        status_code = 200
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat['size']}"
+            status_code = 206
+        if request.method == "HEAD":
+            return Response(status_code=status_code, headers=headers, media_type=media_type)
+        return StreamingResponse(
+            object_store.stream(key, start, end), status_code=status_code, headers=headers, media_type=media_type
+        )
+
+    file_path = object_store.backend.path(key)
+    if settings.DOWNLOAD_OFFLOAD_HEADER:
+        # The front proxy serves the bytes (sendfile, ranges) from its own mount
+        offload = settings.DOWNLOAD_OFFLOAD_HEADER
+        headers[offload] = (
+            f"{settings.DOWNLOAD_OFFLOAD_PREFIX}/{quote(filename)}"
+            if offload.lower() == "x-accel-redirect" else os.path.abspath(file_path)
+        )
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+        return Response(headers=headers, media_type=media_type)
+
+    # FileResponse handles Range/If-Range and uses the server's zero-copy
+    # pathsend extension when available
+    return FileResponse(file_path, filename=filename, headers=headers, stat_result=os.stat(file_path))
@@ -1,13 +1,36 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
+import hashlib
+import json
 from core.config import settings
-import shutil
-import os
-import uuid
+from core.dispatch import celery_app
+from core.cache import submit_cached, submit_deduplicated, result_cache
+from core.ingest import save_upload
+from core.queues import admission
+from core.operations import COMPRESS_METHODS, GIF_DITHERS, GIF_FORMATS
 
 router = APIRouter()
 
+def validate_cut(start_time, end_time, mode: str, ranges):
+    """Validate cut options (ranges already parsed) before anything is queued"""
+    if mode not in ("fast", "smart"):
+        raise HTTPException(status_code=400, detail="mode must be 'fast' or 'smart'")
+    if ranges is not None and (
+        mode != "smart" or not isinstance(ranges, list) or not ranges
+        or not all(isinstance(r, list) and len(r) == 2 and all(isinstance(t, (str, int, float)) for t in r) for r in ranges)
+    ):
+        raise HTTPException(status_code=400, detail="ranges must be a non-empty list of [start, end] pairs and need mode 'smart'")
+    if ranges is None and (start_time is None or end_time is None):
+        raise HTTPException(status_code=400, detail="start_time and end_time are required")
+
+def validate_gif(dither: str, output_format: str):
+    if output_format.lower() not in GIF_FORMATS:
+        raise HTTPException(status_code=400, detail=f"output_format must be one of: {', '.join(sorted(GIF_FORMATS))}")
+    if dither not in GIF_DITHERS:
+        raise HTTPException(status_code=400, detail=f"dither must be one of: {', '.join(sorted(GIF_DITHERS))}")
+
 class DownloadRequest(BaseModel):
     url: str
     format: str = "mp4"
@@ -17,112 +40,130 @@ class DownloadRequest(BaseModel):
 def download_media(request: DownloadRequest):
     """
     Download video from YouTube, Twitter, Instagram etc.
+    Requests for the same URL, format and quality share one download.
     """
-    from worker import celery_app
-    task = celery_app.send_task(
-        "download_youtube", # Reusing generic downloader
-        args=[request.url, request.format, request.quality]
+    admission.check("download_youtube")
+    url = request.url.strip()
+    key = result_cache.make_key(
+        "download_youtube", hashlib.sha256(url.encode()).hexdigest(),
+        {"format": request.format, "quality": request.quality}
     )
-    return {"task_id": task.id, "status": "queued"}
+    task_id, cache_state = submit_deduplicated(
+        celery_app, "download_youtube", key,
+        args=[url, request.format, request.quality] # Reusing generic downloader
+    )
+    return {"task_id": task_id, "status": "queued", "cache": cache_state}
 
 @router.post("/convert")
-def convert_media(
+async def convert_media(
     file: UploadFile = File(...), 
     target_format: str = Form("mp3")
 ):
-    from worker import celery_app
-    
-    upload_dir = f"{settings.STORAGE_PATH}/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1]
-    saved_filename = f"{file_id}{file_ext}"
-    file_path = f"{upload_dir}/{saved_filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    task = celery_app.send_task(
-        "convert_media",
-        args=[file_path, target_format]
+    await run_in_threadpool(admission.check, "convert_media")
+    upload = await save_upload(file, "media")
+
+    task_id, cache_state = await run_in_threadpool(
+        submit_cached, celery_app, "convert_media",
+        upload.key, args=[upload.key, target_format],
+        params={"target_format": target_format.lower()}, digest=upload.digest,
+        kwargs={"digest": upload.digest}
     )
     
-    return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
+    return {"task_id": task_id, "status": "queued", "cache": cache_state, "original_filename": file.filename}
 
 @router.post("/compress")
-def compress_media_endpoint(
+async def compress_media_endpoint(
     file: UploadFile = File(...),
-    crf: int = Form(28)
+    crf: int = Form(28),
+    target_size_mb: Optional[float] = Form(None),
+    target_bitrate: Optional[int] = Form(None),
+    method: str = Form("vbr"),
+    allow_downscale: bool = Form(False)
 ):
-    from worker import celery_app
-    
-    upload_dir = f"{settings.STORAGE_PATH}/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1]
-    saved_filename = f"{file_id}{file_ext}"
-    file_path = f"{upload_dir}/{saved_filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    task = celery_app.send_task(
-        "compress_media",
-        args=[file_path, crf]
+    """
+    Compress at a fixed CRF, or to a file size (target_size_mb) or an overall
+    bitrate in kbps (target_bitrate). Targets are met in one encode ('vbr') or
+    two passes ('2pass'), using a CRF predicted from short sample encodes;
+    allow_downscale lowers the resolution when the target is too tight for
+    the source resolution.
+    """
+    if method not in COMPRESS_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of: {', '.join(sorted(COMPRESS_METHODS))}")
+    if target_size_mb is not None and target_bitrate is not None:
+        raise HTTPException(status_code=400, detail="Give target_size_mb or target_bitrate, not both")
+    if (target_size_mb is not None and target_size_mb <= 0) or (target_bitrate is not None and target_bitrate <= 0):
+        raise HTTPException(status_code=400, detail="Targets must be positive")
+    target = None
+    if target_size_mb is not None or target_bitrate is not None:
+        target = {
+            "bytes": int(target_size_mb * 1024 * 1024) if target_size_mb is not None else None,
+            "kbps": target_bitrate,
+            "method": method,
+            "allow_downscale": allow_downscale,
+        }
+
+    await run_in_threadpool(admission.check, "compress_media")
+    upload = await save_upload(file, "media")
+
+    task_id, cache_state = await run_in_threadpool(
+        submit_cached, celery_app, "compress_media",
+        upload.key, args=[upload.key, crf, target],
+        params={"crf": crf, "target": target}, digest=upload.digest,
+        kwargs={"digest": upload.digest}
     )
     
-    return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
+    return {"task_id": task_id, "status": "queued", "cache": cache_state, "original_filename": file.filename}
 
 @router.post("/cut")
-def cut_media_endpoint(
+async def cut_media_endpoint(
     file: UploadFile = File(...),
-    start_time: str = Form(...),
-    end_time: str = Form(...)
+    start_time: Optional[str] = Form(None),
+    end_time: Optional[str] = Form(None),
+    mode: str = Form("fast"),
+    ranges: Optional[str] = Form(None),
+    join: bool = Form(True)
 ):
-    from worker import celery_app
-    
-    upload_dir = f"{settings.STORAGE_PATH}/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1]
-    saved_filename = f"{file_id}{file_ext}"
-    file_path = f"{upload_dir}/{saved_filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    task = celery_app.send_task(
-        "cut_media",
-        args=[file_path, start_time, end_time]
+    """
+    mode 'fast' stream-copies and snaps to keyframes; 'smart' is frame accurate
+    and only re-encodes the boundary GOPs. Smart mode also accepts several
+    ranges as JSON [["00:00:05", "00:00:10"], [42, 50.5]], joined into one
+    output unless join is false.
+    """
+    try:
+        parsed_ranges = json.loads(ranges) if ranges else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid ranges: {str(e)}")
+    validate_cut(start_time, end_time, mode, parsed_ranges)
+
+    await run_in_threadpool(admission.check, "cut_media")
+    upload = await save_upload(file, "media")
+
+    task = await run_in_threadpool(
+        celery_app.send_task, "cut_media",
+        args=[upload.key, start_time, end_time, mode, parsed_ranges, join]
     )
     
     return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
 
 @router.post("/gif")
-def create_gif_endpoint(
+async def create_gif_endpoint(
     file: UploadFile = File(...),
     fps: int = Form(10),
-    width: int = Form(480)
+    width: int = Form(480),
+    start_time: Optional[str] = Form(None),
+    duration: Optional[str] = Form(None),
+    dither: str = Form("sierra2_4a"),
+    max_bytes: Optional[int] = Form(None),
+    output_format: str = Form("gif")
 ):
-    from worker import celery_app
-    
-    upload_dir = f"{settings.STORAGE_PATH}/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1]
-    saved_filename = f"{file_id}{file_ext}"
-    file_path = f"{upload_dir}/{saved_filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    task = celery_app.send_task(
-        "create_gif",
-        args=[file_path, fps, width]
+    validate_gif(dither, output_format)
+
+    await run_in_threadpool(admission.check, "create_gif")
+    upload = await save_upload(file, "media")
+
+    task = await run_in_threadpool(
+        celery_app.send_task, "create_gif",
+        args=[upload.key, fps, width, start_time, duration, dither, max_bytes, output_format.lower()]
     )
     
     return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
@@ -1,19 +1,26 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
 from pydantic import BaseModel
-from typing import Optional
-import json
+from typing import List, Optional
 import base64
-import difflib
-import markdown
-from xhtml2pdf import pisa
-import os
-import uuid
 from core.config import settings
+from core.dispatch import celery_app
+from core.cache import submit_deduplicated
+from core.ingest import store_text
+from core.queues import admission
+from services.diff_service import diff_service, DIFF_FORMATS
+from services.markdown_service import markdown_service, PAGE_SIZES
+from services.json_service import json_service, JsonStreamError, StreamFormatter, NdjsonFormatter, NdjsonValidator
 
 router = APIRouter()
 
 class JsonRequest(BaseModel):
     data: str
+    sort_keys: bool = False
+    minify: bool = False
+    indent: int = 2
 
 class Base64Request(BaseModel):
     data: str
@@ -22,19 +29,124 @@ class Base64Request(BaseModel):
 class MarkdownRequest(BaseModel):
     data: str
     target: str  # 'html' or 'pdf'
+    page_size: str = "A4"
+
+class MarkdownDocument(BaseModel):
+    data: str
+    name: Optional[str] = None
+
+class MarkdownBatchRequest(BaseModel):
+    documents: List[MarkdownDocument]
+    page_size: str = "A4"
+    make_zip: bool = True
 
 class DiffRequest(BaseModel):
     text1: str
     text2: str
+    format: str = "html"  # 'html', 'unified' or 'json'
+    context: int = settings.DIFF_CONTEXT
+    word_diff: bool = True
+
+async def _body_chunks(request: Request):
+    """The raw request body, or the 'file' field of a multipart upload, in chunks"""
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=400, detail="Missing 'file' field")
+        try:
+            while chunk := await upload.read(settings.UPLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await form.close()
+    else:
+        async for chunk in request.stream():
+            if chunk:
+                yield chunk
+
+
+async def _stream_response(chunks, processor, media_type: str) -> StreamingResponse:
+    """Run chunks through a feed/close processor off the event loop and stream its output"""
+    async def outputs():
+        async for chunk in chunks:
+            output = await run_in_threadpool(processor.feed, chunk)
+            if output:
+                yield output
+        yield await run_in_threadpool(processor.close)
+
+    body = outputs()
+    # Read up to the first output so early errors still get a 400; a later
+    # one can only cut the response short
+    first = ""
+    try:
+        while not first:
+            first = await body.__anext__()
+    except StopAsyncIteration:
+        pass
+    except JsonStreamError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+
+    async def rest():
+        yield first
+        async for output in body:
+            yield output
+
+    return StreamingResponse(rest(), media_type=media_type)
+
+
+def _check_indent(indent: int):
+    if not 0 <= indent <= settings.JSON_MAX_INDENT:
+        raise HTTPException(status_code=400, detail=f"indent must be between 0 and {settings.JSON_MAX_INDENT}")
 
 @router.post("/json/format")
 def format_json(request: JsonRequest):
+    _check_indent(request.indent)
+    if len(request.data) > settings.JSON_MAX_INLINE_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f"JSON over {settings.JSON_MAX_INLINE_MB} MB; send it to /text/json/stream instead"
+        )
     try:
-        parsed = json.loads(request.data)
-        return {"status": "success", "data": json.dumps(parsed, indent=2)}
-    except json.JSONDecodeError as e:
+        formatted = json_service.format(
+            request.data, indent=None if request.minify else request.indent, sort_keys=request.sort_keys
+        )
+        return {"status": "success", "data": formatted}
+    except ValueError as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
 
+@router.post("/json/stream")
+async def stream_json(request: Request, minify: bool = False, indent: int = 2):
+    """
+    Pretty-print or minify a JSON document of any size, sent as the raw body
+    or as a multipart 'file'. The result streams back as it is produced.
+    Sorting keys needs the whole document, so only /json/format offers it.
+    """
+    _check_indent(indent)
+    formatter = StreamFormatter(None if minify else indent)
+    return await _stream_response(_body_chunks(request), formatter, "application/json")
+
+@router.post("/ndjson")
+async def ndjson_tool(request: Request, mode: str = "format", sort_keys: bool = False):
+    """
+    Newline-delimited JSON, one record at a time: 'format' streams every
+    record back compacted (optionally with sorted keys), 'validate' reports
+    which lines don't parse.
+    """
+    if mode == "validate":
+        validator = NdjsonValidator(json_service)
+        try:
+            async for chunk in _body_chunks(request):
+                await run_in_threadpool(validator.feed, chunk)
+            await run_in_threadpool(validator.close)
+        except JsonStreamError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid NDJSON: {str(e)}")
+        return {"status": "success", **validator.report()}
+    if mode != "format":
+        raise HTTPException(status_code=400, detail="mode must be 'format' or 'validate'")
+    return await _stream_response(
+        _body_chunks(request), NdjsonFormatter(json_service, sort_keys), "application/x-ndjson"
+    )
+
 @router.post("/base64")
 def base64_tool(request: Base64Request):
     try:
@@ -49,26 +161,74 @@ def base64_tool(request: Base64Request):
 
 @router.post("/diff")
 def diff_checker(request: DiffRequest):
-    d = difflib.HtmlDiff()
-    diff_html = d.make_file(request.text1.splitlines(), request.text2.splitlines())
-    return {"status": "success", "data": diff_html}
+    """
+    Diff two texts. Small diffs are answered inline; past DIFF_SYNC_MAX_LINES
+    lines, or DIFF_SYNC_MAX_CHANGED_KB on the changed lines, the diff runs on
+    a worker and the response is a task whose result is the rendered diff as
+    a downloadable file.
+    """
+    if request.format not in DIFF_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {request.format}")
+    if not 0 <= request.context <= 1000:
+        raise HTTPException(status_code=400, detail="context must be between 0 and 1000")
+    if len(request.text1) + len(request.text2) > settings.DIFF_MAX_INPUT_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Inputs exceed the {settings.DIFF_MAX_INPUT_MB} MB diff limit")
+
+    lines = request.text1.count("\n") + request.text2.count("\n")
+    # Aligning lines is cheap next to rendering the changes, so how big the
+    # changes are decides; the line cap bounds the alignment itself
+    alignment = diff_service.align(request.text1, request.text2) if lines <= settings.DIFF_SYNC_MAX_LINES else None
+    if alignment is None or diff_service.changed_bytes(alignment) > settings.DIFF_SYNC_MAX_CHANGED_KB * 1024:
+        admission.check("diff_text")
+        keys = [store_text(text) for text in (request.text1, request.text2)]
+        task = celery_app.send_task(
+            "diff_text",
+            args=[*keys, request.format, request.context, request.word_diff]
+        )
+        return {"task_id": task.id, "status": "queued"}
+
+    result = diff_service.diff(
+        request.text1, request.text2, request.format, request.context, words=request.word_diff, alignment=alignment
+    )
+    return {"status": "success", **result}
+
+def _check_markdown(sources: list, page_size: str):
+    if page_size not in PAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unsupported page size: {page_size}")
+    if sum(len(source) for source in sources) > settings.MARKDOWN_MAX_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Markdown exceeds the {settings.MARKDOWN_MAX_MB} MB limit")
 
 @router.post("/markdown")
 def markdown_tool(request: MarkdownRequest):
-    html = markdown.markdown(request.data)
-    
+    """
+    HTML is rendered inline. PDFs are rendered by a worker and cached by
+    source and options, so the response is a task to poll.
+    """
     if request.target == "html":
-        return {"status": "success", "data": html}
-    
-    # PDF Conversion
-    filename = f"md_{uuid.uuid4()}.pdf"
-    file_path = os.path.join(f"{settings.STORAGE_PATH}/downloads", filename)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    
-    with open(file_path, "w+b") as f:
-        pisa_status = pisa.CreatePDF(html, dest=f)
-        
-    if pisa_status.err:
-        raise HTTPException(status_code=500, detail="PDF conversion failed")
-        
-    return {"status": "success", "filename": filename}
+        return {"status": "success", "data": markdown_service.to_html(request.data)}
+    if request.target != "pdf":
+        raise HTTPException(status_code=400, detail="target must be 'html' or 'pdf'")
+
+    _check_markdown([request.data], request.page_size)
+    admission.check("render_markdown")
+    task_id, cache_state = submit_deduplicated(
+        celery_app, "render_markdown", markdown_service.cache_key(request.data, request.page_size),
+        args=[request.data, request.page_size]
+    )
+    return {"task_id": task_id, "status": "queued", "cache": cache_state}
+
+@router.post("/markdown/batch")
+def markdown_batch(request: MarkdownBatchRequest):
+    """Render many documents to PDF in one task, zipped together by default"""
+    if not request.documents:
+        raise HTTPException(status_code=400, detail="No documents")
+    if len(request.documents) > settings.MARKDOWN_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {settings.MARKDOWN_BATCH_MAX} documents per batch")
+    _check_markdown([document.data for document in request.documents], request.page_size)
+
+    admission.check("render_markdown_batch")
+    task = celery_app.send_task(
+        "render_markdown_batch",
+        args=[[document.model_dump() for document in request.documents], request.page_size, request.make_zip]
+    )
+    return {"task_id": task.id, "status": "queued"}
@@ -0,0 +1,201 @@
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+import math
+from core.config import settings
+from core.dispatch import celery_app
+from core.cache import submit_cached
+from core.ingest import resumable_uploads
+from core.queues import admission
+from routers.media import validate_cut, validate_gif
+from routers.visual import validate_lang, validate_operations
+from core.operations import COMPRESS_METHODS
+
+router = APIRouter()
+
+class CreateUploadRequest(BaseModel):
+    filename: str
+    size: int
+    kind: str = "media"  # 'media' or 'image'
+
+class FinalizeRequest(BaseModel):
+    task: str
+    params: dict = {}
+
+def _number(p: dict, name: str, cast, default=None):
+    """p[name] coerced like a form field, or ValueError naming the field"""
+    value = p.get(name)
+    if value is None:
+        return default
+    try:
+        number = cast(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name} must be a number")
+    if isinstance(value, bool) or not math.isfinite(number):
+        raise ValueError(f"{name} must be a number")
+    return number
+
+def _compress_settings(p: dict):
+    """(crf, target) of a 'compress' finalize, checked like /media/compress and as compress_media takes them"""
+    crf = _number(p, "crf", int, 28)
+    if not 0 <= crf <= 51:
+        raise ValueError("crf must be between 0 and 51")
+    target_size_mb = _number(p, "target_size_mb", float)
+    target_bitrate = _number(p, "target_bitrate", int)
+    if target_size_mb is None and target_bitrate is None:
+        return crf, None
+    if target_size_mb is not None and target_bitrate is not None:
+        raise ValueError("Give target_size_mb or target_bitrate, not both")
+    if (target_size_mb is not None and target_size_mb <= 0) or (target_bitrate is not None and target_bitrate <= 0):
+        raise ValueError("Targets must be positive")
+    if p.get("method", "vbr") not in COMPRESS_METHODS:
+        raise ValueError(f"method must be one of: {', '.join(sorted(COMPRESS_METHODS))}")
+    return crf, {
+        "bytes": int(target_size_mb * 1024 * 1024) if target_size_mb is not None else None,
+        "kbps": target_bitrate,
+        "method": p.get("method", "vbr"),
+        "allow_downscale": bool(p.get("allow_downscale", False)),
+    }
+
+def _compress_args(key: str, p: dict) -> list:
+    crf, target = _compress_settings(p)
+    return [key, crf, target]
+
+def _compress_cache_params(p: dict) -> dict:
+    crf, target = _compress_settings(p)
+    return {"crf": crf, "target": target}
+
+def _cut_args(key: str, p: dict) -> list:
+    validate_cut(p.get("start_time"), p.get("end_time"), p.get("mode", "fast"), p.get("ranges"))
+    return [key, p.get("start_time"), p.get("end_time"), p.get("mode", "fast"), p.get("ranges"), p.get("join", True)]
+
+def _gif_args(key: str, p: dict) -> list:
+    validate_gif(p.get("dither", "sierra2_4a"), p.get("output_format", "gif"))
+    return [
+        key, p.get("fps", 10), p.get("width", 480), p.get("start_time"), p.get("duration"),
+        p.get("dither", "sierra2_4a"), p.get("max_bytes"), p.get("output_format", "gif").lower(),
+    ]
+
+def _process_args(key: str, p: dict) -> list:
+    operations = p.get("operations")
+    if operations is not None:
+        validate_operations(operations)
+    elif not p.get("action"):
+        raise HTTPException(status_code=400, detail="Either action or operations is required")
+    return [key, p.get("action") or "pipeline", p.get("params", {}), operations]
+
+def _ocr_args(key: str, p: dict) -> list:
+    validate_lang(p.get("lang", "eng"))
+    return [key, p.get("lang", "eng"), p.get("words", False)]
+
+# Maps a finalize task to (celery task name, args builder, cache params builder).
+# Tasks without a cache params builder are queued directly.
+FINALIZE_TASKS = {
+    "convert": (
+        "convert_media",
+        lambda key, p: [key, p.get("target_format", "mp3")],
+        lambda p: {"target_format": p.get("target_format", "mp3").lower()},
+    ),
+    "compress": (
+        "compress_media",
+        _compress_args,
+        _compress_cache_params,
+    ),
+    "cut": ("cut_media", _cut_args, None),
+    "gif": ("create_gif", _gif_args, None),
+    "process": (
+        "process_image",
+        _process_args,
+        lambda p: {"action": p.get("action") or "pipeline", "params": p.get("params", {}), "operations": p.get("operations")},
+    ),
+    "ocr": (
+        "ocr_image",
+        _ocr_args,
+        lambda p: {"lang": p.get("lang", "eng"), "words": p.get("words", False)},
+    ),
+}
+
+# Upload kind (and so size limit) each finalize task needs
+TASK_KINDS = {
+    "convert": "media",
+    "compress": "media",
+    "cut": "media",
+    "gif": "media",
+    "process": "image",
+    "ocr": "image",
+}
+
+# Tasks that take the content hash, e.g. to reuse cached ffprobe metadata
+DIGEST_TASKS = {"convert", "compress"}
+
+def _offset_headers(meta: dict) -> dict:
+    return {
+        "Upload-Offset": str(meta["offset"]),
+        "Upload-Length": str(meta["size"]),
+        "Cache-Control": "no-store",
+    }
+
+@router.post("", status_code=201)
+def create_upload(request: CreateUploadRequest, response: Response):
+    """
+    Start a resumable upload. Chunks are then sent with PATCH and the
+    upload is handed to a task with POST /uploads/{upload_id}/finalize.
+    """
+    upload_id = resumable_uploads.create(request.filename, request.size, request.kind)
+    response.headers["Location"] = f"{settings.API_V1_STR}/uploads/{upload_id}"
+    return {"upload_id": upload_id, "offset": 0, "chunk_size": settings.UPLOAD_CHUNK_SIZE}
+
+@router.head("/{upload_id}")
+def upload_offset(upload_id: str):
+    meta = resumable_uploads.get(upload_id)
+    return Response(status_code=200, headers=_offset_headers(meta))
+
+@router.get("/{upload_id}")
+def upload_status(upload_id: str):
+    meta = resumable_uploads.get(upload_id)
+    return {
+        "upload_id": upload_id,
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "offset": meta["offset"],
+        "received": meta["received"],
+        "ranges": meta["ranges"],
+    }
+
+@router.patch("/{upload_id}", status_code=204)
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(..., alias="Upload-Offset")):
+    meta = await resumable_uploads.write_chunk(upload_id, upload_offset, request)
+    return Response(status_code=204, headers=_offset_headers(meta))
+
+@router.post("/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, request: FinalizeRequest):
+    if request.task not in FINALIZE_TASKS:
+        raise HTTPException(status_code=400, detail=f"Unsupported task: {request.task}")
+    task_name, build_args, build_cache_params = FINALIZE_TASKS[request.task]
+    # Validate the params before the upload is consumed
+    try:
+        checked_args = await run_in_threadpool(build_args, "", request.params)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Missing parameter: {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await run_in_threadpool(admission.check, task_name, checked_args)
+    upload = await resumable_uploads.finalize(upload_id, TASK_KINDS[request.task])
+    args = build_args(upload.key, request.params)
+
+    if build_cache_params is None:
+        task = await run_in_threadpool(celery_app.send_task, task_name, args=args)
+        return {"task_id": task.id, "status": "queued", "original_filename": upload.filename}
+
+    task_id, cache_state = await run_in_threadpool(
+        submit_cached, celery_app, task_name, upload.key, args=args,
+        params=build_cache_params(request.params), digest=upload.digest,
+        kwargs={"digest": upload.digest} if request.task in DIGEST_TASKS else None
+    )
+    return {"task_id": task_id, "status": "queued", "cache": cache_state, "original_filename": upload.filename}
+
+@router.delete("/{upload_id}", status_code=204)
+def abort_upload(upload_id: str):
+    resumable_uploads.abort(upload_id)
+    return Response(status_code=204)
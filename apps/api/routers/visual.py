@@ -1,61 +1,127 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from starlette.concurrency import run_in_threadpool
 from core.config import settings
+from core.dispatch import celery_app
+from core.cache import submit_cached
+from core.capabilities import ocr_languages
+from core.ingest import save_upload
+from core.queues import admission
+from core.operations import fuse_operations
 from typing import Optional, List
-import shutil
-import os
-import uuid
 import json
+import re
 
 router = APIRouter()
 
-def save_upload(file: UploadFile) -> str:
-    upload_dir = f"{settings.STORAGE_PATH}/uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_id = str(uuid.uuid4())
-    file_ext = os.path.splitext(file.filename)[1]
-    saved_filename = f"{file_id}{file_ext}"
-    file_path = f"{upload_dir}/{saved_filename}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return file_path
+# Tesseract language codes, several joined with '+' (e.g. 'eng+deu')
+OCR_LANG_PATTERN = re.compile(r"[A-Za-z0-9_]+(\+[A-Za-z0-9_]+)*")
+
+def validate_lang(lang: str):
+    """Reject OCR languages that aren't installed before anything is queued"""
+    if not OCR_LANG_PATTERN.fullmatch(lang):
+        raise HTTPException(status_code=400, detail=f"Invalid OCR language: {lang}")
+    installed = ocr_languages()
+    missing = [code for code in lang.split("+") if installed and code not in installed]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"OCR language not installed: {', '.join(missing)}")
+
+def validate_operations(parsed) -> list:
+    """Validate an operations list before anything is queued"""
+    try:
+        if not isinstance(parsed, list) or not all(isinstance(op, dict) for op in parsed):
+            raise ValueError("operations must be a list of objects")
+        fuse_operations(parsed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid operations: {str(e)}")
+    return parsed
+
+def parse_operations(operations: Optional[str]) -> Optional[list]:
+    """Parse and validate an operations JSON list before anything is queued"""
+    if not operations:
+        return None
+    try:
+        parsed = json.loads(operations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid operations: {str(e)}")
+    return validate_operations(parsed)
 
 @router.post("/process")
-def process_single_image(
+async def process_single_image(
     file: UploadFile = File(...), 
-    action: str = Form(...), 
-    params: Optional[str] = Form(None)
+    action: Optional[str] = Form(None), 
+    params: Optional[str] = Form(None),
+    operations: Optional[str] = Form(None)
 ):
-    from worker import celery_app
-    file_path = save_upload(file)
+    """
+    Run a single action, or an ordered operations pipeline such as
+    [{"op": "resize", "width": 800, "height": 600}, {"op": "grayscale"}]
+    that is decoded and encoded only once. params carries output options.
+    """
+    parsed_operations = parse_operations(operations)
+    if not action and parsed_operations is None:
+        raise HTTPException(status_code=400, detail="Either action or operations is required")
+    action = action or "pipeline"
     parsed_params = json.loads(params) if params else {}
-    task = celery_app.send_task("process_image", args=[file_path, action, parsed_params])
-    return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
+    await run_in_threadpool(admission.check, "process_image", ["", action, parsed_params, parsed_operations])
+    upload = await save_upload(file, "image")
+    task_id, cache_state = await run_in_threadpool(
+        submit_cached, celery_app, "process_image", upload.key,
+        args=[upload.key, action, parsed_params, parsed_operations],
+        params={"action": action, "params": parsed_params, "operations": parsed_operations}, digest=upload.digest
+    )
+    return {"task_id": task_id, "status": "queued", "cache": cache_state, "original_filename": file.filename}
 
 @router.post("/batch-process")
-def process_multiple_images(
+async def process_multiple_images(
     files: List[UploadFile] = File(...),
     action: str = Form("convert"),
-    params: Optional[str] = Form(None)
+    params: Optional[str] = Form(None),
+    operations: Optional[str] = Form(None),
+    zip: bool = Form(False)
 ):
-    from worker import celery_app
-    task_ids = []
+    """
+    Process all files in a single batch task; poll /tasks/{batch_id} for
+    aggregate progress and per-item results.
+    """
     parsed_params = json.loads(params) if params else {}
+    parsed_operations = parse_operations(operations)
+    await run_in_threadpool(admission.check, "process_image_batch", [[], action, parsed_params, zip, parsed_operations])
+    items = []
     for file in files:
-        file_path = save_upload(file)
-        task = celery_app.send_task("process_image", args=[file_path, action, parsed_params])
-        task_ids.append({"task_id": task.id, "filename": file.filename})
-    return {"tasks": task_ids, "status": "queued"}
+        upload = await save_upload(file, "image")
+        items.append({"key": upload.key, "filename": file.filename})
+    task = await run_in_threadpool(celery_app.send_task, "process_image_batch", args=[items, action, parsed_params, zip, parsed_operations])
+    return {
+        "task_id": task.id,
+        "batch_id": task.id,
+        "status": "queued",
+        "files": [item["filename"] for item in items]
+    }
 
 @router.post("/ocr")
-def ocr_image(file: UploadFile = File(...), lang: str = Form("eng")):
-    from worker import celery_app
-    file_path = save_upload(file)
-    task = celery_app.send_task("ocr_image", args=[file_path, lang])
-    return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
+async def ocr_image(file: UploadFile = File(...), lang: str = Form("eng"), words: bool = Form(False)):
+    """
+    OCR an image, multi-page TIFF or PDF. With words=true each page also
+    carries word boxes and confidences.
+    """
+    await run_in_threadpool(validate_lang, lang)
+    await run_in_threadpool(admission.check, "ocr_image")
+    upload = await save_upload(file, "image")
+    task_id, cache_state = await run_in_threadpool(
+        submit_cached, celery_app, "ocr_image", upload.key,
+        args=[upload.key, lang, words],
+        params={"lang": lang, "words": words}, digest=upload.digest
+    )
+    return {"task_id": task_id, "status": "queued", "cache": cache_state, "original_filename": file.filename}
 
 @router.post("/remove-bg")
-def remove_background(file: UploadFile = File(...)):
-    from worker import celery_app
-    file_path = save_upload(file)
-    task = celery_app.send_task("process_image", args=[file_path, "remove_bg", {"format": "PNG"}])
-    return {"task_id": task.id, "status": "queued", "original_filename": file.filename}
+async def remove_background(file: UploadFile = File(...)):
+    params = {"format": "PNG"}
+    await run_in_threadpool(admission.check, "process_image", ["", "remove_bg", params])
+    upload = await save_upload(file, "image")
+    task_id, cache_state = await run_in_threadpool(
+        submit_cached, celery_app, "process_image", upload.key,
+        args=[upload.key, "remove_bg", params],
+        params={"action": "remove_bg", "params": params}, digest=upload.digest
+    )
+    return {"task_id": task_id, "status": "queued", "cache": cache_state, "original_filename": file.filename}
@@ -0,0 +1,95 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from PIL import Image
+from core.capabilities import backend_available, require
+from core.config import settings
+from core.queues import core_budget
+
+# rembg loads onnxruntime on import; it is only imported when first used
+REM_BG_AVAILABLE = backend_available("rembg")
+
+class BackgroundRemovalService:
+    """
+    Keeps rembg/onnxruntime sessions resident for the life of the worker process.
+
+    Building a session loads the ONNX model and sets up the runtime, which is
+    most of the cost of a single remove-bg call, so sessions are created once
+    and checked out from a small pool. onnxruntime releases the GIL while
+    running, so several threads can each use their own session.
+
+    Queued remove-bg tasks are not grouped: each runs its own inference on
+    a warm session. rembg feeds the model one image per run, so grouping
+    them would only save the setup the pool already saves. Only the batch
+    endpoint runs several images at once, one per session.
+    """
+
+    def __init__(
+        self,
+        model_name: str = settings.REMBG_MODEL,
+        pool_size: int = settings.REMBG_SESSIONS,
+        threads: int = settings.REMBG_THREADS,
+    ):
+        self.model_name = model_name
+        self.pool_size = max(1, pool_size)
+        self.threads = threads
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        # rembg builds its onnxruntime SessionOptions from OMP_NUM_THREADS,
+        # so this is how intra/inter-op thread counts are pinned on CPU
+        # The task's core budget is only known once the worker has started
+        os.environ["OMP_NUM_THREADS"] = str(self.threads or max(1, core_budget() // self.pool_size))
+        return require("rembg", "Background removal").new_session(self.model_name)
+
+    def warm_up(self):
+        """Create the whole session pool up front, e.g. at worker process start"""
+        if not REM_BG_AVAILABLE:
+            return
+        with self._lock:
+            while self._created < self.pool_size:
+                self._idle.put(self._new_session())
+                self._created += 1
+
+    @contextmanager
+    def session(self):
+        if not REM_BG_AVAILABLE:
+            raise Exception("Background removal is not available. Please install 'rembg' and 'onnxruntime'.")
+
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.pool_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    session = self._new_session()
+                except BaseException:
+                    # Give the slot back, or later calls would wait for a session that never comes
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                session = self._idle.get()
+
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def remove(self, img: Image.Image) -> Image.Image:
+        """Remove the background of a PIL image, returning an RGBA PIL image"""
+        with self.session() as session:
+            return require("rembg", "Background removal").remove(img, session=session)
+
+    def mask(self, img: Image.Image) -> Image.Image:
+        """Foreground mask of a PIL image ('L', same size) without building the cutout"""
+        with self.session() as session:
+            return require("rembg", "Background removal").remove(img, session=session, only_mask=True)
+
+background_service = BackgroundRemovalService()
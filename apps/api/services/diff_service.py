@@ -0,0 +1,390 @@
+import html
+import json
+import os
+import re
+import uuid
+from bisect import bisect_left
+from core.config import settings
+
+DIFF_FORMATS = {"html": ".html", "unified": ".diff", "json": ".json"}
+
+# Word diff tokens: words, runs of whitespace, single punctuation marks
+_WORD = re.compile(r"\w+|\s+|[^\w\s]")
+
+
+def _intern(items_a: list, items_b: list):
+    """Replace every item with a small int so comparisons are int compares"""
+    ids = {}
+    a = [ids.setdefault(item, len(ids)) for item in items_a]
+    b = [ids.setdefault(item, len(ids)) for item in items_b]
+    return a, b
+
+
+def _unique_anchors(a: list, b: list, alo: int, ahi: int, blo: int, bhi: int) -> list:
+    """
+    Patience step: lines occurring exactly once on each side, reduced to
+    their longest run that is increasing on both sides.
+    """
+    first_a = {}
+    for i in range(alo, ahi):
+        first_a[a[i]] = -1 if a[i] in first_a else i
+    first_b = {}
+    for j in range(blo, bhi):
+        first_b[b[j]] = -1 if b[j] in first_b else j
+    # dict order is first occurrence, so pairs are ascending in i
+    pairs = [(i, first_b[line]) for line, i in first_a.items() if i >= 0 and first_b.get(line, -1) >= 0]
+    if not pairs:
+        return []
+
+    # Longest increasing subsequence in j by patience sorting
+    tails, tail_index, previous = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pile = bisect_left(tails, j)
+        if pile == len(tails):
+            tails.append(j)
+            tail_index.append(k)
+        else:
+            tails[pile] = j
+            tail_index[pile] = k
+        previous[k] = tail_index[pile - 1] if pile else None
+
+    anchors, k = [], tail_index[-1]
+    while k is not None:
+        anchors.append(pairs[k])
+        k = previous[k]
+    anchors.reverse()
+    return anchors
+
+
+def _myers(a: list, b: list, alo: int, ahi: int, blo: int, bhi: int, max_cost: int) -> list:
+    """
+    Myers' O(ND) shortest edit script for a region, as matched pairs.
+    Regions needing more than max_cost edits get no matches and show up as
+    one replaced block, which is what a reader would want from them anyway.
+    """
+    n, m = ahi - alo, bhi - blo
+    max_d = min(n + m, max_cost)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        # Only diagonals -d-1..d+1 can be read while backtracking from step d
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m, alo, blo)
+    return []
+
+
+def _backtrack(trace: list, x: int, y: int, alo: int, blo: int) -> list:
+    matches = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v[previous_k + d + 1]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = previous_x, previous_y
+    return matches
+
+
+def match_sequences(a: list, b: list, max_cost: int = settings.DIFF_MAX_EDIT_COST) -> list:
+    """
+    Matched index pairs between two sequences of ints, ascending.
+
+    Patience diff: common prefix/suffix are stripped, lines unique on both
+    sides anchor the alignment and the gaps between anchors are solved
+    the same way; gaps with no unique lines fall back to Myers.
+    """
+    matches = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if not anchors:
+            # Rewritten blocks share no lines at all; nothing for Myers to find
+            if not set(a[alo:ahi]).isdisjoint(b[blo:bhi]):
+                matches.extend(_myers(a, b, alo, ahi, blo, bhi, max_cost))
+            continue
+        matches.extend(anchors)
+        i, j = alo, blo
+        for anchor_i, anchor_j in anchors:
+            regions.append((i, anchor_i, j, anchor_j))
+            i, j = anchor_i + 1, anchor_j + 1
+        regions.append((i, ahi, j, bhi))
+    matches.sort()
+    return matches
+
+
+def opcodes(matches: list, n: int, m: int) -> list:
+    """difflib-style (tag, i1, i2, j1, j2) opcodes from matched pairs"""
+    codes = []
+    i = j = 0
+    for match_i, match_j in matches + [(n, m)]:
+        if i < match_i and j < match_j:
+            codes.append(("replace", i, match_i, j, match_j))
+        elif i < match_i:
+            codes.append(("delete", i, match_i, j, j))
+        elif j < match_j:
+            codes.append(("insert", i, i, j, match_j))
+        if match_i == n and match_j == m:
+            break
+        if codes and codes[-1][0] == "equal" and codes[-1][2] == match_i and codes[-1][4] == match_j:
+            codes[-1] = ("equal", codes[-1][1], match_i + 1, codes[-1][3], match_j + 1)
+        else:
+            codes.append(("equal", match_i, match_i + 1, match_j, match_j + 1))
+        i, j = match_i + 1, match_j + 1
+    return codes
+
+
+def group_opcodes(codes: list, context: int) -> list:
+    """Split opcodes into hunks with context lines around each change"""
+    if not codes or all(code[0] == "equal" for code in codes):
+        return []
+    codes = list(codes)
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    groups, group = [], []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        groups.append(group)
+    return groups
+
+
+def word_diff(old: str, new: str, max_cost: int = settings.DIFF_WORD_MAX_EDIT_COST):
+    """
+    Spans [op, text] of each side of a changed line pair, or None when the
+    pair needs more than max_cost word edits: a rewritten line reads better
+    as a whole-line change, and the budget keeps one from costing seconds.
+    """
+    old_words, new_words = _WORD.findall(old), _WORD.findall(new)
+    a, b = _intern(old_words, new_words)
+    matches = match_sequences(a, b, max_cost)
+    if len(a) + len(b) - 2 * len(matches) > max_cost:
+        return None
+    old_spans, new_spans = [], []
+    for tag, i1, i2, j1, j2 in opcodes(matches, len(a), len(b)):
+        if tag == "equal":
+            text = "".join(old_words[i1:i2])
+            old_spans.append(["equal", text])
+            new_spans.append(["equal", text])
+            continue
+        if i2 > i1:
+            old_spans.append(["delete", "".join(old_words[i1:i2])])
+        if j2 > j1:
+            new_spans.append(["insert", "".join(new_words[j1:j2])])
+    return old_spans, new_spans
+
+
+def _unified_range(start: int, length: int) -> str:
+    if length == 1:
+        return f"{start}"
+    return f"{start - 1 if not length else start},{length}"
+
+
+class DiffService:
+    """
+    Line diffs for the diff checker.
+
+    Lines are interned to ints and aligned with patience diff (Myers for the
+    stretches without unique lines), so cost follows the size of the change
+    rather than the product of the input sizes like difflib's HtmlDiff.
+    Only changed regions and their context are rendered.
+    """
+
+    def __init__(self, output_path: str = f"{settings.STORAGE_PATH}/downloads"):
+        self.output_path = output_path
+
+    def align(self, text1: str, text2: str) -> tuple:
+        """Both sides' lines and the line opcodes between them"""
+        old_lines, new_lines = text1.splitlines(), text2.splitlines()
+        a, b = _intern(old_lines, new_lines)
+        return old_lines, new_lines, opcodes(match_sequences(a, b), len(a), len(b))
+
+    @staticmethod
+    def changed_bytes(alignment: tuple) -> int:
+        """Characters on the changed lines of an alignment, which rendering and word diffs scale with"""
+        old_lines, new_lines, codes = alignment
+        return sum(
+            sum(map(len, old_lines[i1:i2])) + sum(map(len, new_lines[j1:j2]))
+            for tag, i1, i2, j1, j2 in codes if tag != "equal"
+        )
+
+    def hunks(self, text1: str, text2: str, context: int = settings.DIFF_CONTEXT, words: bool = True,
+              alignment: tuple = None) -> list:
+        old_lines, new_lines, codes = alignment or self.align(text1, text2)
+
+        hunks = []
+        for group in group_opcodes(codes, context):
+            lines = []
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    lines.extend(
+                        {"op": "equal", "old": i + 1, "new": j + 1, "text": old_lines[i]}
+                        for i, j in zip(range(i1, i2), range(j1, j2))
+                    )
+                    continue
+                deleted = [{"op": "delete", "old": i + 1, "new": None, "text": old_lines[i]} for i in range(i1, i2)]
+                inserted = [{"op": "insert", "old": None, "new": j + 1, "text": new_lines[j]} for j in range(j1, j2)]
+                if words:
+                    # Changed lines are paired in order for the intra-line diff
+                    for old, new in zip(deleted, inserted):
+                        if max(len(old["text"]), len(new["text"])) <= settings.DIFF_WORD_MAX_LINE:
+                            spans = word_diff(old["text"], new["text"])
+                            if spans:
+                                old["spans"], new["spans"] = spans
+                lines.extend(deleted)
+                lines.extend(inserted)
+
+            first, last = group[0], group[-1]
+            hunks.append({
+                "old_start": first[1] + 1,
+                "old_lines": last[2] - first[1],
+                "new_start": first[3] + 1,
+                "new_lines": last[4] - first[3],
+                "lines": lines,
+            })
+        return hunks
+
+    def diff(self, text1: str, text2: str, format: str = "html", context: int = settings.DIFF_CONTEXT, words: bool = True,
+             alignment: tuple = None) -> dict:
+        """alignment is align(text1, text2) when the caller already has it"""
+        hunks = self.hunks(text1, text2, context, words=words and format != "unified", alignment=alignment)
+        stats = {
+            "hunks": len(hunks),
+            "added": sum(line["op"] == "insert" for hunk in hunks for line in hunk["lines"]),
+            "removed": sum(line["op"] == "delete" for hunk in hunks for line in hunk["lines"]),
+        }
+        if format == "json":
+            return {"format": format, "data": hunks, "stats": stats}
+        render = self.render_unified if format == "unified" else self.render_html
+        return {"format": format, "data": render(hunks), "stats": stats}
+
+    def diff_files(self, path1: str, path2: str, format: str = "html", context: int = settings.DIFF_CONTEXT, words: bool = True) -> dict:
+        """Diff two text files into a file under downloads"""
+        with open(path1, encoding="utf-8", errors="replace") as f:
+            text1 = f.read()
+        with open(path2, encoding="utf-8", errors="replace") as f:
+            text2 = f.read()
+        result = self.diff(text1, text2, format, context, words)
+
+        os.makedirs(self.output_path, exist_ok=True)
+        filename = f"diff_{uuid.uuid4()}{DIFF_FORMATS[format]}"
+        output_path = os.path.join(self.output_path, filename)
+        with open(output_path, "w", encoding="utf-8") as f:
+            if format == "json":
+                json.dump(result["data"], f)
+            else:
+                f.write(result["data"])
+
+        return {
+            "status": "success",
+            "filename": filename,
+            "path": output_path,
+            "format": format,
+            "stats": result["stats"],
+        }
+
+    def render_unified(self, hunks: list, old_name: str = "original", new_name: str = "modified") -> str:
+        if not hunks:
+            return ""
+        out = [f"--- {old_name}", f"+++ {new_name}"]
+        prefixes = {"equal": " ", "delete": "-", "insert": "+"}
+        for hunk in hunks:
+            out.append(
+                f"@@ -{_unified_range(hunk['old_start'], hunk['old_lines'])} "
+                f"+{_unified_range(hunk['new_start'], hunk['new_lines'])} @@"
+            )
+            out.extend(prefixes[line["op"]] + line["text"] for line in hunk["lines"])
+        return "\n".join(out) + "\n"
+
+    def render_html(self, hunks: list) -> str:
+        """Side-by-side table of the changed regions only"""
+        out = ['<table class="diff"><tbody>']
+        if not hunks:
+            out.append('<tr><td class="diff_hunk" colspan="4">No differences</td></tr>')
+        for hunk in hunks:
+            out.append(
+                f'<tr><td class="diff_hunk" colspan="4">@@ -{hunk["old_start"]},{hunk["old_lines"]} '
+                f'+{hunk["new_start"]},{hunk["new_lines"]} @@</td></tr>'
+            )
+            deleted, inserted = [], []
+            for line in hunk["lines"] + [None]:
+                if line is not None and line["op"] == "delete":
+                    deleted.append(line)
+                    continue
+                if line is not None and line["op"] == "insert":
+                    inserted.append(line)
+                    continue
+                # A change block ended: pair removed and added lines row by row
+                for index in range(max(len(deleted), len(inserted))):
+                    old = deleted[index] if index < len(deleted) else None
+                    new = inserted[index] if index < len(inserted) else None
+                    changed = old is not None and new is not None
+                    out.append(
+                        "<tr>"
+                        + _html_cell(old, "old", "diff_chg" if changed else "diff_sub")
+                        + _html_cell(new, "new", "diff_chg" if changed else "diff_add")
+                        + "</tr>"
+                    )
+                deleted, inserted = [], []
+                if line is not None:
+                    out.append("<tr>" + _html_cell(line, "old", "") + _html_cell(line, "new", "") + "</tr>")
+        out.append("</tbody></table>")
+        return "\n".join(out)
+
+
+def _html_cell(line, side: str, css: str) -> str:
+    if line is None:
+        return '<td class="diff_header"></td><td></td>'
+    if "spans" in line:
+        tags = {"delete": "del", "insert": "ins"}
+        text = "".join(
+            f"<{tags[op]}>{html.escape(span)}</{tags[op]}>" if op in tags else html.escape(span)
+            for op, span in line["spans"]
+        )
+    else:
+        text = html.escape(line["text"])
+    css_attr = f' class="{css}"' if css else ""
+    return f'<td class="diff_header">{line[side]}</td><td{css_attr}>{text}</td>'
+
+
+diff_service = DiffService()
@@ -1,14 +1,49 @@
 from PIL import Image
-import pytesseract
 import os
 from core.config import settings
+from core.operations import fuse_operations, output_format
+from core.metrics import metrics
+from core.queues import core_budget
+from concurrent.futures import ThreadPoolExecutor
 import uuid
-try:
-    from rembg import remove
-    REM_BG_AVAILABLE = True
-except ImportError:
-    REM_BG_AVAILABLE = False
-import io
+import zipfile
+from services.background_service import background_service
+from services.large_image_service import large_image_service
+from services.ocr_service import ocr_service
+
+# Operations that only shrink the image and may therefore decode at reduced size
+SCALING_OPERATIONS = {"resize", "thumbnail"}
+
+# Counter-clockwise right-angle rotations, matching Image.rotate's direction
+ROTATE_TRANSPOSE = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+# Pillow's own decompression-bomb check, kept in line with the pixel limit
+Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_MEGAPIXELS * 1_000_000
+
+# Bytes per band of the modes that aren't 8 bits per band
+BAND_BYTES = {"I": 4, "F": 4, "I;16": 2, "I;16L": 2, "I;16B": 2, "I;16N": 2}
+
+# Full-size rasters alive at once in the Pillow path: the decode plus the
+# result of the current step; rembg adds RGB/RGBA copies and the mask
+PILLOW_COPIES = 2
+REMOVE_BG_COPIES = 5
+
+def peak_memory(img: Image.Image, plan: list) -> int:
+    """
+    Rough peak bytes of running plan on img in Pillow, at the size the
+    decoder will produce (after _shrink_on_load's draft/reduce).
+    """
+    width, height = img.size
+    # A JPEG 2000 reduce factor only takes effect on load; unset, reduce is Image.reduce
+    factor = img.reduce if img.format == "JPEG2000" and isinstance(img.reduce, int) else 0
+    width, height = width >> factor, height >> factor
+    decoded = width * height * len(img.getbands()) * BAND_BYTES.get(img.mode, 1)
+    copies = REMOVE_BG_COPIES if any(operation["op"] == "remove_bg" for operation in plan) else PILLOW_COPIES
+    return decoded * copies
 
 class ImageService:
     def __init__(self, storage_path: str = settings.STORAGE_PATH):
@@ -17,73 +52,214 @@ class ImageService:
         os.makedirs(self.upload_path, exist_ok=True)
         os.makedirs(self.download_path, exist_ok=True)
 
-    def process_image(self, input_path: str, action: str, params: dict = None):
+    def process_image(self, input_path: str, action: str, params: dict = None, operations: list = None):
         """
-        Process image using Pillow (resize, rotate, convert format)
+        Process image using Pillow (resize, rotate, grayscale, remove_bg, convert format).
+        With operations, the ordered list of {"op": ..., ...} steps is applied to one
+        decoded image and encoded once; params then only carry output options.
         """
         filename = os.path.basename(input_path)
         base_name = os.path.splitext(filename)[0]
         params = params or {}
-        
-        with Image.open(input_path) as img:
-            # Handle RGBA to RGB for JPEG if needed
-            if action != "remove_bg" and img.mode in ("RGBA", "P"):
-                target_format = params.get("format", "PNG").upper()
-                if target_format == "JPEG" or target_format == "JPG":
-                    img = img.convert("RGB")
+        if operations is None:
+            operations = [{"op": action, **params}]
+        plan = fuse_operations(operations)
+
+        try:
+            img = Image.open(input_path)
+        except Image.DecompressionBombError:
+            raise Exception(f"Image processing failed: the image is over the {settings.IMAGE_MAX_MEGAPIXELS} megapixel limit")
+
+        with img:
+            if img.width * img.height > settings.IMAGE_MAX_MEGAPIXELS * 1_000_000:
+                raise Exception(
+                    f"Image processing failed: {img.width}x{img.height} is over the "
+                    f"{settings.IMAGE_MAX_MEGAPIXELS} megapixel limit"
+                )
+
+            target_format = output_format(operations, params, img.format or "PNG")
 
-            if action == "resize":
-                width = params.get("width", img.width)
-                height = params.get("height", img.height)
-                img = img.resize((width, height), Image.Resampling.LANCZOS)
-            elif action == "rotate":
-                degrees = params.get("degrees", 90)
-                img = img.rotate(degrees, expand=True)
-            elif action == "grayscale":
-                img = img.convert("L")
-            elif action == "remove_bg":
-                if not REM_BG_AVAILABLE:
-                    raise Exception("Background removal is not available. Please install 'rembg' and 'onnxruntime'.")
-                # Convert PIL to bytes for rembg
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='PNG')
-                result_bytes = remove(img_byte_arr.getvalue())
-                img = Image.open(io.BytesIO(result_bytes))
-            
-            target_format = params.get("format", img.format or "PNG").upper()
-            if target_format == "JPG": target_format = "JPEG"
-            
             output_filename = f"{base_name}_{action}.{target_format.lower()}"
             output_path = os.path.join(self.download_path, output_filename)
-            
+
             save_params = {}
             if target_format == "JPEG":
                 save_params["quality"] = params.get("quality", 85)
             elif target_format == "WEBP":
                 save_params["quality"] = params.get("quality", 80)
-            
-            img.save(output_path, format=target_format, **save_params)
-            
+
+            self._shrink_on_load(img, plan)
+            peak = peak_memory(img, plan)
+            streamed = peak > settings.IMAGE_MEMORY_BUDGET_MB * 1024 * 1024
+            if streamed:
+                reason = large_image_service.unsupported(plan, target_format)
+                if reason:
+                    raise Exception(
+                        f"Image processing failed: {img.width}x{img.height} needs about {peak // (1024 * 1024)} MB, "
+                        f"over the {settings.IMAGE_MEMORY_BUDGET_MB} MB budget, and {reason}"
+                    )
+                with metrics.phase("stream"):
+                    large_image_service.process(input_path, output_path, plan, target_format, save_params)
+            else:
+                with metrics.phase("decode"):
+                    img.load()
+                with metrics.phase("process"):
+                    for operation in plan:
+                        img = self._apply_operation(img, operation)
+
+                # Handle RGBA to RGB for JPEG if needed
+                if target_format == "JPEG" and img.mode in ("RGBA", "LA", "P"):
+                    img = img.convert("RGB")
+
+                with metrics.phase("encode"):
+                    img.save(output_path, format=target_format, **save_params)
+
             return {
                 "status": "success",
                 "filename": output_filename,
                 "path": output_path,
-                "action": action
+                "action": action,
+                "operations": [operation["op"] for operation in plan],
+                "engine": "vips" if streamed else "pillow",
             }
 
-    def extract_text(self, input_path: str, lang: str = "eng"):
+    def _shrink_on_load(self, img: Image.Image, plan: list):
         """
-        Extract text from image using Tesseract OCR
+        Let the decoder skip work when the plan starts by shrinking the image:
+        JPEG decodes at 1/2, 1/4 or 1/8 scale in the DCT domain (draft mode) and
+        JPEG 2000 drops resolution levels. The decoded image is never smaller
+        than the target, so the final LANCZOS pass keeps full quality.
+        Must run before the image is loaded.
+        """
+        leading = next((operation for operation in plan if operation["op"] != "grayscale"), None)
+        if leading is None or leading["op"] not in SCALING_OPERATIONS:
+            return
+
+        if leading["op"] == "thumbnail":
+            scale = min(leading.get("width", img.width) / img.width, leading.get("height", img.height) / img.height, 1)
+            target = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        else:
+            target = (leading.get("width", img.width), leading.get("height", img.height))
+        if target[0] >= img.width and target[1] >= img.height:
+            return
+
+        if img.format == "JPEG":
+            ops = {operation["op"] for operation in plan}
+            # Grayscale pipelines only need the luma channel
+            mode = "L" if "grayscale" in ops and "remove_bg" not in ops else img.mode
+            img.draft(mode, target)
+        elif img.format == "JPEG2000":
+            factor = 0
+            while img.width >> (factor + 1) >= target[0] and img.height >> (factor + 1) >= target[1]:
+                factor += 1
+            img.reduce = factor
+
+    def _apply_operation(self, img: Image.Image, operation: dict) -> Image.Image:
+        op = operation["op"]
+        if op == "resize":
+            width = operation.get("width", img.width)
+            height = operation.get("height", img.height)
+            # reducing_gap box-reduces by an integer factor first, then resamples the rest
+            return img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=settings.IMAGE_REDUCING_GAP)
+        elif op == "thumbnail":
+            bounds = (operation.get("width", img.width), operation.get("height", img.height))
+            img.thumbnail(bounds, Image.Resampling.LANCZOS, reducing_gap=settings.IMAGE_REDUCING_GAP)
+            return img
+        elif op == "rotate":
+            degrees = operation.get("degrees", 90) % 360
+            if degrees in ROTATE_TRANSPOSE:
+                # Right-angle rotations are a lossless pixel shuffle, no resampling needed
+                return img.transpose(ROTATE_TRANSPOSE[degrees])
+            return img.rotate(degrees, expand=True)
+        elif op == "grayscale":
+            return img.convert("L")
+        elif op == "remove_bg":
+            return background_service.remove(img)
+        return img
+
+    def process_batch(self, items: list, action: str, params: dict = None, operations: list = None,
+                      batch_id: str = None, make_zip: bool = False, progress=None):
+        """
+        Process many images inside one task using a local thread pool.
+        items are {"path", "filename"} dicts; failures are reported per item.
+        progress(done, total, failed) is called after every chunk.
+        """
+        batch_id = batch_id or str(uuid.uuid4())
+        total = len(items)
+        chunk_size = max(1, settings.BATCH_CHUNK_SIZE)
+        pool_size = settings.BATCH_POOL_SIZE or core_budget()
+        jobs = [(item["path"], action, params or {}, operations) for item in items]
+
+        # Threads, not processes: the task runs in a daemonic prefork child,
+        # which can't start processes, and Pillow releases the GIL while it
+        # decodes, resamples and encodes. Model jobs share the warm sessions.
+        uses_model = action == "remove_bg" or any(op.get("op") == "remove_bg" for op in operations or [])
+        workers = background_service.pool_size if uses_model else min(pool_size, total)
+        executor = ThreadPoolExecutor(max_workers=workers or 1)
+
+        results = []
+        failed = 0
+        with executor as pool:
+            outcomes = pool.map(_process_batch_item, jobs)
+            for item, outcome in zip(items, outcomes):
+                outcome["original_filename"] = item.get("filename")
+                if outcome["status"] != "success":
+                    failed += 1
+                results.append(outcome)
+                if progress and (len(results) % chunk_size == 0 or len(results) == total):
+                    progress(len(results), total, failed)
+
+        batch_result = {
+            "status": "success" if failed < total else "error",
+            "batch_id": batch_id,
+            "action": action,
+            "total": total,
+            "succeeded": total - failed,
+            "failed": failed,
+            "items": results,
+        }
+
+        if make_zip and failed < total:
+            zip_filename = f"batch_{batch_id}.zip"
+            zip_path = os.path.join(self.download_path, zip_filename)
+            self._zip_outputs(results, zip_path)
+            batch_result.update({"filename": zip_filename, "path": zip_path})
+
+        return batch_result
+
+    def _zip_outputs(self, results: list, zip_path: str):
+        used_names = set()
+        # Images are already compressed, storing them avoids a pointless deflate pass
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            for outcome in results:
+                if outcome["status"] != "success":
+                    continue
+                stem = os.path.splitext(outcome.get("original_filename") or outcome["filename"])[0]
+                ext = os.path.splitext(outcome["filename"])[1]
+                name = f"{stem}{ext}"
+                counter = 1
+                while name in used_names:
+                    name = f"{stem}_{counter}{ext}"
+                    counter += 1
+                used_names.add(name)
+                archive.write(outcome["path"], arcname=name)
+
+    def extract_text(self, input_path: str, lang: str = "eng", words: bool = False):
+        """
+        Extract text from an image, multi-page TIFF or PDF using Tesseract OCR
         """
         try:
-            with Image.open(input_path) as img:
-                text = pytesseract.image_to_string(img, lang=lang)
-                return {
-                    "status": "success",
-                    "text": text,
-                    "lang": lang
-                }
+            with metrics.phase("ocr"):
+                return ocr_service.extract(input_path, lang, words=words)
         except Exception as e:
             raise Exception(f"OCR failed: {str(e)}")
 
 image_service = ImageService()
+
+def _process_batch_item(job):
+    """Runs in a pool thread, so errors are returned rather than raised"""
+    input_path, action, params, operations = job
+    try:
+        return image_service.process_image(input_path, action, params, operations)
+    except Exception as e:
+        return {"status": "error", "error": str(e), "action": action}
@@ -0,0 +1,307 @@
+import codecs
+import json
+import re
+from typing import Optional
+from core.config import settings
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# orjson reads integers beyond 64 bits as floats; documents with long digit
+# runs go through the stdlib parser, which keeps them exact
+_LONG_DIGITS = re.compile(r"\d{19,}")
+
+# Stream tokenizer: optional whitespace, then one token; the group number is its kind
+_SCAN = re.compile(r"""[ \t\n\r]*(?:
+    ("(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*")
+  | (-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)
+  | (true|false|null)
+  | ([{}\[\]:,])
+)""", re.VERBOSE)
+_STRING, _NUMBER, _LITERAL, _PUNCT = 1, 2, 3, 4
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*\Z")
+_LITERALS = ("true", "false", "null")
+
+# What the stream formatter expects next
+_VALUE, _KEY, _COLON, _COMMA, _END = "a value", "a property name", "':'", "',' or a closing bracket", "end of document"
+
+
+class JsonService:
+    """
+    JSON parsing and formatting.
+
+    Whole documents go through orjson when it is installed (several times
+    faster than the stdlib and without the intermediate str on output),
+    falling back to the json module otherwise. Documents too large to hold
+    in memory go through StreamFormatter and the NDJSON line processors
+    below instead, which work chunk by chunk.
+    """
+
+    def __init__(self, backend: str = settings.JSON_BACKEND):
+        if backend not in ("auto", "orjson", "stdlib"):
+            raise ValueError(f"Unknown JSON backend: {backend}")
+        self.use_orjson = ORJSON_AVAILABLE and backend in ("auto", "orjson")
+
+    @property
+    def backend(self) -> str:
+        return "orjson" if self.use_orjson else "stdlib"
+
+    def loads(self, data):
+        return self._loads(data)[0]
+
+    def _loads(self, data):
+        """Parsed document and whether orjson could read it"""
+        if self.use_orjson:
+            text = data if isinstance(data, str) else data.decode("utf-8", "replace")
+            if not _LONG_DIGITS.search(text):
+                try:
+                    return orjson.loads(data), True
+                except orjson.JSONDecodeError:
+                    # NaN/Infinity and friends: let the stdlib accept them or explain why not
+                    pass
+        return json.loads(data), False
+
+    def dumps(self, obj, indent: Optional[int] = 2, sort_keys: bool = False, fast: bool = True) -> str:
+        # orjson writes NaN as null, so documents only the stdlib could read are written by it too
+        if self.use_orjson and fast and indent in (None, 2):
+            option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+            try:
+                return orjson.dumps(obj, option=option).decode()
+            except orjson.JSONEncodeError:
+                # Out-of-range integers, NaN, non-string keys
+                pass
+        separators = (",", ": ") if indent else (",", ":")
+        return json.dumps(obj, indent=indent or None, sort_keys=sort_keys, separators=separators, ensure_ascii=False)
+
+    def format(self, data, indent: Optional[int] = 2, sort_keys: bool = False) -> str:
+        obj, fast = self._loads(data)
+        return self.dumps(obj, indent=indent, sort_keys=sort_keys, fast=fast)
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class NdjsonLines:
+    """
+    Splits a byte stream into numbered, non-blank lines and hands each to
+    handle(); feed/close return whatever handle returned, joined.
+    """
+
+    def __init__(self, max_line: int = settings.JSON_MAX_TOKEN_SIZE):
+        self.max_line = max_line
+        self.count = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._partial = ""
+
+    def handle(self, number: int, line: str) -> str:
+        raise NotImplementedError
+
+    def feed(self, chunk: bytes, final: bool = False) -> str:
+        try:
+            text = self._partial + self._decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise JsonStreamError(f"Line {self.count + 1}: invalid UTF-8 ({e.reason})")
+        lines = text.split("\n")
+        self._partial = "" if final else lines.pop()
+        if len(self._partial) > self.max_line:
+            raise JsonStreamError(f"Line {self.count + 1} is longer than {self.max_line} characters")
+        output = []
+        for line in lines:
+            self.count += 1
+            if line.strip():
+                output.append(self.handle(self.count, line))
+        return "".join(output)
+
+    def close(self) -> str:
+        return self.feed(b"", final=True)
+
+
+class NdjsonFormatter(NdjsonLines):
+    """Re-serialises every record compactly, failing on the first bad line"""
+
+    def __init__(self, service: JsonService, sort_keys: bool = False):
+        super().__init__()
+        self.service = service
+        self.sort_keys = sort_keys
+
+    def handle(self, number: int, line: str) -> str:
+        try:
+            return self.service.format(line, indent=None, sort_keys=self.sort_keys) + "\n"
+        except ValueError as e:
+            raise JsonStreamError(f"Line {number}: {e}")
+
+
+class NdjsonValidator(NdjsonLines):
+    """Checks every record, keeping the first max_errors failures"""
+
+    def __init__(self, service: JsonService, max_errors: int = 100):
+        super().__init__()
+        self.service = service
+        self.max_errors = max_errors
+        self.records = 0
+        self.invalid = 0
+        self.errors = []
+
+    def handle(self, number: int, line: str) -> str:
+        try:
+            self.service.loads(line)
+            self.records += 1
+        except ValueError as e:
+            self.invalid += 1
+            if len(self.errors) < self.max_errors:
+                self.errors.append({"line": number, "error": str(e)})
+        return ""
+
+    def report(self) -> dict:
+        return {
+            "valid": not self.invalid,
+            "records": self.records,
+            "invalid": self.invalid,
+            "lines": self.count,
+            "errors": self.errors,
+        }
+
+
+class StreamFormatter:
+    """
+    Incremental JSON validator and re-formatter.
+
+    A tokenizer/state machine over decoded text: every token is checked
+    against the grammar and written straight back out with the requested
+    layout. Strings and numbers are copied verbatim, so nothing is lost to
+    float or unicode round-trips. Memory is the nesting stack plus at most
+    one unfinished token carried over between chunks.
+    """
+
+    def __init__(
+        self,
+        indent: Optional[int] = 2,
+        max_depth: int = settings.JSON_MAX_DEPTH,
+        max_token: int = settings.JSON_MAX_TOKEN_SIZE,
+    ):
+        self.max_depth = max_depth
+        self.max_token = max_token
+        self._breaks = _Breaks(indent)
+        self._colon = ": " if indent else ":"
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._offset = 0  # characters consumed before the buffer
+        self._stack = []  # open containers: "{" or "["
+        self._expect = _VALUE
+        self._opened = False  # container just opened; layout waits for its first token
+
+    def feed(self, chunk: bytes, final: bool = False) -> str:
+        try:
+            buffer = self._buffer + self._decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise JsonStreamError(f"Invalid UTF-8 near character {self._offset + len(self._buffer)}: {e.reason}")
+
+        # The hot loop: state lives in locals
+        out = []
+        append = out.append
+        breaks, colon, stack = self._breaks, self._colon, self._stack
+        expect, opened = self._expect, self._opened
+        position = 0
+        for match in _SCAN.finditer(buffer):
+            if match.start() != position:
+                break
+            kind = match.lastindex
+            text = match.group(kind)
+            # A number running into the end of the buffer may continue in the next chunk
+            if kind == _NUMBER and not final and _NUMBER_TAIL.match(buffer, match.end()):
+                break
+
+            if opened:
+                opened = False
+                if text == "}" or text == "]":
+                    if stack[-1] != ("{" if text == "}" else "["):
+                        raise self._error(f"Unexpected '{text}'", match.start(kind), expect)
+                    stack.pop()
+                    append(text)
+                    expect = _COMMA if stack else _END
+                    position = match.end()
+                    continue
+                append(breaks[len(stack)])
+
+            if kind < _PUNCT:
+                if expect == _VALUE:
+                    append(text)
+                    expect = _COMMA if stack else _END
+                elif expect == _KEY and kind == _STRING:
+                    append(text)
+                    expect = _COLON
+                else:
+                    raise self._error("Unexpected value", match.start(kind), expect)
+            elif text == ",":
+                if expect != _COMMA:
+                    raise self._error("Unexpected ','", match.start(kind), expect)
+                append(",")
+                append(breaks[len(stack)])
+                expect = _KEY if stack[-1] == "{" else _VALUE
+            elif text == ":":
+                if expect != _COLON:
+                    raise self._error("Unexpected ':'", match.start(kind), expect)
+                append(colon)
+                expect = _VALUE
+            elif text == "{" or text == "[":
+                if expect != _VALUE:
+                    raise self._error(f"Unexpected '{text}'", match.start(kind), expect)
+                if len(stack) >= self.max_depth:
+                    raise self._error(f"Nesting deeper than {self.max_depth}", match.start(kind), expect)
+                stack.append(text)
+                append(text)
+                opened = True
+                expect = _KEY if text == "{" else _VALUE
+            else:
+                if expect != _COMMA or stack[-1] != ("{" if text == "}" else "["):
+                    raise self._error(f"Unexpected '{text}'", match.start(kind), expect)
+                stack.pop()
+                append(breaks[len(stack)])
+                append(text)
+                expect = _COMMA if stack else _END
+            position = match.end()
+
+        self._expect, self._opened = expect, opened
+        position = _WHITESPACE.match(buffer, position).end()
+        rest = buffer[position:]
+        if rest and (final or not _may_continue(rest)):
+            raise self._error("Unexpected character", position, expect)
+        if len(rest) > self.max_token:
+            raise self._error(f"Token longer than {self.max_token} characters", position, expect)
+        if final and expect != _END:
+            raise self._error("Unexpected end of document", position, expect)
+        self._offset += position
+        self._buffer = rest
+        return "".join(out)
+
+    def close(self) -> str:
+        return self.feed(b"", final=True)
+
+    def _error(self, message: str, position: int, expect: str) -> JsonStreamError:
+        return JsonStreamError(f"{message} at character {self._offset + position} (expected {expect})")
+
+
+class _Breaks(dict):
+    """Line break plus indentation per depth, built the first time a depth is reached; empty when minifying"""
+
+    def __init__(self, indent: Optional[int]):
+        super().__init__()
+        self.indent = indent
+
+    def __missing__(self, depth: int) -> str:
+        value = self[depth] = "\n" + " " * self.indent * depth if self.indent else ""
+        return value
+
+
+def _may_continue(rest: str) -> bool:
+    """Whether rest could be the start of a token cut off by the chunk boundary"""
+    if rest[0] in "tfn":
+        return any(literal.startswith(rest) for literal in _LITERALS)
+    return rest[0] in '"-0123456789'
+
+
+json_service = JsonService()
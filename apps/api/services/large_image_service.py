@@ -0,0 +1,153 @@
+import io
+import os
+from PIL import Image
+from core.capabilities import backend_available, require
+from core.config import settings
+from core.queues import core_budget
+from services.background_service import background_service
+
+# pyvips loads libvips on import; it is only imported when first used
+LARGE_IMAGE_AVAILABLE = backend_available("pyvips")
+
+# Pillow's counter-clockwise right-angle rotations as libvips' clockwise ones
+VIPS_ROTATIONS = {90: "rot270", 180: "rot180", 270: "rot90"}
+
+# Pillow format name -> libvips saver and the save_params it understands
+VIPS_SAVERS = {"JPEG": "jpegsave", "PNG": "pngsave", "WEBP": "webpsave", "TIFF": "tiffsave", "GIF": "gifsave"}
+
+# Operations that read pixels out of order (or twice) and so can't stream
+RANDOM_ACCESS_OPERATIONS = {"rotate", "remove_bg"}
+
+# Longest side of the copy the background mask is computed on; the model
+# itself works at a few hundred pixels
+MASK_PREVIEW_SIZE = 2048
+
+class LargeImageService:
+    """
+    Bounded-memory image processing with libvips, for inputs too big to
+    decode whole in Pillow.
+
+    libvips runs a pipeline over strips of the image, so resizes, grayscale
+    and format conversion read and write a few rows at a time and memory
+    doesn't grow with the image's area. Rotations (and background removal,
+    which reads the image twice) need random access; libvips then decodes
+    to a temporary file once the image is over the memory budget and works
+    from that instead of RAM.
+    """
+
+    def __init__(self, memory_budget_mb: int = settings.IMAGE_MEMORY_BUDGET_MB):
+        self.memory_budget_mb = memory_budget_mb
+        self._vips = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._vips is not None
+
+    @property
+    def vips(self):
+        if self._vips is None:
+            # Read by libvips on first use: random-access decodes above this go to disk
+            os.environ.setdefault("VIPS_DISC_THRESHOLD", f"{self.memory_budget_mb}m")
+            vips = require("pyvips", "Large-image processing")
+            # Tasks never repeat an operation, and cached ones would pin their buffers
+            vips.cache_set_max(0)
+            vips.concurrency_set(core_budget())
+            self._vips = vips
+        return self._vips
+
+    def unsupported(self, plan: list, target_format: str):
+        """Why plan can't run here, or None if it can"""
+        if not LARGE_IMAGE_AVAILABLE:
+            return "large-image processing needs 'pyvips'"
+        if target_format not in VIPS_SAVERS:
+            return f"{target_format} output isn't supported for large images"
+        return None
+
+    def process(self, input_path: str, output_path: str, plan: list, target_format: str, save_params: dict):
+        vips = self.vips
+        try:
+            if any(operation["op"] in RANDOM_ACCESS_OPERATIONS for operation in plan):
+                image = vips.Image.new_from_file(input_path, access="random")
+            elif plan and plan[0]["op"] in ("resize", "thumbnail"):
+                # Shrink-on-load, like the Pillow path's draft mode
+                image = self._thumbnail(input_path, plan[0])
+                plan = plan[1:]
+            else:
+                image = vips.Image.new_from_file(input_path, access="sequential")
+
+            for operation in plan:
+                image = self._apply_operation(image, operation)
+
+            options = {}
+            if target_format == "JPEG":
+                # Pillow drops alpha rather than flattening it
+                image = _without_alpha(image)
+                options["Q"] = save_params.get("quality", 85)
+            elif target_format == "WEBP":
+                options["Q"] = save_params.get("quality", 80)
+            getattr(image, VIPS_SAVERS[target_format])(output_path, **options)
+        except vips.Error as e:
+            raise Exception(f"Image processing failed: {e.message}")
+
+    def _thumbnail(self, input_path: str, operation: dict):
+        header = self.vips.Image.new_from_file(input_path)
+        width = operation.get("width", header.width)
+        height = operation.get("height", header.height)
+        # 'force' ignores the aspect ratio like Pillow's resize; thumbnail only ever shrinks
+        size = "force" if operation["op"] == "resize" else "down"
+        return self.vips.Image.thumbnail(input_path, width, height=height, size=size, no_rotate=True)
+
+    def _apply_operation(self, image, operation: dict):
+        op = operation["op"]
+        if op == "resize":
+            width = operation.get("width", image.width)
+            height = operation.get("height", image.height)
+            return image.resize(width / image.width, vscale=height / image.height, kernel="lanczos3")
+        elif op == "thumbnail":
+            width = operation.get("width", image.width)
+            height = operation.get("height", image.height)
+            return image.thumbnail_image(width, height=height, size="down")
+        elif op == "rotate":
+            degrees = operation.get("degrees", 90) % 360
+            if degrees in VIPS_ROTATIONS:
+                return getattr(image, VIPS_ROTATIONS[degrees])()
+            return image.rotate(-degrees)
+        elif op == "grayscale":
+            return _grayscale(image)
+        elif op == "remove_bg":
+            return self._remove_background(image)
+        return image
+
+    def _remove_background(self, image):
+        """rembg on a preview; only the mask is scaled back up and joined on as alpha"""
+        preview = image.thumbnail_image(MASK_PREVIEW_SIZE)
+        with Image.open(io.BytesIO(preview.write_to_buffer(".png"))) as small:
+            mask = background_service.mask(small.convert("RGB"))
+        buffer = io.BytesIO()
+        mask.save(buffer, format="PNG")
+        alpha = self.vips.Image.new_from_buffer(buffer.getvalue(), "")
+        alpha = alpha.resize(image.width / alpha.width, vscale=image.height / alpha.height, kernel="linear")
+        colour = _without_alpha(image)
+        if colour.interpretation != "srgb":
+            colour = colour.colourspace("srgb")
+        return colour.bandjoin(alpha.extract_band(0))
+
+def _without_alpha(image):
+    return image.extract_band(0, n=image.bands - 1) if image.hasalpha() else image
+
+def _grayscale(image):
+    """Pillow's convert('L'): ITU-R 601-2 luma of the gamma-encoded values, alpha dropped"""
+    image = _without_alpha(image)
+    if image.interpretation == "cmyk":
+        # Pillow's CMYK -> RGB ignores colour profiles: 255 - (C + K), clipped
+        image = (255 - (image.extract_band(0, n=3) + image[3])).cast("uchar").copy(interpretation="srgb")
+    if image.bands >= 3:
+        if image.interpretation != "srgb":
+            image = image.colourspace("srgb")
+        # Rounded like Pillow's fixed-point conversion
+        return (image.recomb([[0.299, 0.587, 0.114]]) + 0.5).cast("uchar").copy(interpretation="b-w")
+    if image.format != "uchar":
+        return image.colourspace("b-w")
+    return image
+
+large_image_service = LargeImageService()
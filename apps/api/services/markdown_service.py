@@ -0,0 +1,166 @@
+import hashlib
+import io
+import os
+import threading
+import uuid
+import zipfile
+import markdown
+from core.config import settings
+from core.cache import result_cache
+from core.capabilities import require
+from core.objects import object_store
+from core.storage import publish_outputs
+
+PAGE_SIZES = ("A4", "A5", "letter", "legal")
+
+# Print styles on top of xhtml2pdf's defaults
+PDF_CSS = """
+@page {{ size: {page_size}; margin: 2cm; }}
+body {{ font-size: 11px; }}
+h1, h2, h3 {{ -pdf-keep-with-next: true; }}
+pre, code {{ font-family: Courier; background-color: #f4f4f5; }}
+pre {{ padding: 6px; }}
+table {{ border: 0.5px solid #999999; }}
+th, td {{ padding: 3px; border: 0.5px solid #999999; }}
+"""
+
+
+class MarkdownService:
+    """
+    Markdown to HTML and PDF.
+
+    Building a Markdown instance loads and wires up every extension, so each
+    thread keeps one and resets it between documents. The PDF stylesheet is
+    assembled once per page size, and warm_up() renders a throwaway PDF so
+    the first real one in a worker process doesn't pay for ReportLab's
+    imports and font setup. xhtml2pdf itself is only imported for PDFs, so
+    HTML rendering in the API never loads it.
+    """
+
+    def __init__(
+        self,
+        output_path: str = f"{settings.STORAGE_PATH}/downloads",
+        extensions: list = settings.MARKDOWN_EXTENSIONS,
+    ):
+        self.output_path = output_path
+        self.extensions = list(extensions)
+        self._local = threading.local()
+        self._stylesheets = {}
+
+    def _markdown(self) -> markdown.Markdown:
+        md = getattr(self._local, "md", None)
+        if md is None:
+            md = self._local.md = markdown.Markdown(extensions=self.extensions)
+        return md
+
+    def to_html(self, source: str) -> str:
+        md = self._markdown()
+        try:
+            return md.convert(source)
+        finally:
+            md.reset()
+
+    def stylesheet(self, page_size: str) -> str:
+        css = self._stylesheets.get(page_size)
+        if css is None:
+            default_css = require("xhtml2pdf.default", "PDF rendering").DEFAULT_CSS
+            css = self._stylesheets[page_size] = default_css + PDF_CSS.format(page_size=page_size)
+        return css
+
+    def cache_key(self, source: str, page_size: str) -> str:
+        """Result cache key of a PDF render: the source hash plus every option that changes the output"""
+        digest = hashlib.sha256(source.encode()).hexdigest()
+        return result_cache.make_key("render_markdown", digest, {"page_size": page_size, "extensions": self.extensions})
+
+    def _write_pdf(self, source: str, page_size: str, dest):
+        # xhtml2pdf pulls in ReportLab; only processes that render PDFs pay for it
+        pisa = require("xhtml2pdf.pisa", "PDF rendering")
+        status = pisa.CreatePDF(self.to_html(source), dest=dest, default_css=self.stylesheet(page_size))
+        if status.err:
+            raise Exception("PDF conversion failed")
+
+    def render_pdf(self, source: str, page_size: str = "A4") -> dict:
+        os.makedirs(self.output_path, exist_ok=True)
+        filename = f"md_{uuid.uuid4()}.pdf"
+        output_path = os.path.join(self.output_path, filename)
+        try:
+            with open(output_path, "w+b") as f:
+                self._write_pdf(source, page_size, f)
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+        return {
+            "status": "success",
+            "filename": filename,
+            "path": output_path,
+            "size": os.path.getsize(output_path),
+        }
+
+    def render_batch(self, documents: list, page_size: str = "A4", make_zip: bool = True, progress=None) -> dict:
+        """
+        Render many documents in one go. Each document is looked up in and
+        written to the result cache on its own, so repeats across batches
+        and single renders are shared.
+        """
+        batch_id = str(uuid.uuid4())
+        results = []
+        for index, document in enumerate(documents):
+            name = document.get("name") or f"document_{index + 1}"
+            key = self.cache_key(document["data"], page_size)
+            try:
+                cached = result_cache.get(key)
+                if cached is not None and cached.get("key"):
+                    # Rendered by another job, maybe on another worker: zip a local copy of the object
+                    results.append({**cached, "path": object_store.fetch(cached["key"]), "name": name, "cached": True})
+                else:
+                    # Published before it is cached, so the entry carries the key the cache checks on a hit
+                    result = publish_outputs(self.render_pdf(document["data"], page_size))
+                    result_cache.set(key, result)
+                    results.append({**result, "path": object_store.fetch(result["key"]), "name": name, "cached": False})
+            except Exception as e:
+                results.append({"status": "error", "name": name, "error": str(e)})
+            if progress:
+                progress({"done": index + 1, "total": len(documents)})
+
+        failed = sum(result["status"] != "success" for result in results)
+        batch_result = {
+            "status": "success" if failed < len(results) else "error",
+            "batch_id": batch_id,
+            "total": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "items": results,
+        }
+
+        if make_zip and failed < len(results):
+            zip_filename = f"markdown_{batch_id}.zip"
+            zip_path = os.path.join(self.output_path, zip_filename)
+            self._zip_outputs(results, zip_path)
+            batch_result.update({"filename": zip_filename, "path": zip_path})
+
+        return batch_result
+
+    def _zip_outputs(self, results: list, zip_path: str):
+        used_names = set()
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for outcome in results:
+                if outcome["status"] != "success":
+                    continue
+                stem = os.path.splitext(os.path.basename(outcome["name"]))[0] or "document"
+                name = f"{stem}.pdf"
+                counter = 1
+                while name in used_names:
+                    name = f"{stem}_{counter}.pdf"
+                    counter += 1
+                used_names.add(name)
+                archive.write(outcome["path"], arcname=name)
+
+    def warm_up(self):
+        for page_size in PAGE_SIZES:
+            self.stylesheet(page_size)
+        self._write_pdf("# Warm-up\n\nText, `code` and a table.\n\n| a | b |\n|---|---|\n| 1 | 2 |", "A4", io.BytesIO())
+
+
+markdown_service = MarkdownService()
@@ -1,36 +1,404 @@
+import contextvars
 import ffmpeg
 import os
+import glob
+import math
+import shutil
+import subprocess
+import threading
+import time
+import redis
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from core.config import settings
+from core.cache import probe_cache
+from core.metrics import metrics
+from core.operations import COMPRESS_METHODS, GIF_DITHERS, GIF_FORMATS
+from core.progress import throughput, file_size
+from core.queues import core_budget, queue_for
+
+SMART_CUT_VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265", "mpeg2video": "mpeg2video"}
+SMART_CUT_AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "ac3": "ac3", "mp2": "mp2", "opus": "libopus"}
+
+# What each target container can carry without re-encoding, and the encoders
+# used when a stream has to be transcoded. Containers without a "video" entry
+# are audio-only.
+CONTAINER_CODECS = {
+    "mp4": {"video": {"h264", "hevc", "mpeg4", "av1"}, "audio": {"aac", "mp3", "alac", "ac3", "eac3", "opus", "flac"},
+            "subtitle": {"mov_text"}, "vcodec": "libx264", "acodec": "aac"},
+    "mov": {"video": {"h264", "hevc", "mpeg4", "prores", "mjpeg"}, "audio": {"aac", "mp3", "alac", "pcm_s16le", "pcm_s24le"},
+            "subtitle": {"mov_text"}, "vcodec": "libx264", "acodec": "aac"},
+    "mkv": {"video": {"h264", "hevc", "mpeg4", "mpeg2video", "vp8", "vp9", "av1"},
+            "audio": {"aac", "mp3", "ac3", "eac3", "dts", "opus", "vorbis", "flac", "alac", "pcm_s16le"},
+            "subtitle": {"subrip", "ass", "webvtt"}, "vcodec": "libx264", "acodec": "aac"},
+    "webm": {"video": {"vp8", "vp9", "av1"}, "audio": {"opus", "vorbis"},
+             "subtitle": {"webvtt"}, "vcodec": "libvpx-vp9", "acodec": "libopus"},
+    "avi": {"video": {"mpeg4", "h264", "mjpeg"}, "audio": {"mp3", "ac3", "pcm_s16le"},
+            "vcodec": "mpeg4", "acodec": "libmp3lame"},
+    "m4a": {"audio": {"aac", "alac"}, "acodec": "aac"},
+    "mp3": {"audio": {"mp3"}, "acodec": "libmp3lame"},
+    "aac": {"audio": {"aac"}, "acodec": "aac"},
+    "ogg": {"audio": {"vorbis", "opus", "flac"}, "acodec": "libvorbis"},
+    "opus": {"audio": {"opus"}, "acodec": "libopus"},
+    "flac": {"audio": {"flac"}, "acodec": "flac"},
+    "wav": {"audio": {"pcm_s16le", "pcm_s24le", "pcm_f32le"}, "acodec": "pcm_s16le"},
+}
+
+# Keyframes closer than this to a cut point count as being on it
+CUT_TOLERANCE = 0.001
+
+def parse_timestamp(value) -> float:
+    """Seconds from 'HH:MM:SS.mmm', 'MM:SS' or a plain number"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_progress(report: dict, total_seconds: float = None) -> dict:
+    """Turn one ffmpeg -progress block into task progress"""
+    def number(key, cast=float):
+        try:
+            return cast(report.get(key, "").rstrip("x"))
+        except ValueError:
+            return None
+
+    out_time_us = number("out_time_us", int)
+    done = max(0.0, out_time_us / 1_000_000) if out_time_us is not None else None
+    progress = {
+        "frame": number("frame", int),
+        "fps": number("fps"),
+        "speed": number("speed"),
+        "done_seconds": round(done, 2) if done is not None else None,
+        "total_seconds": round(total_seconds, 2) if total_seconds else None,
+    }
+    if done is not None and total_seconds:
+        progress["percent"] = round(min(100.0, done / total_seconds * 100), 1)
+    return progress
+
+def step_progress(progress, phase: str, offset: float, total_seconds: float):
+    """
+    progress for one ffmpeg run of a job that takes several: the run's own
+    seconds are counted from offset, out of the whole job's total_seconds
+    """
+    if not progress:
+        return None
+
+    def report(run_progress: dict):
+        done = min(total_seconds, offset + (run_progress.get("done_seconds") or 0.0))
+        progress({
+            **run_progress,
+            "phase": phase,
+            "done_seconds": round(done, 2),
+            "total_seconds": round(total_seconds, 2),
+            "percent": round(done / total_seconds * 100, 1) if total_seconds else None,
+        })
+    return report
+
+def run_ffmpeg(stream, total_seconds: float = None, progress=None, phase: str = "transcode") -> dict:
+    """
+    ffmpeg.run with machine-readable progress: '-progress pipe:1' blocks are
+    parsed as they arrive and passed to progress(dict). Returns the last
+    block plus wall and CPU time. Raises ffmpeg.Error on failure, like ffmpeg.run.
+    Every ffmpeg the service starts goes through here, timed as phase of the
+    current task.
+    """
+    with metrics.phase(phase):
+        return _run_ffmpeg(stream, total_seconds, progress)
+
+def _run_ffmpeg(stream, total_seconds: float = None, progress=None) -> dict:
+    args = ffmpeg.compile(stream, overwrite_output=True)
+    args = [args[0], '-nostats', '-progress', 'pipe:1', *args[1:]]
+    started = time.monotonic()
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # Drain stderr on the side so a chatty ffmpeg can't block on a full pipe
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    report, last = {}, {}
+    try:
+        for line in process.stdout:
+            key, _, value = line.decode('utf8', 'replace').strip().partition('=')
+            report[key] = value
+            if key == 'progress':
+                last = parse_progress(report, total_seconds)
+                if progress:
+                    progress(last)
+                report = {}
+    except BaseException:
+        # e.g. the progress callback failed: don't leave ffmpeg encoding unattended
+        process.kill()
+        _, status, _ = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        process.stdout.close()
+        reader.join()
+        raise
+
+    # Reap with wait4 for the child's own rusage; RUSAGE_CHILDREN would mix in
+    # every other ffmpeg this process has running
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    reader.join()
+    elapsed = time.monotonic() - started
+    cpu = usage.ru_utime + usage.ru_stime
+    metrics.ffmpeg(elapsed, cpu)
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', b''.join(stderr))
+    return {**last, "elapsed": elapsed, "cpu_seconds": cpu}
+
+def plan_smart_cut(start: float, end: float, keyframes: list) -> list:
+    """
+    Split [start, end) into ('encode' | 'copy', start, end) pieces: the partial
+    GOPs at either boundary are re-encoded, the keyframe-aligned middle is copied.
+    """
+    first = next((k for k in keyframes if k >= start - CUT_TOLERANCE), None)
+    last = next((k for k in reversed(keyframes) if k <= end + CUT_TOLERANCE), None)
+    if first is None or last is None or last - first <= CUT_TOLERANCE:
+        return [("encode", start, end)]
+
+    pieces = []
+    if first - start > CUT_TOLERANCE:
+        pieces.append(("encode", start, first))
+    pieces.append(("copy", first, last))
+    if end - last > CUT_TOLERANCE:
+        pieces.append(("encode", last, end))
+    return pieces
+
+def write_concat_list(paths: list, list_path: str, spans: list = None) -> str:
+    """Write a concat demuxer playlist; spans are optional (inpoint, duration) pairs per file"""
+    with open(list_path, "w") as f:
+        for index, path in enumerate(paths):
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            if spans:
+                inpoint, duration = spans[index]
+                f.write(f"inpoint {inpoint:.6f}\nduration {duration:.6f}\n")
+    return list_path
+
+def gif_ladder(fps: int, width: int) -> list:
+    """(fps, width) rungs at or below the request, largest pixel rate first"""
+    widths, current = [], width
+    while current >= settings.GIF_MIN_WIDTH or not widths:
+        widths.append(current)
+        current = int(current * 0.85) // 2 * 2
+    rates = {fps}
+    for scale in (0.75, 0.5):
+        if round(fps * scale) >= settings.GIF_MIN_FPS:
+            rates.add(round(fps * scale))
+    return sorted(((f, w) for f in rates for w in widths), key=lambda rung: rung[0] * rung[1] ** 2, reverse=True)
+
+def fit_rate_curve(points: list) -> tuple:
+    """
+    Least-squares fit of ln(kbps) = a + b * crf through (crf, kbps) samples.
+    x264's bitrate falls roughly exponentially with CRF (about half per +6),
+    so a line in log space interpolates and extrapolates well.
+    """
+    points = [(crf, math.log(max(kbps, 1e-3))) for crf, kbps in points]
+    if len(points) == 1:
+        crf, log_kbps = points[0]
+        return log_kbps + crf * math.log(2) / 6, -math.log(2) / 6
+    mean_crf = sum(crf for crf, _ in points) / len(points)
+    mean_log = sum(log_kbps for _, log_kbps in points) / len(points)
+    spread = sum((crf - mean_crf) ** 2 for crf, _ in points)
+    slope = sum((crf - mean_crf) * (log_kbps - mean_log) for crf, log_kbps in points) / spread
+    # A flat or rising curve (static content) would make every CRF look free
+    slope = min(slope, -0.01)
+    return mean_log - slope * mean_crf, slope
+
+def rate_for_crf(curve: tuple, crf: float) -> float:
+    return math.exp(curve[0] + curve[1] * crf)
+
+def crf_for_rate(curve: tuple, kbps: float) -> float:
+    return (math.log(kbps) - curve[0]) / curve[1]
+
+def sample_spans(duration: float, count: int, length: float) -> list:
+    """(start, length) of count clips spread evenly over the video, or the whole video when it is short"""
+    if duration <= count * length * 2:
+        return [(0.0, duration)]
+    return [(duration * (index + 0.5) / count - length / 2, length) for index in range(count)]
+
+def downscale_ladder(width: int, height: int) -> list:
+    """Even (width, height) rungs below the source, down to COMPRESS_MIN_HEIGHT"""
+    rungs = []
+    for target in (1080, 720, 540, 480, 360, 240, 144):
+        if target < height and target >= min(settings.COMPRESS_MIN_HEIGHT, height):
+            rungs.append((round(width * target / height / 2) * 2, target))
+    return rungs
 
 class MediaService:
     def __init__(self, storage_path: str = settings.STORAGE_PATH):
         self.upload_path = f"{storage_path}/uploads"
         self.download_path = f"{storage_path}/downloads"
+        self.work_path = f"{storage_path}/work"
         os.makedirs(self.upload_path, exist_ok=True)
         os.makedirs(self.download_path, exist_ok=True)
+        os.makedirs(self.work_path, exist_ok=True)
+
+    def probe(self, input_path: str, digest: str = None) -> dict:
+        """ffprobe metadata, cached per content hash when digest is given"""
+        if digest:
+            try:
+                cached = probe_cache.get(digest)
+                metrics.cache_lookup("probe", cached is not None)
+                if cached is not None:
+                    return cached
+            except redis.RedisError:
+                digest = None
+
+        try:
+            with metrics.phase("probe"):
+                info = ffmpeg.probe(input_path)
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Probe failed: {error_message}")
 
-    def convert_file(self, input_path: str, target_format: str):
+        if digest:
+            try:
+                probe_cache.set(digest, info)
+            except redis.RedisError:
+                pass
+        return info
+
+    def duration(self, input_path: str, digest: str = None) -> float:
+        info = self.probe(input_path, digest)
+        if not any(stream.get("codec_type") == "video" for stream in info.get("streams", [])):
+            return 0.0
+        return float(info.get("format", {}).get("duration") or 0)
+
+    def convert_plan(self, info: dict, target_format: str):
+        """
+        Choose how to reach target_format from the probed source: 'copy' when
+        every kept stream fits the container as is, 'partial' when some do,
+        'transcode' when none do. Returns (strategy, stream indexes to keep,
+        output kwargs, per-stream actions), or None for targets outside
+        CONTAINER_CODECS.
+        """
+        container = CONTAINER_CODECS.get(target_format)
+        if container is None:
+            return None
+
+        streams = info.get("streams", [])
+        video = next((
+            stream for stream in streams
+            if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")
+        ), None)
+        audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+        subtitles = [
+            stream for stream in streams
+            if stream.get("codec_type") == "subtitle" and stream.get("codec_name") in container.get("subtitle", ())
+        ]
+        if "video" not in container:
+            video, subtitles = None, []
+        if video is None and audio is None:
+            return None
+
+        indexes, args, actions = [], {}, {}
+        if video is not None:
+            indexes.append(video["index"])
+            copy = video.get("codec_name") in container["video"]
+            args['c:v'] = 'copy' if copy else container["vcodec"]
+            if copy and video.get("codec_name") == "hevc" and target_format in ("mp4", "mov"):
+                # Apple players only accept HEVC tagged hvc1
+                args['tag:v'] = 'hvc1'
+            actions["video"] = "copy" if copy else container["vcodec"]
+        if audio is not None:
+            indexes.append(audio["index"])
+            copy = audio.get("codec_name") in container["audio"]
+            args['c:a'] = 'copy' if copy else container["acodec"]
+            actions["audio"] = "copy" if copy else container["acodec"]
+        if subtitles:
+            indexes.extend(stream["index"] for stream in subtitles)
+            args['c:s'] = 'copy'
+            actions["subtitle"] = "copy"
+
+        copied = [action == "copy" for action in actions.values()]
+        strategy = "copy" if all(copied) else "partial" if any(copied) else "transcode"
+        return strategy, indexes, args, actions
+
+    def convert_file(self, input_path: str, target_format: str, digest: str = None, progress=None):
+        """
+        Convert to target_format, stream-copying whatever the target container
+        can carry as is instead of decoding and re-encoding it.
+        """
         filename = os.path.basename(input_path)
         base_name = os.path.splitext(filename)[0]
+        target_format = target_format.lower()
         output_filename = f"{base_name}.{target_format}"
         output_path = os.path.join(self.download_path, output_filename)
 
+        info = self.probe(input_path, digest)
+        total = float(info.get("format", {}).get("duration") or 0)
+        plan = self.convert_plan(info, target_format)
+        strategy, actions, fallback = "transcode", {}, False
+        started = time.monotonic()
+
         try:
-            stream = ffmpeg.input(input_path)
-            stream = ffmpeg.output(stream, output_path)
-            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
-            
-            return {
+            if plan is not None:
+                strategy, indexes, args, actions = plan
+                try:
+                    source = ffmpeg.input(input_path)
+                    stream = ffmpeg.output(
+                        *[source[str(index)] for index in indexes], output_path, threads=core_budget(), **args
+                    )
+                    run = run_ffmpeg(stream, total, progress)
+                except ffmpeg.Error:
+                    if strategy == "transcode":
+                        raise
+                    # Some pairings the table allows are still refused by the
+                    # muxer (e.g. missing timestamps); re-encode instead
+                    plan, fallback = None, True
+
+            if plan is None:
+                strategy, actions = "transcode", {}
+                stream = ffmpeg.input(input_path)
+                stream = ffmpeg.output(stream, output_path, threads=core_budget())
+                run = run_ffmpeg(stream, total, progress)
+
+            result = {
                 "status": "success",
                 "original_file": filename,
                 "filename": output_filename,
-                "path": output_path
+                "path": output_path,
+                "strategy": strategy,
+                "streams": actions,
+                "stats": throughput(time.monotonic() - started, file_size(input_path), run.get("frame")),
             }
+            if fallback:
+                result["fallback"] = True
+            return result
         except ffmpeg.Error as e:
             error_message = e.stderr.decode('utf8') if e.stderr else str(e)
             raise Exception(f"Conversion failed: {error_message}")
 
-    def compress_video(self, input_path: str, crf: int = 28):
+    def parallel_mode(self, input_path: str) -> str:
+        """
+        Pick how to encode: 'sequential', 'local' (segments on this box) or
+        'distributed' (segments as Celery subtasks). Short clips aren't worth splitting.
+        """
+        mode = settings.PARALLEL_ENCODE_MODE
+        if mode == "off" or self.duration(input_path) < settings.PARALLEL_ENCODE_MIN_DURATION:
+            return "sequential"
+        return mode
+
+    def segment_workers(self, mode: str) -> int:
+        """
+        Encodes that can run at once, which sets how finely the video is split:
+        PARALLEL_ENCODE_WORKERS if set, else the task's cores for 'local' and
+        the cpu-video workers' concurrency for 'distributed'.
+        """
+        if settings.PARALLEL_ENCODE_WORKERS:
+            return settings.PARALLEL_ENCODE_WORKERS
+        if mode == "distributed":
+            return max(1, settings.QUEUE_CONCURRENCY.get(queue_for("encode_segment"), 1))
+        return core_budget()
+
+    def compress_video(self, input_path: str, crf: int = 28, mode: str = "sequential", progress=None):
+        """progress(dict) receives done/total seconds, percent and, for single encodes, fps and speed"""
+        if mode == "local":
+            return self.compress_video_parallel(input_path, crf, progress=progress)
+
         filename = os.path.basename(input_path)
         base_name, ext = os.path.splitext(filename)
         output_filename = f"{base_name}_compressed{ext}"
@@ -39,20 +407,342 @@ class MediaService:
         try:
             # CRF 28 is a good balance for compression
             stream = ffmpeg.input(input_path)
-            stream = ffmpeg.output(stream, output_path, vcodec='libx264', crf=crf)
-            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+            stream = ffmpeg.output(stream, output_path, vcodec='libx264', crf=crf, threads=core_budget())
+            run = run_ffmpeg(stream, self.duration(input_path), progress)
 
             return {
                 "status": "success",
                 "original_file": filename,
                 "filename": output_filename,
-                "path": output_path
+                "path": output_path,
+                "stats": throughput(run["elapsed"], file_size(input_path), run.get("frame")),
+            }
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Compression failed: {error_message}")
+
+    def split_video(self, input_path: str, workers: int):
+        """
+        Split the video stream at keyframes into about workers * PARALLEL_ENCODE_SEGMENTS_PER_WORKER
+        stream-copied segments. Returns (work_dir, [(segment_path, duration), ...]).
+        """
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        work_dir = os.path.join(self.work_path, base_name)
+        os.makedirs(work_dir, exist_ok=True)
+
+        total = self.duration(input_path)
+        segment_time = max(
+            settings.PARALLEL_ENCODE_MIN_SEGMENT,
+            total / (workers * settings.PARALLEL_ENCODE_SEGMENTS_PER_WORKER)
+        )
+
+        try:
+            stream = ffmpeg.input(input_path)
+            # The segment muxer only cuts on keyframes, so stream copy is exact
+            stream = ffmpeg.output(
+                stream, os.path.join(work_dir, "source_%05d.mkv"),
+                map='0:v:0', c='copy', f='segment',
+                segment_time=f"{segment_time:.3f}", reset_timestamps=1
+            )
+            run_ffmpeg(stream, phase="split")
+        except ffmpeg.Error as e:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Splitting failed: {error_message}")
+
+        segments = sorted(glob.glob(os.path.join(work_dir, "source_*.mkv")))
+        return work_dir, [(segment, self.duration(segment)) for segment in segments]
+
+    def encode_segment(self, segment_path: str, crf: int, threads: int = 0) -> str:
+        """Encode one segment with the same settings as every other segment"""
+        output_path = segment_path.replace("source_", "encoded_")
+        try:
+            stream = ffmpeg.input(segment_path)
+            stream = ffmpeg.output(stream, output_path, vcodec='libx264', crf=crf, threads=threads, an=None)
+            run_ffmpeg(stream, phase="encode")
+            return output_path
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Segment encoding failed: {error_message}")
+
+    def concat_segments(self, encoded_paths: list, input_path: str, work_dir: str):
+        """
+        Join encoded segments with the concat demuxer (no re-encode) and mux
+        the original audio back in.
+        """
+        filename = os.path.basename(input_path)
+        base_name, ext = os.path.splitext(filename)
+        output_filename = f"{base_name}_compressed{ext}"
+        output_path = os.path.join(self.download_path, output_filename)
+
+        list_path = write_concat_list(encoded_paths, os.path.join(work_dir, "segments.txt"))
+
+        try:
+            video = ffmpeg.input(list_path, f='concat', safe=0)
+            source = ffmpeg.input(input_path)
+            stream = ffmpeg.output(video['v'], source['a?'], output_path, vcodec='copy')
+            run_ffmpeg(stream, phase="concat")
+
+            return {
+                "status": "success",
+                "original_file": filename,
+                "filename": output_filename,
+                "path": output_path,
+                "segments": len(encoded_paths)
+            }
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Compression failed: {error_message}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def compress_video_parallel(self, input_path: str, crf: int = 28, workers: int = 0, progress=None):
+        """
+        Split at keyframes, encode the segments concurrently and concat them.
+        Each ffmpeg is its own process, so a thread per running encode is enough
+        to keep the task's cores busy; its core budget is split evenly between
+        the encoders.
+        progress(dict) is called as segments finish.
+        """
+        workers = workers or self.segment_workers("local")
+        started = time.monotonic()
+        work_dir, segments = self.split_video(input_path, workers)
+        workers = min(workers, len(segments)) or 1
+        threads = max(1, core_budget() // workers)
+
+        total = sum(duration for _, duration in segments)
+        done = 0.0
+        encoded = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    # Each encode runs in a copy of this context so it's counted against the task
+                    pool.submit(contextvars.copy_context().run, self.encode_segment, path, crf, threads): (path, duration)
+                    for path, duration in segments
+                }
+                for future in as_completed(futures):
+                    path, duration = futures[future]
+                    encoded[path] = future.result()
+                    done += duration
+                    if progress:
+                        progress({
+                            "done_seconds": round(done, 2),
+                            "total_seconds": round(total, 2),
+                            "percent": round(done / total * 100, 1) if total else None,
+                            "segments_done": len(encoded),
+                            "segments": len(segments),
+                        })
+        except Exception:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+        result = self.concat_segments([encoded[path] for path, _ in segments], input_path, work_dir)
+        result["stats"] = throughput(time.monotonic() - started, file_size(input_path))
+        return result
+
+    def compress_to_target(
+        self,
+        input_path: str,
+        target_bytes: int = None,
+        target_kbps: float = None,
+        method: str = "vbr",
+        allow_downscale: bool = False,
+        digest: str = None,
+        progress=None,
+    ):
+        """
+        Compress to a file size (target_bytes) or an overall bitrate (target_kbps)
+        in one go instead of guessing a CRF. A CRF -> bitrate curve measured on
+        short sample clips predicts the CRF that fits the budget; the encode is
+        then either a single CRF pass held under the budget by the VBV ('vbr')
+        or a two-pass ABR encode ('2pass'). With allow_downscale the resolution
+        drops when the budget would need a CRF past COMPRESS_MAX_CRF. An
+        encode that still overshoots is redone once at a lower rate.
+        The result carries the predicted and the achieved size.
+        """
+        if method not in COMPRESS_METHODS:
+            raise Exception(f"Compression failed: unsupported method '{method}'")
+
+        filename = os.path.basename(input_path)
+        base_name, ext = os.path.splitext(filename)
+        output_filename = f"{base_name}_compressed{ext}"
+        output_path = os.path.join(self.download_path, output_filename)
+
+        info = self.probe(input_path, digest)
+        streams = info.get("streams", [])
+        video = next((
+            stream for stream in streams
+            if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")
+        ), None)
+        has_audio = any(stream.get("codec_type") == "audio" for stream in streams)
+        duration = float(info.get("format", {}).get("duration") or 0)
+        if video is None or not duration:
+            raise Exception("Compression failed: no video stream")
+
+        total_kbps = target_kbps or target_bytes * 8 / 1000 / duration
+        # Audio gets at most a quarter of the budget
+        audio_kbps = 0
+        if has_audio:
+            audio_kbps = int(min(settings.COMPRESS_AUDIO_KBPS, max(settings.COMPRESS_MIN_AUDIO_KBPS, total_kbps / 4)))
+        # Container overhead is per packet: about 16 bytes per video frame and per AAC frame (~47/s)
+        frame_rate = video.get("avg_frame_rate") or "0/0"
+        numerator, _, denominator = frame_rate.partition("/")
+        fps = float(numerator) / float(denominator) if float(denominator or 0) else 30.0
+        overhead_kbps = (fps + (47 if has_audio else 0)) * 16 * 8 / 1000
+        # The rest of the headroom absorbs rate-control error
+        video_kbps = total_kbps * (1 - settings.COMPRESS_HEADROOM) - audio_kbps - overhead_kbps
+        if video_kbps < 16:
+            raise Exception(
+                f"Compression failed: {round(total_kbps)} kbps is too little for {round(duration, 1)} seconds of video"
+            )
+
+        started = time.monotonic()
+        work_dir = os.path.join(self.work_path, f"{base_name}_target")
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            plan = self._plan_target_rate(input_path, video, duration, video_kbps, allow_downscale, work_dir)
+
+            stream = ffmpeg.input(input_path)
+            video_stream = stream.video
+            if plan["scale"]:
+                video_stream = video_stream.filter('scale', *plan["scale"], flags='lanczos')
+            outputs = [video_stream, stream.audio] if has_audio else [video_stream]
+            audio_args = {'acodec': 'aac', 'b:a': f"{audio_kbps}k"} if has_audio else {'an': None}
+            limit = target_bytes or target_kbps * 1000 / 8 * duration
+            rate, crf = plan["video_kbps"], plan["crf"]
+            log_prefix = os.path.join(work_dir, "x264")
+
+            if method == "2pass":
+                first = ffmpeg.output(
+                    video_stream, os.devnull, vcodec='libx264', **{'b:v': f"{rate:.0f}k"},
+                    threads=core_budget(), f='null', an=None, **{'pass': 1, 'passlogfile': log_prefix}
+                )
+                run_ffmpeg(first, duration, progress and (lambda p: progress({**p, "pass": 1})), phase="analyze")
+
+            # One corrective re-encode if rate control overshoots; 2pass reuses the first-pass stats
+            for attempt in range(1, 3):
+                if method == "2pass":
+                    encode = ffmpeg.output(
+                        *outputs, output_path, vcodec='libx264', **{'b:v': f"{rate:.0f}k"},
+                        threads=core_budget(), **audio_args, **{'pass': 2, 'passlogfile': log_prefix}
+                    )
+                    run = run_ffmpeg(encode, duration, progress and (lambda p: progress({**p, "pass": 2})))
+                else:
+                    # CRF for the quality the budget buys; the VBV keeps peaks from running over it
+                    vbv = rate * settings.COMPRESS_MAXRATE_FACTOR
+                    encode = ffmpeg.output(
+                        *outputs, output_path, vcodec='libx264', crf=round(crf, 1),
+                        maxrate=f"{vbv:.0f}k", bufsize=f"{2 * vbv:.0f}k", threads=core_budget(), **audio_args
+                    )
+                    run = run_ffmpeg(encode, duration, progress)
+
+                size = os.path.getsize(output_path)
+                if size <= limit or attempt == 2:
+                    break
+                # Charge the whole overshoot, plus the headroom again, to the video rate
+                rate -= (size - limit) * 8 / 1000 / duration + rate * settings.COMPRESS_HEADROOM
+                crf = min(max(crf, crf_for_rate(plan["curve"], rate)), 51)
+
+            predicted = round((plan["video_kbps"] + audio_kbps + overhead_kbps) * 1000 / 8 * duration)
+            result = {
+                "status": "success",
+                "original_file": filename,
+                "filename": output_filename,
+                "path": output_path,
+                "method": method,
+                "crf": round(crf, 1),
+                "video_kbps": round(rate),
+                "audio_kbps": audio_kbps,
+                "width": plan["scale"][0] if plan["scale"] else video.get("width"),
+                "height": plan["scale"][1] if plan["scale"] else video.get("height"),
+                "downscaled": plan["scale"] is not None,
+                "samples": plan["samples"],
+                "attempts": attempt,
+                "predicted_bytes": predicted,
+                "size_bytes": size,
+                "prediction_error_percent": round((size - predicted) / predicted * 100, 1),
+                "stats": throughput(time.monotonic() - started, file_size(input_path), run.get("frame")),
             }
+            if target_bytes:
+                result["target_bytes"] = target_bytes
+            else:
+                result.update({"target_kbps": target_kbps, "achieved_kbps": round(size * 8 / 1000 / duration)})
+            result["target_met"] = size <= limit
+            return result
         except ffmpeg.Error as e:
             error_message = e.stderr.decode('utf8') if e.stderr else str(e)
             raise Exception(f"Compression failed: {error_message}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _sample_rates(self, input_path: str, duration: float, scale, work_dir: str) -> list:
+        """
+        Encode the sample clips once per COMPRESS_SAMPLE_CRFS in a single
+        ffmpeg (one decode, split to an encoder per CRF) and return the
+        (crf, video kbps) points. Raw H.264 output, so only the video
+        bitstream is counted.
+        """
+        spans = sample_spans(duration, settings.COMPRESS_SAMPLES, settings.COMPRESS_SAMPLE_SECONDS)
+        clips = [ffmpeg.input(input_path, ss=f"{start:.3f}", t=f"{length:.3f}").video for start, length in spans]
+        video = ffmpeg.concat(*clips, v=1, a=0) if len(clips) > 1 else clips[0]
+        if scale:
+            video = video.filter('scale', *scale, flags='lanczos')
+
+        crfs = settings.COMPRESS_SAMPLE_CRFS
+        split = video.split()
+        paths = [os.path.join(work_dir, f"sample_crf{crf}.h264") for crf in crfs]
+        # Encoders run side by side in one process, so each gets a share of the budget
+        threads = max(1, core_budget() // len(crfs))
+        outputs = [
+            ffmpeg.output(split[index], path, vcodec='libx264', crf=crf, f='h264', threads=threads)
+            for index, (crf, path) in enumerate(zip(crfs, paths))
+        ]
+        run_ffmpeg(ffmpeg.merge_outputs(*outputs), phase="sample")
+
+        seconds = sum(length for _, length in spans)
+        return [(crf, os.path.getsize(path) * 8 / 1000 / seconds) for crf, path in zip(crfs, paths)]
+
+    def _plan_target_rate(self, input_path: str, video: dict, duration: float, video_kbps: float,
+                          allow_downscale: bool, work_dir: str) -> dict:
+        """
+        CRF (and resolution) for a video bitrate budget. When even the budget
+        is more than COMPRESS_MIN_CRF needs, the rate drops to what that CRF
+        takes, so generous targets don't waste bytes.
+        """
+        width, height = video.get("width"), video.get("height")
+        points = self._sample_rates(input_path, duration, None, work_dir)
+        curve = fit_rate_curve(points)
+        crf = crf_for_rate(curve, video_kbps)
+        scale, rounds = None, 1
 
-    def cut_video(self, input_path: str, start_time: str, end_time: str):
+        if crf > settings.COMPRESS_MAX_CRF and allow_downscale and width and height:
+            ladder = downscale_ladder(width, height)
+            # Bitrate at a fixed CRF scales with about area^0.75; pick the largest rung that should fit
+            needed = rate_for_crf(curve, settings.COMPRESS_MAX_CRF)
+            scale = next(
+                (rung for rung in ladder if needed * (rung[0] * rung[1] / (width * height)) ** 0.75 <= video_kbps),
+                ladder[-1] if ladder else None,
+            )
+            if scale:
+                points = self._sample_rates(input_path, duration, scale, work_dir)
+                curve = fit_rate_curve(points)
+                crf = crf_for_rate(curve, video_kbps)
+                rounds = 2
+
+        crf = min(max(crf, settings.COMPRESS_MIN_CRF), 51)
+        return {
+            "crf": crf,
+            "curve": curve,
+            "scale": scale,
+            "video_kbps": min(video_kbps, rate_for_crf(curve, crf)),
+            "samples": {
+                "rounds": rounds,
+                "clips": len(sample_spans(duration, settings.COMPRESS_SAMPLES, settings.COMPRESS_SAMPLE_SECONDS)),
+                "curve": [{"crf": crf, "kbps": round(kbps, 1)} for crf, kbps in points],
+            },
+        }
+
+    def cut_video(self, input_path: str, start_time: str, end_time: str, progress=None):
         filename = os.path.basename(input_path)
         base_name, ext = os.path.splitext(filename)
         output_filename = f"{base_name}_cut{ext}"
@@ -61,39 +751,346 @@ class MediaService:
         try:
             stream = ffmpeg.input(input_path, ss=start_time, to=end_time)
             stream = ffmpeg.output(stream, output_path, c='copy') # Stream copy for speed
-            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+            run = run_ffmpeg(stream, parse_timestamp(end_time) - parse_timestamp(start_time), progress)
 
             return {
                 "status": "success",
                 "original_file": filename,
                 "filename": output_filename,
-                "path": output_path
+                "path": output_path,
+                "stats": throughput(run["elapsed"], file_size(output_path), run.get("frame")),
+            }
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Cutting failed: {error_message}")
+
+    def keyframes(self, input_path: str) -> list:
+        """Keyframe timestamps of the first video stream, read from packet flags without decoding"""
+        try:
+            info = ffmpeg.probe(input_path, select_streams='v:0', show_entries='packet=pts_time,flags')
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode('utf8') if e.stderr else str(e)
+            raise Exception(f"Probe failed: {error_message}")
+        return sorted(
+            float(packet["pts_time"]) for packet in info.get("packets", [])
+            if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A")
+        )
+
+    def smart_cut(self, input_path: str, ranges: list, join: bool = True, progress=None):
+        """
+        Frame-accurate cut of one or more (start, end) ranges.
+
+        Only the partial GOPs before the first and after the last keyframe of a
+        range are re-encoded, with the source codec settings; everything in
+        between is stream-copied. All copied spans are split out in a single
+        pass over the input. Pieces are staged as Matroska and joined with the
+        concat demuxer.
+        With join, all ranges go into one output; otherwise one output per range.
+        progress(dict) is called through the copy, encode and concat steps,
+        counted in seconds of media each step writes.
+        """
+        filename = os.path.basename(input_path)
+        base_name, ext = os.path.splitext(filename)
+        ranges = [(parse_timestamp(start), parse_timestamp(end)) for start, end in ranges]
+        for start, end in ranges:
+            if end <= start:
+                raise Exception(f"Cutting failed: range end {end} is not after start {start}")
+
+        info = ffmpeg.probe(input_path)
+        video = next((stream for stream in info["streams"] if stream.get("codec_type") == "video"), None)
+        audio = next((stream for stream in info["streams"] if stream.get("codec_type") == "audio"), None)
+        encode_args = self._matching_encode_args(video, audio)
+        # Without a matching encoder the copied and re-encoded pieces can't be joined,
+        # so every range is re-encoded in full instead
+        keyframes = self.keyframes(input_path) if encode_args else []
+        encode_args = encode_args or {'vcodec': 'libx264', 'acodec': 'aac'}
+
+        work_dir = os.path.join(self.work_path, f"{base_name}_cut")
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            plans = [plan_smart_cut(start, end, keyframes) for start, end in ranges]
+            # Keyframes the copied spans start or end on; copy_<n> holds boundaries[n] to boundaries[n + 1]
+            boundaries = sorted({time for plan in plans for kind, *span in plan if kind == "copy" for time in span})
+            pieces, encodes = [], []
+            for index, plan in enumerate(plans):
+                range_pieces = []
+                for kind, piece_start, piece_end in plan:
+                    if kind == "copy":
+                        range_pieces.extend(
+                            (os.path.join(work_dir, f"copy_{n:05d}.mkv"), boundaries[n + 1] - boundaries[n])
+                            for n in range(boundaries.index(piece_start), boundaries.index(piece_end))
+                        )
+                    else:
+                        path = os.path.join(work_dir, f"{index:03d}_{len(range_pieces)}_encode.mkv")
+                        encodes.append((path, piece_start, piece_end))
+                        # Its length is only known once encoded: a start between frames
+                        # keeps the frame shown at that moment
+                        range_pieces.append((path, None))
+                pieces.append(range_pieces)
+
+            copy_seconds = boundaries[-1] - boundaries[0] if boundaries else 0.0
+            encode_seconds = sum(piece_end - piece_start for _, piece_start, piece_end in encodes)
+            total = copy_seconds + encode_seconds + sum(end - start for start, end in ranges)
+            done = 0.0
+
+            if boundaries:
+                # Input-side seeking lands on the first keyframe, and the segment muxer
+                # only cuts on keyframes, so one stream-copy pass splits out every
+                # copied span exactly (output-side -ss/-to with copy drops packets
+                # around B-frames)
+                source = ffmpeg.input(input_path, ss=boundaries[0], to=boundaries[-1])
+                stream = ffmpeg.output(
+                    source['v:0'], source['a?'], os.path.join(work_dir, "copy_%05d.mkv"),
+                    c='copy', f='segment', reset_timestamps=1,
+                    segment_times=",".join(
+                        f"{boundary - boundaries[0] - CUT_TOLERANCE:.6f}" for boundary in boundaries[1:]
+                    ),
+                )
+                run_ffmpeg(stream, copy_seconds, step_progress(progress, "copy", done, total), phase="copy")
+                done += copy_seconds
+
+            for path, piece_start, piece_end in encodes:
+                # Input-side seek is frame accurate when decoding; -t would also keep
+                # a frame that starts exactly at piece_end, which belongs to the next piece
+                source = ffmpeg.input(input_path, ss=piece_start, t=round(piece_end - piece_start - CUT_TOLERANCE, 6))
+                stream = ffmpeg.output(source['v:0'], source['a?'], path, f='matroska', threads=core_budget(), **encode_args)
+                run_ffmpeg(stream, piece_end - piece_start, step_progress(progress, "encode", done, total), phase="encode")
+                done += piece_end - piece_start
+
+            groups = [sum(pieces, [])] if join else pieces
+            outputs = []
+            for index, group_pieces in enumerate(groups):
+                suffix = "_cut" if len(groups) == 1 else f"_cut{index + 1}"
+                output_filename = f"{base_name}{suffix}{ext}"
+                output_path = os.path.join(self.download_path, output_filename)
+                length = sum(end - start for start, end in ranges) if join else ranges[index][1] - ranges[index][0]
+                self._concat(group_pieces, output_path, work_dir, step_progress(progress, "concat", done, total), length)
+                done += length
+                outputs.append({"filename": output_filename, "path": output_path})
+
+            return {
+                "status": "success",
+                "original_file": filename,
+                "filename": outputs[0]["filename"],
+                "path": outputs[0]["path"],
+                "outputs": outputs,
+                "mode": "smart",
+                "reencoded_pieces": len(encodes),
+                "copied_pieces": sum(kind == "copy" for plan in plans for kind, *_ in plan)
             }
         except ffmpeg.Error as e:
             error_message = e.stderr.decode('utf8') if e.stderr else str(e)
             raise Exception(f"Cutting failed: {error_message}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _matching_encode_args(self, video: dict, audio: dict):
+        """Encoder settings that produce pieces joinable with the source's own streams"""
+        if not video or video.get("codec_name") not in SMART_CUT_VIDEO_ENCODERS:
+            return None
+        if audio and audio.get("codec_name") not in SMART_CUT_AUDIO_ENCODERS:
+            return None
+
+        args = {
+            'vcodec': SMART_CUT_VIDEO_ENCODERS[video["codec_name"]],
+            'pix_fmt': video.get("pix_fmt", "yuv420p"),
+        }
+        profile = (video.get("profile") or "").lower()
+        if video["codec_name"] == "h264" and profile in ("baseline", "main", "high"):
+            args['profile:v'] = profile
+        if audio:
+            args['acodec'] = SMART_CUT_AUDIO_ENCODERS[audio["codec_name"]]
+            if audio.get("sample_rate"):
+                args['ar'] = audio["sample_rate"]
+            if audio.get("channels"):
+                args['ac'] = audio["channels"]
+            if audio.get("bit_rate"):
+                args['b:a'] = audio["bit_rate"]
+        return args
+
+    def _concat(self, pieces: list, output_path: str, work_dir: str, progress=None, length: float = None):
+        """
+        Join (path, duration) pieces. Each piece enters at its first video frame
+        and lasts exactly its frames: copied pieces carry audio from just before
+        their keyframe and encoded ones AAC priming, which would otherwise
+        shift every piece after them.
+        """
+        paths = [path for path, _ in pieces]
+        spans = [self._piece_span(path, duration) for path, duration in pieces]
+        list_path = write_concat_list(paths, os.path.join(work_dir, f"{os.path.basename(output_path)}.txt"), spans)
+        stream = ffmpeg.input(list_path, f='concat', safe=0)
+        stream = ffmpeg.output(stream, output_path, c='copy')
+        run_ffmpeg(stream, length, progress, phase="concat")
+
+    def _piece_span(self, path: str, duration: float = None):
+        """(first video timestamp, duration) of a piece; the duration is read from its frames unless given"""
+        if duration is not None:
+            info = ffmpeg.probe(path, select_streams='v:0', show_entries='stream=start_time')
+            start = (info.get("streams") or [{}])[0].get("start_time")
+            return (float(start) if start not in (None, "N/A") else 0.0), duration
+        info = ffmpeg.probe(path, select_streams='v:0', show_entries='packet=pts_time,duration_time')
+        frames = [
+            (float(packet["pts_time"]), float(packet.get("duration_time") or 0))
+            for packet in info.get("packets", []) if packet.get("pts_time") not in (None, "N/A")
+        ]
+        start = min(pts for pts, _ in frames)
+        return start, max(pts + length for pts, length in frames) - start
+
+    def create_gif(
+        self,
+        input_path: str,
+        fps: int = 10,
+        width: int = 480,
+        start_time=None,
+        duration=None,
+        dither: str = "sierra2_4a",
+        max_bytes: int = None,
+        output_format: str = "gif",
+        progress=None,
+    ):
+        """
+        Animated clip in one decode pass. GIFs get a per-clip palette through a
+        split palettegen/paletteuse graph; 'webp' and 'mp4' are smaller
+        GIF-like alternatives. With max_bytes, fps/width are chosen from short
+        probe encodes instead of repeated full encodes.
+        """
+        output_format = output_format.lower()
+        if output_format not in GIF_FORMATS:
+            raise Exception(f"GIF creation failed: unsupported format '{output_format}'")
+        if dither not in GIF_DITHERS:
+            raise Exception(f"GIF creation failed: unsupported dither '{dither}'")
 
-    def create_gif(self, input_path: str, fps: int = 10, width: int = 480):
         filename = os.path.basename(input_path)
         base_name = os.path.splitext(filename)[0]
-        output_filename = f"{base_name}.gif"
+        output_filename = f"{base_name}.{output_format}"
         output_path = os.path.join(self.download_path, output_filename)
 
+        start = parse_timestamp(start_time) if start_time not in (None, "") else 0.0
+        length = parse_timestamp(duration) if duration not in (None, "") else None
+
+        started = time.monotonic()
+        frames = None
         try:
-            stream = ffmpeg.input(input_path)
-            stream = ffmpeg.filter(stream, 'fps', fps=fps)
-            stream = ffmpeg.filter(stream, 'scale', width=width, height=-1)
-            stream = ffmpeg.output(stream, output_path, loop=0)
-            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
+            plan = {"fps": fps, "width": width, "probes": 0, "predicted_bytes": None}
+            if max_bytes:
+                plan = self._plan_gif_size(input_path, fps, width, start, length, dither, output_format, max_bytes)
 
-            return {
+            if plan.get("probe_path"):
+                # The probe already covered the whole clip at the chosen settings
+                shutil.move(plan.pop("probe_path"), output_path)
+            else:
+                stream = self._gif_stream(input_path, output_path, plan["fps"], plan["width"], start, length, dither, output_format)
+                total = (length or max(0.0, self.duration(input_path) - start)) if progress else None
+                frames = run_ffmpeg(stream, total, progress).get("frame")
+
+            size = os.path.getsize(output_path)
+            result = {
                 "status": "success",
                 "original_file": filename,
                 "filename": output_filename,
-                "path": output_path
+                "path": output_path,
+                "format": output_format,
+                "fps": plan["fps"],
+                "width": plan["width"],
+                "size_bytes": size,
+                "stats": throughput(time.monotonic() - started, file_size(input_path), frames),
             }
+            if max_bytes:
+                result.update({
+                    "max_bytes": max_bytes,
+                    "predicted_bytes": plan["predicted_bytes"],
+                    "probes": plan["probes"],
+                    "target_met": size <= max_bytes,
+                })
+            return result
         except ffmpeg.Error as e:
             error_message = e.stderr.decode('utf8') if e.stderr else str(e)
             raise Exception(f"GIF creation failed: {error_message}")
 
+    def _gif_stream(self, input_path: str, output_path: str, fps: int, width: int, start: float, length, dither: str, output_format: str):
+        # Input-side seek/duration so only the requested span is decoded
+        input_args = {}
+        if start:
+            input_args['ss'] = f"{start:.3f}"
+        if length:
+            input_args['t'] = f"{length:.3f}"
+        video = ffmpeg.input(input_path, **input_args).video.filter('fps', fps=fps)
+
+        if output_format == "mp4":
+            # yuv420p needs even dimensions
+            video = video.filter('scale', width, -2, flags='lanczos')
+            return ffmpeg.output(
+                video, output_path, vcodec='libx264', pix_fmt='yuv420p', crf=28,
+                preset='veryfast', movflags='+faststart', threads=core_budget(), an=None
+            )
+
+        video = video.filter('scale', width, -1, flags='lanczos')
+        if output_format == "webp":
+            return ffmpeg.output(
+                video, output_path, vcodec='libwebp_anim', lossless=0, quality=70, loop=0,
+                threads=core_budget(), an=None
+            )
+
+        split = video.split()
+        # stats_mode=diff spends the palette on what moves, not the static background
+        palette = split[0].filter('palettegen', stats_mode='diff')
+        video = ffmpeg.filter([split[1], palette], 'paletteuse', dither=dither, diff_mode='rectangle')
+        return ffmpeg.output(video, output_path, loop=0, threads=core_budget())
+
+    def _plan_gif_size(self, input_path: str, fps: int, width: int, start: float, length, dither: str, output_format: str, max_bytes: int) -> dict:
+        """
+        Pick the largest fps/width rung predicted to fit max_bytes. Each probe
+        encodes GIF_PROBE_SECONDS from the middle of the clip; its byte rate is
+        scaled by pixel area and frame rate to predict the other rungs, and the
+        chosen rung is re-probed until the choice settles or probes run out.
+        """
+        source = self.duration(input_path)
+        if not source:
+            raise Exception("GIF creation failed: no video stream")
+        clip = max(0.0, source - start)
+        if length:
+            clip = min(clip, length)
+        probe_length = min(settings.GIF_PROBE_SECONDS, clip)
+        whole = probe_length >= clip
+        probe_start = start + (clip - probe_length) / 2
+
+        ladder = gif_ladder(fps, width)
+        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        probes = {}
+
+        def predict(rung, measured):
+            (probe_fps, probe_width), size = measured, probes[measured][1]
+            rate = size / probe_length if probe_length else 0
+            return rate * clip * (rung[1] / probe_width) ** 2 * (rung[0] / probe_fps)
+
+        def choose(measured):
+            for rung in ladder:
+                if predict(rung, measured) <= max_bytes:
+                    return rung
+            return ladder[-1]
+
+        rung = ladder[0]
+        try:
+            while rung not in probes and len(probes) < settings.GIF_MAX_PROBES:
+                probe_path = os.path.join(self.work_path, f"{base_name}_probe{len(probes)}.{output_format}")
+                stream = self._gif_stream(input_path, probe_path, rung[0], rung[1], probe_start, probe_length, dither, output_format)
+                run_ffmpeg(stream, phase="sample")
+                probes[rung] = (probe_path, os.path.getsize(probe_path))
+                measured = rung
+                rung = choose(measured)
+
+            plan = {
+                "fps": rung[0],
+                "width": rung[1],
+                "probes": len(probes),
+                "predicted_bytes": round(predict(rung, measured)),
+            }
+            if whole and rung in probes:
+                plan["probe_path"] = probes.pop(rung)[0]
+            return plan
+        finally:
+            for probe_path, _ in probes.values():
+                if os.path.exists(probe_path):
+                    os.remove(probe_path)
+
 media_service = MediaService()
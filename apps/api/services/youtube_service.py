@@ -1,42 +1,149 @@
 import yt_dlp
+import hashlib
+import json
 import os
+import shutil
+import time
+import redis
 from core.config import settings
+from core.metrics import metrics
+from core.progress import throughput
 import uuid
 
 class YouTubeService:
-    def __init__(self, download_path: str = f"{settings.STORAGE_PATH}/downloads"):
+    """
+    yt-dlp downloads.
+
+    Extracted metadata is cached in Redis per URL for YTDLP_INFO_TTL, so a
+    repeated URL skips the extractor's round-trips and goes straight to the
+    download. DASH/HLS fragments are fetched concurrently. Every job writes
+    to its own file name and temp dir, so concurrent jobs never collide.
+    """
+
+    def __init__(
+        self,
+        download_path: str = f"{settings.STORAGE_PATH}/downloads",
+        work_path: str = f"{settings.STORAGE_PATH}/work",
+        url: str = settings.REDIS_URL,
+    ):
         self.download_path = download_path
+        self.work_path = work_path
+        self.url = url
+        self._client = None
         os.makedirs(self.download_path, exist_ok=True)
 
-    def download_video(self, url: str, format: str = "mp4", quality: str = "best"):
-        task_id = str(uuid.uuid4())
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def _info_key(self, url: str) -> str:
+        return f"ytdlp:info:{hashlib.sha256(url.encode()).hexdigest()}"
+
+    def extract_info(self, ydl, url: str):
+        """Unprocessed extractor output for url, from cache when fresh. Returns (info, cached)"""
+        key = self._info_key(url)
+        try:
+            data = self.client.get(key)
+            metrics.cache_lookup("ytdlp_info", data is not None)
+            if data is not None:
+                return json.loads(data), True
+        except redis.RedisError:
+            pass
+
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False, process=False))
+        # Playlists and redirects resolve lazily and can't be stored as-is
+        if info.get("_type", "video") == "video":
+            try:
+                self.client.set(key, json.dumps(info), ex=settings.YTDLP_INFO_TTL)
+            except redis.RedisError:
+                pass
+        return info, False
+
+    def forget_info(self, url: str):
+        try:
+            self.client.delete(self._info_key(url))
+        except redis.RedisError:
+            pass
+
+    def download_video(self, url: str, format: str = "mp4", quality: str = "best", progress=None, job_id: str = None):
+        job_id = job_id or str(uuid.uuid4())
+        started = time.monotonic()
+        temp_dir = os.path.join(self.work_path, f"ytdlp_{job_id}")
+        # Separate video and audio downloads count towards one total
+        transfer = {"finished_bytes": 0, "current_bytes": 0, "files": 0}
+
+        def on_progress(d):
+            if d["status"] == "finished":
+                transfer["finished_bytes"] += d.get("downloaded_bytes") or d.get("total_bytes") or 0
+                transfer["current_bytes"] = 0
+                transfer["files"] += 1
+                return
+            if d["status"] != "downloading":
+                return
+            transfer["current_bytes"] = d.get("downloaded_bytes") or 0
+            if progress:
+                downloaded = d.get("downloaded_bytes") or 0
+                total = d.get("total_bytes") or d.get("total_bytes_estimate")
+                progress({
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": total,
+                    "percent": round(downloaded / total * 100, 1) if total else None,
+                    "speed_bytes": round(d["speed"]) if d.get("speed") else None,
+                    "eta_seconds": d.get("eta"),
+                    "file_index": transfer["files"] + 1,
+                })
         
         # Configure yt-dlp options
         ydl_opts = {
             'format': f'{quality}video+{quality}audio/best' if format == 'mp4' else 'bestaudio/best',
-            'outtmpl': f'{self.download_path}/%(title)s.%(ext)s',
+            # Job-scoped name and temp dir: same-titled downloads can run side by side
+            'paths': {'home': self.download_path, 'temp': temp_dir},
+            'outtmpl': f'%(title).80B [{job_id[:8]}].%(ext)s',
             'merge_output_format': format,
             'noplaylist': True,
             'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'concurrent_fragment_downloads': settings.YTDLP_CONCURRENT_FRAGMENTS,
+            'fragment_retries': 5,
+            'progress_hooks': [on_progress],
         }
 
         try:
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                
-                # If merged, update extension
-                if format == 'mp4' and not filename.endswith('.mp4'):
-                     base = os.path.splitext(filename)[0]
-                     filename = f"{base}.mp4"
+                info, cached = self.extract_info(ydl, url)
+                try:
+                    info = ydl.process_ie_result(info, download=True)
+                except yt_dlp.utils.DownloadError:
+                    if not cached:
+                        raise
+                    # Media URLs in cached metadata can expire; extract afresh
+                    self.forget_info(url)
+                    info, cached = self.extract_info(ydl, url)
+                    info = ydl.process_ie_result(info, download=True)
+
+                downloads = info.get('requested_downloads') or []
+                filename = downloads[0].get('filepath') if downloads else None
+                if not filename:
+                    filename = ydl.prepare_filename(info)
+                    # If merged, update extension
+                    if format == 'mp4' and not filename.endswith('.mp4'):
+                        base = os.path.splitext(filename)[0]
+                        filename = f"{base}.mp4"
 
                 return {
                     "status": "success",
                     "title": info.get('title', 'Unknown'),
                     "filename": os.path.basename(filename),
-                    "path": filename
+                    "path": filename,
+                    "info_cached": cached,
+                    "stats": throughput(time.monotonic() - started, transfer["finished_bytes"] + transfer["current_bytes"]),
                 }
         except Exception as e:
             raise Exception(f"Download failed: {str(e)}")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
 youtube_service = YouTubeService()
@@ -1,86 +1,337 @@
-from celery import Celery
+from celery import chord, group
+from celery.signals import worker_init, worker_process_init, worker_ready, worker_shutdown, task_prerun, task_postrun, task_success
+import time
 from core.config import settings
-from services.youtube_service import youtube_service
-from services.media_service import media_service
-from services.image_service import image_service
+from core.capabilities import capability_registry
+from core.cache import result_cache
+from core.dispatch import celery_app
+from core.metrics import metrics
+from core.profiler import SamplingProfiler, should_profile
+from core.progress import ProgressReporter
+from core.registry import LazyService
+from core.objects import object_store
+from core.storage import AREAS, storage_manager, artifact_keys, publish_outputs
+from core.queues import queue_for, apply_core_budget, core_budget, admission
 import os
+import shutil
 
-celery_app = Celery(
-    "worker",
-    broker=settings.CELERY_BROKER_URL,
-    backend=settings.CELERY_RESULT_BACKEND
-)
+# Loaded on first use, so each worker only imports what its queue's tasks need
+youtube_service = LazyService("download")
+media_service = LazyService("media")
+image_service = LazyService("image")
+background_service = LazyService("background")
+diff_service = LazyService("diff")
+markdown_service = LazyService("markdown")
 
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
-    timezone="UTC",
-    enable_utc=True,
+    # Long CPU jobs: don't let one process hoard queued work the others could start
+    worker_prefetch_multiplier=settings.WORKER_PREFETCH_MULTIPLIER,
+    beat_schedule={
+        "sweep-storage": {"task": "sweep_storage", "schedule": settings.STORAGE_SWEEP_INTERVAL},
+    },
 )
 
+# Queues this worker consumes, set before the pool forks
+_queues = set()
+
+@worker_init.connect
+def budget_cores(sender=None, **kwargs):
+    # Split the CPUs between the pool's processes before they fork
+    apply_core_budget(sender.concurrency)
+    _queues.update(sender.app.amqp.queues.consume_from)
+
+@worker_ready.connect
+def publish_capabilities(sender=None, **kwargs):
+    capability_registry.publish(sender.hostname, list(_queues))
+
+@worker_shutdown.connect
+def withdraw_capabilities(sender=None, **kwargs):
+    capability_registry.withdraw(sender.hostname)
+
+_started = {}
+_profilers = {}
+
+def _file_bytes(values) -> int:
+    """Total size of the stored objects among task arguments (keys, or batch items with a key)"""
+    total = 0
+    for value in values or []:
+        if isinstance(value, dict):
+            value = value.get("key")
+        if isinstance(value, list):
+            total += _file_bytes(value)
+        elif isinstance(value, str) and value.partition("/")[0] in AREAS:
+            total += object_store.size(value)
+    return total
+
+@task_prerun.connect
+def start_timer(task_id=None, task=None, args=None, **kwargs):
+    _started[task_id] = time.monotonic()
+    metrics.set_task(task.name)
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    if enqueued_at:
+        metrics.observe(
+            "task_queue_wait_seconds", max(0.0, time.time() - enqueued_at),
+            task=task.name, queue=queue_for(task.name, args)
+        )
+    metrics.inc("task_input_bytes_total", _file_bytes(args), task=task.name)
+    if should_profile(task.name):
+        _profilers[task_id] = SamplingProfiler().start()
+
+@task_postrun.connect
+def record_runtime(task_id=None, task=None, args=None, retval=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    if started is not None and task is not None:
+        elapsed = time.monotonic() - started
+        queue = queue_for(task.name, args)
+        # Feeds the per-queue wait estimate used for admission control
+        admission.record_runtime(queue, elapsed)
+        metrics.observe("task_run_seconds", elapsed, task=task.name, queue=queue, state=state or "UNKNOWN")
+        metrics.inc("task_output_bytes_total", _file_bytes(artifact_keys(retval)), task=task.name)
+
+    profiler = _profilers.pop(task_id, None)
+    if profiler is not None and profiler.stop() >= settings.PROFILE_MIN_SECONDS:
+        profiler.save(f"{task.name}_{task_id}")
+    metrics.set_task(None)
+    metrics.flush()
+
+def _serves(queue: str) -> bool:
+    return not _queues or queue in _queues
+
+@worker_process_init.connect
+def warm_up_models(**kwargs):
+    # Pay the model load once per worker process instead of on the first
+    # request, but only on workers whose queue gets those jobs
+    if settings.REMBG_PRELOAD and _serves(queue_for("process_image", ["", "remove_bg"])):
+        background_service.warm_up()
+    if settings.MARKDOWN_PRELOAD and _serves(queue_for("render_markdown")):
+        markdown_service.warm_up()
+
+@task_success.connect
+def register_outputs(sender=None, result=None, **kwargs):
+    # Every output gets an expiry so the sweeper can reclaim it
+    for key in artifact_keys(result):
+        storage_manager.register(key)
+
+@celery_app.task(name="sweep_storage")
+def sweep_storage_task():
+    return storage_manager.sweep()
+
+def _cache_result(cache_key: str, result: dict):
+    if cache_key:
+        result_cache.set(cache_key, result)
+
 @celery_app.task(name="download_youtube", bind=True)
-def download_youtube_task(self, url: str, format: str, quality: str):
+def download_youtube_task(self, url: str, format: str, quality: str, cache_key: str = None):
     self.update_state(state='PROCESSING', meta={'step': 'downloading'})
-    result = youtube_service.download_video(url, format, quality)
-    return result
+    try:
+        result = publish_outputs(youtube_service.download_video(
+            url, format, quality, progress=ProgressReporter(self, 'downloading'), job_id=self.request.id
+        ))
+        _cache_result(cache_key, result)
+        return result
+    finally:
+        if cache_key:
+            result_cache.release(cache_key)
 
 @celery_app.task(name="convert_media", bind=True)
-def convert_media_task(self, input_path: str, target_format: str):
+def convert_media_task(self, input_key: str, target_format: str, cache_key: str = None, digest: str = None):
     self.update_state(state='PROCESSING', meta={'step': 'converting'})
     try:
-        result = media_service.convert_file(input_path, target_format)
+        result = publish_outputs(media_service.convert_file(
+            object_store.fetch(input_key), target_format, digest=digest, progress=ProgressReporter(self, 'converting')
+        ))
+        _cache_result(cache_key, result)
         return result
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        if cache_key:
+            result_cache.release(cache_key)
+        object_store.delete(input_key)
 
 @celery_app.task(name="process_image", bind=True)
-def process_image_task(self, input_path: str, action: str, params: dict):
+def process_image_task(self, input_key: str, action: str, params: dict, operations: list = None, cache_key: str = None):
     self.update_state(state='PROCESSING', meta={'step': action})
     try:
-        result = image_service.process_image(input_path, action, params)
+        result = publish_outputs(image_service.process_image(object_store.fetch(input_key), action, params, operations))
+        _cache_result(cache_key, result)
         return result
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        if cache_key:
+            result_cache.release(cache_key)
+        object_store.delete(input_key)
+
+@celery_app.task(name="process_image_batch", bind=True)
+def process_image_batch_task(self, items: list, action: str, params: dict, make_zip: bool = False, operations: list = None):
+    total = len(items)
+    self.update_state(state='PROCESSING', meta={'step': action, 'progress': {'done': 0, 'total': total, 'failed': 0}})
+
+    def report(done, total, failed):
+        self.update_state(state='PROCESSING', meta={
+            'step': action,
+            'progress': {'done': done, 'total': total, 'failed': failed}
+        })
+
+    try:
+        files = [{"path": object_store.fetch(item["key"]), "filename": item["filename"]} for item in items]
+        return publish_outputs(image_service.process_batch(
+            files, action, params, operations, batch_id=self.request.id, make_zip=make_zip, progress=report
+        ))
+    finally:
+        for item in items:
+            object_store.delete(item["key"])
 
 @celery_app.task(name="ocr_image", bind=True)
-def ocr_image_task(self, input_path: str, lang: str):
+def ocr_image_task(self, input_key: str, lang: str, words: bool = False, cache_key: str = None):
     self.update_state(state='PROCESSING', meta={'step': 'ocr'})
     try:
-        result = image_service.extract_text(input_path, lang)
+        result = image_service.extract_text(object_store.fetch(input_key), lang, words)
+        _cache_result(cache_key, result)
         return result
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        if cache_key:
+            result_cache.release(cache_key)
+        object_store.delete(input_key)
 
 @celery_app.task(name="compress_media", bind=True)
-def compress_media_task(self, input_path: str, crf: int):
+def compress_media_task(self, input_key: str, crf: int, target: dict = None, cache_key: str = None, digest: str = None):
     self.update_state(state='PROCESSING', meta={'step': 'compressing'})
+    fanned_out = False
+
+    try:
+        input_path = object_store.fetch(input_key)
+        if target:
+            # Rate control needs the whole stream, so target sizes never fan out into segments
+            result = publish_outputs(media_service.compress_to_target(
+                input_path, target.get("bytes"), target.get("kbps"), target.get("method", "vbr"),
+                target.get("allow_downscale", False), digest=digest, progress=ProgressReporter(self, 'compressing')
+            ))
+            _cache_result(cache_key, result)
+            return result
+
+        mode = media_service.parallel_mode(input_path)
+        if mode == "distributed":
+            signature = _segment_chord(self.request.id, input_key, input_path, crf, cache_key)
+            # The chord now owns the input object and the cache claim
+            fanned_out = True
+            raise self.replace(signature)
+
+        result = publish_outputs(
+            media_service.compress_video(input_path, crf, mode=mode, progress=ProgressReporter(self, 'compressing'))
+        )
+        _cache_result(cache_key, result)
+        return result
+    finally:
+        if not fanned_out:
+            if cache_key:
+                result_cache.release(cache_key)
+            object_store.delete(input_key)
+
+def _segment_chord(parent_id: str, input_key: str, input_path: str, crf: int, cache_key: str):
+    work_dir, segments = media_service.split_video(input_path, media_service.segment_workers("distributed"))
+    total = sum(duration for _, duration in segments)
+    # Segments become objects so any video worker, on any host, can encode them
+    segment_keys = [(object_store.put(path), duration) for path, duration in segments]
+    header = group(
+        encode_segment_task.s(key, crf, duration, total, parent_id)
+        for key, duration in segment_keys
+    )
+    if not object_store.local:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return chord(header, concat_segments_task.s(input_key, cache_key))
+
+@celery_app.task(name="encode_segment", bind=True)
+def encode_segment_task(self, segment_key: str, crf: int, duration: float, total: float, parent_id: str):
+    encoded_path = media_service.encode_segment(object_store.fetch(segment_key), crf, core_budget())
+    encoded_key = object_store.put(encoded_path)
+    object_store.delete(segment_key)
+
+    # Aggregate progress across segments onto the parent task
+    key = f"segments:{parent_id}:done"
+    done = float(self.backend.client.incrbyfloat(key, duration))
+    self.backend.client.expire(key, 24 * 60 * 60)
+    self.backend.store_result(parent_id, {
+        'step': 'compressing',
+        'progress': {
+            'done_seconds': round(done, 2),
+            'total_seconds': round(total, 2),
+            'percent': round(done / total * 100, 1) if total else None,
+        }
+    }, 'PROCESSING')
+    return encoded_key
+
+@celery_app.task(name="concat_segments", bind=True)
+def concat_segments_task(self, encoded_keys: list, input_key: str, cache_key: str = None):
     try:
-        result = media_service.compress_video(input_path, crf)
+        encoded_paths = [object_store.fetch(key) for key in encoded_keys]
+        # The segments' directory, on the shared volume or in this worker's object cache
+        work_dir = os.path.dirname(encoded_paths[0])
+        result = publish_outputs(media_service.concat_segments(encoded_paths, object_store.fetch(input_key), work_dir))
+        _cache_result(cache_key, result)
         return result
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        for key in encoded_keys:
+            object_store.delete(key)
+        self.backend.client.delete(f"segments:{self.request.id}:done")
+        if cache_key:
+            result_cache.release(cache_key)
+        object_store.delete(input_key)
 
 @celery_app.task(name="cut_media", bind=True)
-def cut_media_task(self, input_path: str, start_time: str, end_time: str):
+def cut_media_task(self, input_key: str, start_time: str, end_time: str, mode: str = "fast",
+                   ranges: list = None, join: bool = True):
     self.update_state(state='PROCESSING', meta={'step': 'cutting'})
     try:
-        result = media_service.cut_video(input_path, start_time, end_time)
-        return result
+        input_path = object_store.fetch(input_key)
+        if mode == "smart":
+            result = media_service.smart_cut(
+                input_path, ranges or [(start_time, end_time)], join=join, progress=ProgressReporter(self, 'cutting')
+            )
+        else:
+            result = media_service.cut_video(input_path, start_time, end_time, progress=ProgressReporter(self, 'cutting'))
+        return publish_outputs(result)
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        object_store.delete(input_key)
 
 @celery_app.task(name="create_gif", bind=True)
-def create_gif_task(self, input_path: str, fps: int, width: int):
+def create_gif_task(
+    self, input_key: str, fps: int, width: int, start_time: str = None, duration: str = None,
+    dither: str = "sierra2_4a", max_bytes: int = None, output_format: str = "gif"
+):
     self.update_state(state='PROCESSING', meta={'step': 'creating_gif'})
     try:
-        result = media_service.create_gif(input_path, fps, width)
+        result = media_service.create_gif(
+            object_store.fetch(input_key), fps, width, start_time=start_time, duration=duration,
+            dither=dither, max_bytes=max_bytes, output_format=output_format,
+            progress=ProgressReporter(self, 'creating_gif')
+        )
+        return publish_outputs(result)
+    finally:
+        object_store.delete(input_key)
+
+@celery_app.task(name="diff_text", bind=True)
+def diff_text_task(self, key1: str, key2: str, format: str = "html", context: int = 3, word_diff: bool = True):
+    self.update_state(state='PROCESSING', meta={'step': 'diffing'})
+    try:
+        return publish_outputs(diff_service.diff_files(
+            object_store.fetch(key1), object_store.fetch(key2), format, context, words=word_diff
+        ))
+    finally:
+        for key in (key1, key2):
+            object_store.delete(key)
+
+@celery_app.task(name="render_markdown", bind=True)
+def render_markdown_task(self, source: str, page_size: str = "A4", cache_key: str = None):
+    self.update_state(state='PROCESSING', meta={'step': 'rendering_pdf'})
+    try:
+        result = publish_outputs(markdown_service.render_pdf(source, page_size))
+        _cache_result(cache_key, result)
         return result
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        if cache_key:
+            result_cache.release(cache_key)
+
+@celery_app.task(name="render_markdown_batch", bind=True)
+def render_markdown_batch_task(self, documents: list, page_size: str = "A4", make_zip: bool = True):
+    self.update_state(state='PROCESSING', meta={'step': 'rendering_pdf'})
+    return publish_outputs(markdown_service.render_batch(
+        documents, page_size, make_zip, progress=ProgressReporter(self, 'rendering_pdf')
+    ))
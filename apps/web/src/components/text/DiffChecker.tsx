@@ -2,9 +2,10 @@
 
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
+import { useTaskStatus } from "@/hooks/useTaskStatus";
 import { API_URL } from "@/lib/api";
 import { ArrowLeftRight, Loader2 } from "lucide-react";
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { toast } from "sonner";
 
 export function DiffChecker() {
@@ -12,9 +13,31 @@ export function DiffChecker() {
   const [text2, setText2] = useState("");
   const [diffHtml, setDiffHtml] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const [taskId, setTaskId] = useState<string | null>(null);
+
+  // Large inputs are diffed on a worker; its result is the diff as a file
+  const { status, data, error } = useTaskStatus(taskId);
+
+  useEffect(() => {
+    if (status === "SUCCESS" && data?.result?.filename) {
+      fetch(`${API_URL}/download/${data.result.filename}`)
+        .then((response) => response.text())
+        .then((html) => {
+          setDiffHtml(html);
+          toast.success("Comparison complete!");
+        })
+        .catch(() => toast.error("Could not load the diff"))
+        .finally(() => setIsLoading(false));
+    } else if (status === "FAILURE") {
+      toast.error(error || data?.error || "Diff failed");
+      setIsLoading(false);
+    }
+  }, [status, data, error]);
 
   const handleCompare = async () => {
     setIsLoading(true);
+    setTaskId(null);
+    setDiffHtml("");
     try {
       const response = await fetch(`${API_URL}/text/diff`, {
         method: "POST",
@@ -23,11 +46,16 @@ export function DiffChecker() {
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.detail || "Diff failed");
+      if (data.task_id) {
+        setTaskId(data.task_id);
+        toast.info("Large input, comparing in the background...");
+        return;
+      }
       setDiffHtml(data.data);
       toast.success("Comparison complete!");
+      setIsLoading(false);
     } catch (err: any) {
       toast.error(err.message);
-    } finally {
       setIsLoading(false);
     }
   };
@@ -115,8 +143,20 @@ export function DiffChecker() {
           white-space: nowrap;
           border-right: 1px solid #e2e8f0;
         }
-        .diff-container .diff_next {
-          display: none;
+        .diff-container .diff_hunk {
+          background-color: #f8fafc;
+          color: #64748b;
+        }
+        .diff-container del {
+          background-color: #fca5a5;
+          text-decoration: none;
+        }
+        .diff-container ins {
+          background-color: #86efac;
+          text-decoration: none;
+        }
+        .diff-container td:not(.diff_header) {
+          white-space: pre-wrap;
         }
         .diff-container .diff_add {
           background-color: #dcfce7;
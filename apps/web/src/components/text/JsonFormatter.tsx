@@ -12,6 +12,8 @@ export function JsonFormatter() {
   const [output, setOutput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [copied, setCopied] = useState(false);
+  const [sortKeys, setSortKeys] = useState(false);
+  const [minify, setMinify] = useState(false);
 
   const handleFormat = async () => {
     if (!input.trim()) return;
@@ -20,7 +22,7 @@ export function JsonFormatter() {
       const response = await fetch(`${API_URL}/text/json/format`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ data: input }),
+        body: JSON.stringify({ data: input, sort_keys: sortKeys, minify }),
       });
       const data = await response.json();
       if (!response.ok) throw new Error(data.detail || "Formatting failed");
@@ -55,6 +57,22 @@ export function JsonFormatter() {
             value={input}
             onChange={(e) => setInput(e.target.value)}
           />
+          <div className="flex gap-2 mt-4">
+            <Button
+              size="sm"
+              variant={sortKeys ? "default" : "outline"}
+              onClick={() => setSortKeys(!sortKeys)}
+            >
+              Sort keys
+            </Button>
+            <Button
+              size="sm"
+              variant={minify ? "default" : "outline"}
+              onClick={() => setMinify(!minify)}
+            >
+              Minify
+            </Button>
+          </div>
           <Button
             onClick={handleFormat}
             className="w-full mt-4"
@@ -2,9 +2,10 @@
 
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
+import { useTaskStatus } from "@/hooks/useTaskStatus";
 import { API_URL } from "@/lib/api";
 import { Download, Eye, Loader2, Pen } from "lucide-react";
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { toast } from "sonner";
 
 export function MarkdownTool() {
@@ -12,6 +13,23 @@ export function MarkdownTool() {
   const [htmlPreview, setHtmlPreview] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [mode, setMode] = useState<"edit" | "preview">("edit");
+  const [taskId, setTaskId] = useState<string | null>(null);
+
+  // PDFs are rendered by a worker; poll until the file is ready
+  const { status, data, error } = useTaskStatus(taskId);
+
+  useEffect(() => {
+    if (status === "SUCCESS" && data?.result?.filename) {
+      window.open(`${API_URL}/download/${data.result.filename}`, "_blank");
+      toast.success("PDF downloading...");
+      setTaskId(null);
+      setIsLoading(false);
+    } else if (status === "FAILURE") {
+      toast.error(error || data?.error || "PDF conversion failed");
+      setTaskId(null);
+      setIsLoading(false);
+    }
+  }, [status, data, error]);
 
   const handleConvert = async (target: "html" | "pdf") => {
     setIsLoading(true);
@@ -28,14 +46,13 @@ export function MarkdownTool() {
         setHtmlPreview(res.data);
         setMode("preview");
         toast.success("Preview generated!");
+        setIsLoading(false);
       } else {
-        const downloadUrl = `${API_URL}/download/${res.filename}`;
-        window.open(downloadUrl, "_blank");
-        toast.success("PDF downloading...");
+        setTaskId(res.task_id);
+        toast.info("Rendering PDF...");
       }
     } catch (err: any) {
       toast.error(err.message);
-    } finally {
       setIsLoading(false);
     }
   };
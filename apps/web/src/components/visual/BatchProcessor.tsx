@@ -26,11 +26,19 @@ interface TaskInfo {
   result?: TaskResult;
 }
 
+interface BatchProgress {
+  done: number;
+  total: number;
+  failed: number;
+}
+
 export function BatchProcessor() {
   const [files, setFiles] = useState<FileList | null>(null);
   const [format, setFormat] = useState("webp");
   const [isUploading, setIsUploading] = useState(false);
   const [tasks, setTasks] = useState<TaskInfo[]>([]);
+  const [progress, setProgress] = useState<BatchProgress | null>(null);
+  const [zipFilename, setZipFilename] = useState<string | null>(null);
 
   const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     if (e.target.files && e.target.files.length > 0) {
@@ -49,6 +57,7 @@ export function BatchProcessor() {
     }
     formData.append("action", "convert");
     formData.append("params", JSON.stringify({ format }));
+    formData.append("zip", "true");
 
     try {
       const response = await fetch(`${API_URL}/visual/batch-process`, {
@@ -59,16 +68,19 @@ export function BatchProcessor() {
       if (!response.ok) throw new Error("Batch upload failed");
 
       const data = await response.json();
-      const newTasks: TaskInfo[] = data.tasks.map((t: any) => ({
-        task_id: t.task_id,
-        filename: t.filename,
-        status: "PENDING",
-      }));
+      const newTasks: TaskInfo[] = data.files.map(
+        (filename: string, index: number) => ({
+          task_id: `${data.batch_id}-${index}`,
+          filename,
+          status: "PENDING",
+        }),
+      );
       setTasks(newTasks);
+      setProgress(null);
+      setZipFilename(null);
       toast.success(`Batch started for ${files.length} images!`);
 
-      // Monitor tasks
-      newTasks.forEach((t) => monitorTask(t.task_id));
+      monitorBatch(data.batch_id);
     } catch (err: unknown) {
       toast.error(err instanceof Error ? err.message : "Error");
     } finally {
@@ -76,22 +88,32 @@ export function BatchProcessor() {
     }
   };
 
-  const monitorTask = async (taskId: string) => {
+  const monitorBatch = async (batchId: string) => {
     const interval = setInterval(async () => {
       try {
-        const res = await fetch(`${API_URL}/tasks/${taskId}`);
+        const res = await fetch(`${API_URL}/tasks/${batchId}`);
         const data = await res.json();
 
-        setTasks((prev) =>
-          prev.map((t) =>
-            t.task_id === taskId
-              ? { ...t, status: data.status, result: data.result }
-              : t,
-          ),
-        );
-
-        if (data.status === "SUCCESS" || data.status === "FAILURE") {
+        if (data.progress) setProgress(data.progress);
+
+        if (data.status === "SUCCESS") {
+          const items: TaskResult[] = data.result.items;
+          setTasks((prev) =>
+            prev.map((t, index) => ({
+              ...t,
+              status: items[index]?.status === "success" ? "SUCCESS" : "FAILURE",
+              result: items[index],
+            })),
+          );
+          setZipFilename(data.result.filename ?? null);
           clearInterval(interval);
+        } else if (data.status === "FAILURE") {
+          setTasks((prev) => prev.map((t) => ({ ...t, status: "FAILURE" })));
+          clearInterval(interval);
+        } else {
+          setTasks((prev) =>
+            prev.map((t) => ({ ...t, status: data.status })),
+          );
         }
       } catch {
         clearInterval(interval);
@@ -160,6 +182,25 @@ export function BatchProcessor() {
           </Button>
         </div>
 
+        {progress && (
+          <div className="flex items-center justify-between text-sm text-muted-foreground">
+            <span>
+              {progress.done} / {progress.total} processed
+              {progress.failed > 0 && ` (${progress.failed} failed)`}
+            </span>
+            {zipFilename && (
+              <Button
+                size="sm"
+                variant="outline"
+                onClick={() => handleDownload(zipFilename)}
+              >
+                <Download className="w-4 h-4 mr-2" />
+                Download all
+              </Button>
+            )}
+          </div>
+        )}
+
         {tasks.length > 0 && (
           <div className="space-y-2 max-h-64 overflow-y-auto pt-4 border-t">
             {tasks.map((task) => (
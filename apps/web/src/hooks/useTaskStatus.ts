@@ -1,4 +1,4 @@
-import { apiClient } from "@/lib/api";
+import { API_URL, apiClient } from "@/lib/api";
 import { useEffect, useState } from "react";
 
 export type TaskStatus = "PENDING" | "PROCESSING" | "SUCCESS" | "FAILURE";
@@ -9,6 +9,7 @@ interface TaskResponse {
   result?: any;
   step?: string;
   error?: string;
+  progress?: any;
 }
 
 export function useTaskStatus(taskId: string | null) {
@@ -19,18 +20,20 @@ export function useTaskStatus(taskId: string | null) {
   useEffect(() => {
     if (!taskId) return;
 
-    // eslint-disable-next-line prefer-const
-    let intervalId: NodeJS.Timeout;
+    let intervalId: NodeJS.Timeout | undefined;
+    let source: EventSource | undefined;
+
+    const update = (response: TaskResponse) => {
+      setData(response);
+      const currentStatus = response.status.toUpperCase() as TaskStatus;
+      setStatus(currentStatus);
+      return currentStatus === "SUCCESS" || currentStatus === "FAILURE";
+    };
 
     const checkStatus = async () => {
       try {
         const response = await apiClient<TaskResponse>(`/tasks/${taskId}`);
-        setData(response);
-
-        const currentStatus = response.status.toUpperCase() as TaskStatus;
-        setStatus(currentStatus);
-
-        if (currentStatus === "SUCCESS" || currentStatus === "FAILURE") {
+        if (update(response)) {
           clearInterval(intervalId);
         }
       } catch (err) {
@@ -41,11 +44,33 @@ export function useTaskStatus(taskId: string | null) {
       }
     };
 
-    // Check immediately then poll
-    checkStatus();
-    intervalId = setInterval(checkStatus, 2000);
+    const poll = () => {
+      // Check immediately then poll
+      checkStatus();
+      intervalId = setInterval(checkStatus, 2000);
+    };
+
+    if (typeof EventSource === "undefined") {
+      poll();
+    } else {
+      // Updates are pushed as they happen; fall back to polling if the stream fails
+      source = new EventSource(`${API_URL}/tasks/events?ids=${taskId}`);
+      source.addEventListener("status", (event) => {
+        if (update(JSON.parse((event as MessageEvent).data))) {
+          source?.close();
+        }
+      });
+      source.addEventListener("done", () => source?.close());
+      source.onerror = () => {
+        source?.close();
+        if (!intervalId) poll();
+      };
+    }
 
-    return () => clearInterval(intervalId);
+    return () => {
+      source?.close();
+      clearInterval(intervalId);
+    };
   }, [taskId]);
 
   return { status, data, error };
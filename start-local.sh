@@ -32,7 +32,7 @@ API_PID=$!
 
 # 4. Start Celery Worker
 echo -e "${GREEN}Starting Celery Worker...${NC}"
-celery -A worker.celery_app worker --loglevel=info &
+celery -A worker.celery_app worker -B -Q io,cpu-video,cpu-image,ocr,ml --loglevel=info &
 WORKER_PID=$!
 
 # 5. Setup and Start Frontend